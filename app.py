@@ -1,50 +1,103 @@
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from flask import Flask, request, jsonify, send_from_directory, session
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
 from flask_cors import CORS
 import random
 import string
 import os
-from database_models import db, User, Product, Category, Cart, CartItem, Order, OrderItem, Payment
+from database_models import db, User, Product, Category, Cart, CartItem, Order, OrderItem, Payment, UploadBlob, ProductImage, PriceCampaign, db_config, init_db
 from datetime import datetime
-from rapid_reviews import get_reviews
-import mysql.connector
-import requests
-
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+import metrics
+import rate_limit
+import fanout
+import image_variants
+import upload_store
+import static_assets
+import image_proxy
+import lqip
+import recommendations
+import personalization
+import search_index
+import catalog
+import catalog_snapshot
+import campaigns
+import events
+
+UPLOAD_FOLDER = upload_store.UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+
+def get_reviews(asin):
+    # rapid_reviews brings in requests and the HTTP client; loaded on the first reviews call
+    from rapid_reviews import get_reviews as fetch
+    return fetch(asin)
+
+
 def generate_invoice_number():
     ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
     rnd = ''.join(random.choices(string.digits, k=4))
     return f'INV{ts}{rnd}'
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'super-secret-jwt-key')  # override with env in production
     jwt = JWTManager(app)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hotel.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(db_config())  # SQLALCHEMY_DATABASE_URI from DATABASE_URL, UPLOAD_FOLDER
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret')
-    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     # GST configuration (default 5%)
     app.config['GST_RATE'] = float(os.environ.get('GST_RATE', 0.05))
+    # seconds /api/products/<id>/full waits for each optional part before answering without it
+    app.config['DETAIL_REVIEWS_BUDGET'] = float(os.environ.get('DETAIL_REVIEWS_BUDGET', 0.8))
+    app.config['DETAIL_RELATED_BUDGET'] = float(os.environ.get('DETAIL_RELATED_BUDGET', 0.3))
+    # overrides for scripts, benchmarks and tests (e.g. a different database)
+    if config:
+        app.config.update(config)
 
-    db.init_app(app)
+    init_db(app)
 
     # Enable CORS for all routes (for development)
     CORS(app)
 
+    # Per-route latency / SQL / outbound HTTP metrics, served on /metrics
+    metrics.init_app(app)
+
+    # Per-IP / per-user token buckets on login, register and the reviews proxy (see rate_limit.py)
+    rate_limit.init_app(app)
+
     login_manager = LoginManager()
     login_manager.init_app(app)
 
+    # static files are served from memory, precompressed (see static_assets.py)
+    static_assets.store.preload()
+
+    # catalog version for ETags and change hooks (see catalog.py); before anything registers a hook
+    catalog.init_app(app)
+
+    # fuzzy product search index, built in a background thread on the first search, or now with
+    # SEARCH_INDEX_PRELOAD, so scripts and benchmarks that never search never read the whole table (see search_index.py)
+    if app.config.get('SEARCH_INDEX_PRELOAD', os.environ.get('SEARCH_INDEX_PRELOAD') == '1'):
+        search_index.start(app)
+    # creates, renames and deletes made by other workers reach this worker's index through the catalog version
+    catalog.on_change(lambda version, fields, local: local or search_index.searcher.catch_up(app, version),
+                      fields=('name',), app=app)
+
+    # columnar product snapshot for filtered / sorted listings, rebuilt on catalog changes (see catalog_snapshot.py)
+    if app.config.get('CATALOG_SNAPSHOT', True):
+        catalog_snapshot.start(app)
+
+    # view / click / add-to-cart events, buffered per worker and flushed to their own sqlite file (see events.py)
+    event_log = events.init_app(app)
+
+    # scheduled price campaigns start and end from a background poller (see campaigns.py)
+    if app.config.get('CAMPAIGN_SCHEDULER', True):
+        campaigns.start(app)
+
     # Serve index.html at root
     @app.route('/')
     def root():
-        with open('index.html', 'r', encoding='utf-8') as f:
-            return f.read()
+        return static_assets.respond(static_assets.store.get('index.html'), page=True)
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -111,12 +164,51 @@ def create_app():
         logout_user()
         return jsonify({'ok':True})
 
+    # Product dicts plus srcset-ready variants for uploaded images
+    def product_payload(items):
+        variants = image_variants.variants_for([i.image_url for i in items])
+        out = []
+        for i in items:
+            d = i.to_dict()
+            if i.image_url in variants:
+                d['image_variants'] = variants[i.image_url]
+            proxied = image_proxy.proxy_urls(i.id, i.image_url)
+            if proxied:
+                d['image_proxy'] = proxied
+            out.append(d)
+        return out
+
+    # Catalog responses carry a weak ETag of the catalog version: a client that already
+    # has the current one gets a 304 without the products being loaded
+    def not_modified(tag):
+        if request.if_none_match.contains_weak(tag):
+            resp = app.response_class(status=304)
+            resp.set_etag(tag, weak=True)
+            return resp
+        return None
+
+    def with_etag(resp, tag):
+        resp.set_etag(tag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
     # Product endpoints
     @app.route('/api/products', methods=['GET','POST'])
     def products_list_create():
         if request.method == 'GET':
+            user = optional_user()
+            if not user:
+                # the anonymous list depends only on the catalog
+                tag = catalog.etag('products')
+                cached = not_modified(tag)
+                if cached:
+                    return cached
+                return with_etag(jsonify(product_payload(Product.query.all())), tag)
             items = Product.query.all()
-            return jsonify([i.to_dict() for i in items])
+            cart = Cart.query.filter_by(user_id=user.id).first()
+            cart_ids = [pid for (pid,) in db.session.query(CartItem.product_id).filter_by(cart_id=cart.id)] if cart else []
+            items = personalization.rank(items, user.id, cart_ids)
+            return jsonify(product_payload(items))
         # create product (admin required)
         data = request.json or {}
         token = request.headers.get('Authorization','').replace('Bearer ','')
@@ -138,14 +230,23 @@ def create_app():
         item.image_url = data.get('image_url','')
         item.category_id = data.get('category_id')
         db.session.add(item)
-        db.session.commit()
+        db.session.flush()
+        upload_store.link_product(item)
+        catalog.bump(product_ids=[item.id])
+        lqip.schedule(app, item)  # image placeholder, computed in the background
+        personalization.refresh_product(item)
+        search_index.update(item)
         return jsonify(item.to_dict()), 201
 
     @app.route('/api/products/<int:item_id>', methods=['GET','PUT','DELETE'])
     def product_item(item_id):
-        item = Product.query.get_or_404(item_id)
         if request.method == 'GET':
-            return jsonify(item.to_dict())
+            tag = catalog.etag('product', item_id)
+            cached = not_modified(tag)
+            if cached:
+                return cached
+            return with_etag(jsonify(product_payload([Product.query.get_or_404(item_id)])[0]), tag)
+        item = Product.query.get_or_404(item_id)
         # admin-only for updates
         token = request.headers.get('Authorization','').replace('Bearer ','')
         try:
@@ -163,14 +264,150 @@ def create_app():
             item.description = data.get('description', item.description)
             item.price = float(data.get('price', item.price))
             item.stock = int(data.get('stock', item.stock))
+            old_image_url = item.image_url
             item.image_url = data.get('image_url', item.image_url)
             item.category_id = data.get('category_id', item.category_id)
-            db.session.commit()
+            upload_store.link_product(item, replace=item.image_url != old_image_url)
+            catalog.bump(set(data) & {'name', 'description', 'price', 'stock', 'image_url', 'category_id'}, product_ids=[item.id])
+            if item.image_url != old_image_url:
+                lqip.schedule(app, item)
+            personalization.refresh_product(item)
+            search_index.update(item)
             return jsonify(item.to_dict())
+        # the product's blobs become garbage for gc_uploads.py unless something else uses them
+        ProductImage.query.filter_by(product_id=item.id).delete()
         db.session.delete(item)
-        db.session.commit()
+        catalog.bump(product_ids=[item_id])
+        search_index.remove(item_id)
         return jsonify({'ok':True})
 
+    # Typo-tolerant search over product names
+    @app.route('/api/search', methods=['GET'])
+    def search_products():
+        q = (request.args.get('q') or '').strip()[:200]
+        limit = max(1, min(request.args.get('limit', 20, type=int) or 20, 100))
+        if not q:
+            return jsonify({'query': q, 'results': [], 'did_you_mean': None})
+        search_index.searcher.maybe_refresh(app)
+        found = search_index.searcher.search(q, limit)
+        if found is None:
+            # index still building: plain substring match meanwhile
+            items = Product.query.filter(Product.name.icontains(q, autoescape=True)).order_by(Product.id).limit(limit).all()
+            return jsonify({'query': q, 'results': product_payload(items), 'did_you_mean': None, 'index': 'building'})
+        ids = found['product_ids']
+        by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+        kept = [(by_id[pid], score) for pid, score in zip(ids, found['scores']) if pid in by_id]
+        results = product_payload([p for p, _ in kept])
+        for d, (_, score) in zip(results, kept):
+            d['score'] = score
+        return jsonify({'query': q, 'results': results, 'did_you_mean': found['did_you_mean']})
+
+    # Recommended products in score order (one IN query), each with its co-purchase count
+    def recommended_payload(scored):
+        items = {p.id: p for p in Product.query.filter(Product.id.in_([pid for pid, _ in scored])).all()} if scored else {}
+        kept = [(items[pid], n) for pid, n in scored if pid in items]
+        out = product_payload([p for p, _ in kept])
+        for d, (_, n) in zip(out, kept):
+            d['bought_together_count'] = n
+        return out
+
+    @app.route('/api/products/<int:item_id>/bought-together', methods=['GET'])
+    def bought_together(item_id):
+        k = min(request.args.get('k', 8, type=int) or 8, 50)
+        rec = recommendations.get_recommender()
+        rec.maybe_catch_up(app)
+        return jsonify(recommended_payload(rec.top([item_id], k)))
+
+    # Filtered, sorted, paginated listing. Served from the shared memory-mapped snapshot;
+    # only the page's rows are loaded from the database. Falls back to SQL until it is built.
+    def listing_args():
+        args = request.args
+        sort = args.get('sort', 'id')
+        if sort not in catalog_snapshot.SORTS:
+            raise ValueError(f'sort must be one of {", ".join(sorted(catalog_snapshot.SORTS))}')
+        categories = [int(c) for c in args.get('category_id', '').split(',') if c.strip()]
+        return {
+            'category_ids': categories or None,
+            'min_price': args.get('min_price', type=float),
+            'max_price': args.get('max_price', type=float),
+            'min_rating': args.get('min_rating', type=float),
+            'in_stock': args.get('in_stock') in ('1', 'true'),
+            'on_sale': args.get('on_sale') in ('1', 'true'),
+            'q': (args.get('q') or '').strip()[:100] or None,
+            'sort': sort,
+        }
+
+    def listing_from_db(f, offset, limit):
+        effective = db.func.coalesce(Product.discount_price, Product.price)
+        q = Product.query
+        if f['category_ids']:
+            q = q.filter(Product.category_id.in_(f['category_ids']))
+        if f['min_price'] is not None:
+            q = q.filter(effective >= f['min_price'])
+        if f['max_price'] is not None:
+            q = q.filter(effective <= f['max_price'])
+        if f['min_rating'] is not None:
+            q = q.filter(Product.rating >= f['min_rating'])
+        if f['in_stock']:
+            q = q.filter(Product.stock > 0)
+        if f['on_sale']:
+            q = q.filter(Product.discount_price.isnot(None))
+        if f['q']:
+            q = q.filter(Product.name.icontains(f['q'], autoescape=True))
+        column = {'id': Product.id, 'newest': Product.id, 'price': effective, 'rating': Product.rating,
+                  'name': db.func.lower(Product.name)}[f['sort'].lstrip('-')]
+        descending = f['sort'].startswith('-') or f['sort'] == 'newest'
+        order = [column.desc(), Product.id.desc()] if descending else [column, Product.id]
+        return q.count(), q.order_by(*order).offset(offset).limit(limit).all()
+
+    @app.route('/api/catalog', methods=['GET'])
+    def catalog_listing():
+        try:
+            f = listing_args()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        page = max(request.args.get('page', 1, type=int) or 1, 1)
+        per_page = min(max(request.args.get('per_page', 24, type=int) or 24, 1), 100)
+        offset = (page - 1) * per_page
+        snapshots = app.extensions.get('catalog_snapshot')  # None with CATALOG_SNAPSHOT off
+        found = snapshots.query(offset=offset, limit=per_page, **f) if snapshots else None
+        if found is None:
+            total, items = listing_from_db(f, offset, per_page)
+            source, version = 'db', None
+        else:
+            total, ids, version = found
+            by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+            items = [by_id[i] for i in ids if i in by_id]
+            source = 'snapshot'
+        return jsonify({'total': total, 'page': page, 'per_page': per_page, 'results': product_payload(items),
+                        'source': source, 'snapshot_version': version})
+
+    # Product detail in one round trip: the product plus its reviews and bought-together items,
+    # fetched concurrently. Parts that miss their budget (or find the upstream pool busy) are left out
+    # and listed in timed_out; the client can fetch them separately (a slow reviews call keeps
+    # filling the cache meanwhile).
+    @app.route('/api/products/<int:item_id>/full', methods=['GET'])
+    def product_full(item_id):
+        k = min(request.args.get('k', 8, type=int) or 8, 50)
+        fan = fanout.Fanout(app)
+
+        def related():
+            rec = recommendations.get_recommender()
+            rec.maybe_catch_up(app)
+            return recommended_payload(rec.top([item_id], k))
+        fan.submit('related', app.config['DETAIL_RELATED_BUDGET'], related)
+        item = Product.query.get_or_404(item_id)
+        if item.asin:
+            fan.submit('reviews', app.config['DETAIL_REVIEWS_BUDGET'], get_reviews, item.asin, pool='upstream')
+        product = product_payload([item])[0]
+        db.session.remove()  # give the connection back while waiting on the parts
+        parts, timed_out, errors = fan.collect()
+        out = {'product': product, 'reviews': parts.get('reviews'), 'related': parts.get('related'),
+               'timed_out': timed_out}
+        if errors:
+            out['errors'] = errors
+        return jsonify(out)
+
     # Categories
     @app.route('/api/categories', methods=['GET','POST'])
     def categories_list_create():
@@ -190,6 +427,29 @@ def create_app():
             return None
         return User.query.filter_by(email=identity).first()
 
+    # the user behind an optional bearer token; None when absent, invalid or expired
+    def optional_user():
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return None
+        return get_current_user()
+
+    # batched view / click / add-to-cart events from scripts.js. They only go into this worker's
+    # buffer here; its writer thread puts them in the events database (see events.py)
+    @app.route('/api/events', methods=['POST'])
+    def api_events():
+        data = request.get_json(force=True, silent=True)  # sendBeacon batches arrive as text/plain
+        if not isinstance(data, dict):
+            return jsonify({'error':'JSON object required'}), 400
+        user = optional_user() if 'Authorization' in request.headers else None
+        try:
+            rows, rejected = events.parse_batch(data, user.id if user else None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        event_log.add(rows)
+        return jsonify({'accepted': len(rows), 'rejected': rejected}), 202
+
     @app.route('/api/cart', methods=['GET'])
     @jwt_required()
     def get_cart():
@@ -268,6 +528,20 @@ def create_app():
             db.session.commit()
         return jsonify({'ok':True})
 
+    @app.route('/api/cart/recommendations', methods=['GET'])
+    @jwt_required()
+    def cart_recommendations():
+        user = get_current_user()
+        if not user: return jsonify({'error':'not found'}), 404
+        k = min(request.args.get('k', 8, type=int) or 8, 50)
+        cart = Cart.query.filter_by(user_id=user.id).first()
+        product_ids = [pid for (pid,) in db.session.query(CartItem.product_id).filter_by(cart_id=cart.id)] if cart else []
+        if not product_ids:
+            return jsonify([])
+        rec = recommendations.get_recommender()
+        rec.maybe_catch_up(app)
+        return jsonify(recommended_payload(rec.top(product_ids, k)))
+
     # Checkout: create order from cart
     @app.route('/api/checkout', methods=['POST'])
     @jwt_required()
@@ -305,7 +579,9 @@ def create_app():
         # create a payment record (pending)
         pay = Payment(order_id=order.id, payment_method=payment_method, payment_status='pending', amount=total)
         db.session.add(pay)
-        db.session.commit()
+        catalog.bump(('stock',), product_ids=[ci.product_id for ci in items])  # commits the order together with the stock change
+        recommendations.get_recommender().maybe_catch_up(app, force=True)  # add this order's pairs
+        personalization.schedule_user(app, user.id)
         return jsonify({'ok':True, 'order_id': order.id, 'invoice': order.invoice_number})
 
     # Orders
@@ -367,6 +643,51 @@ def create_app():
         db.session.commit()
         return jsonify(o.to_dict())
 
+    # Admin: set-based repricing / discount campaigns (see campaigns.py)
+    @app.route('/api/admin/reprice', methods=['POST'])
+    @jwt_required()
+    def admin_reprice():
+        user = get_current_user()
+        if not user or not user.is_admin: return jsonify({'error':'admin required'}), 403
+        data = request.json or {}
+        try:
+            if data.get('dry_run'):
+                return jsonify(campaigns.preview(data.get('target'), data.get('change')))
+            campaign = campaigns.create(data)
+        except (ValueError, TypeError) as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'campaign': campaign.to_dict(), 'catalog_version': catalog.version()}), 201
+
+    @app.route('/api/admin/campaigns', methods=['GET'])
+    @jwt_required()
+    def admin_campaigns():
+        user = get_current_user()
+        if not user or not user.is_admin: return jsonify({'error':'admin required'}), 403
+        q = PriceCampaign.query
+        if request.args.get('status'):
+            q = q.filter_by(status=request.args['status'])
+        return jsonify([c.to_dict() for c in q.order_by(PriceCampaign.id.desc()).limit(200)])
+
+    @app.route('/api/admin/campaigns/<int:campaign_id>/end', methods=['POST'])
+    @jwt_required()
+    def admin_end_campaign(campaign_id):
+        user = get_current_user()
+        if not user or not user.is_admin: return jsonify({'error':'admin required'}), 403
+        campaign = PriceCampaign.query.get_or_404(campaign_id)
+        restored = campaigns.end(campaign.id)
+        if restored is None:
+            return jsonify({'error': f'campaign is {campaign.status}'}), 409
+        db.session.refresh(campaign)
+        return jsonify({'campaign': campaign.to_dict(), 'restored': restored})
+
+    @app.route('/api/admin/events/stats', methods=['GET'])
+    @jwt_required()
+    def admin_event_stats():
+        user = get_current_user()
+        if not user or not user.is_admin: return jsonify({'error':'admin required'}), 403
+        return jsonify({'worker': event_log.stats(), 'store': events.table_stats(event_log.path)})
+
     # Printable invoice page (HTML)
     @app.route('/invoice/<int:order_id>')
     @jwt_required()
@@ -426,15 +747,71 @@ def create_app():
         f = request.files['image']
         if not f.filename:
             return jsonify({'error':'no filename'}), 400
-        filename = secure_filename(f.filename)
-        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        f.save(path)
-        return jsonify({'url':f'/uploads/{filename}'})
+        # stored under its SHA-256, so re-uploading the same bytes reuses the existing blob
+        try:
+            digest, ext, size, is_new = upload_store.save(f.stream, f.filename, app.config['UPLOAD_FOLDER'])
+        except ValueError as e:
+            return jsonify({'error':str(e)}), 400
+        url = upload_store.blob_url(digest, ext)
+        if UploadBlob.query.get(digest) is None:
+            db.session.add(UploadBlob(hash=digest, ext=ext, size=size, content_type=f.mimetype))
+        product_id = request.form.get('product_id', type=int)
+        product = Product.query.get(product_id) if product_id else None
+        if product and not ProductImage.query.filter_by(product_id=product_id, blob_hash=digest).first():
+            db.session.add(ProductImage(product_id=product_id, blob_hash=digest))
+        db.session.commit()
+        if product and product.image_url == url:
+            lqip.schedule(app, product)
+        if not is_new:
+            return jsonify({'url':url, 'hash':digest, 'deduplicated':True})
+        # thumbnails and WebP/AVIF variants are produced off the request thread
+        image_variants.schedule(app, url, upload_store.blob_path(digest, ext))
+        return jsonify({'url':url, 'hash':digest, 'variants':'pending'})
+
+    # srcset data for an uploaded image (empty until its variants are ready)
+    @app.route('/api/images/variants', methods=['GET'])
+    def image_variants_for():
+        url = request.args.get('url', '')
+        data = image_variants.variants_for([url]).get(url)
+        if not data:
+            return jsonify({'ok': False, 'url': url, 'pending': True}), 404
+        return jsonify({'ok': True, 'url': url, **data})
 
     # serve uploads
     @app.route('/uploads/<path:filename>')
     def serve_uploads(filename):
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        etag = upload_store.immutable_etag(filename)
+        if etag is None:
+            # legacy name-based uploads can be overwritten, so they stay revalidated
+            return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        resp = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=31536000, etag=etag)
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+        return resp
+
+    # resized copies of external product images (see image_proxy.py)
+    @app.route('/img/<size>/<int:product_id>')
+    def proxy_image(size, product_id):
+        if size not in image_proxy.PRESETS:
+            return jsonify({'error':'unknown size', 'sizes':list(image_proxy.PRESETS)}), 404
+        item = Product.query.get_or_404(product_id)
+        if not image_proxy.is_external(item.image_url):
+            return jsonify({'error':'product has no external image'}), 404
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+        try:
+            data, etag = image_proxy.get_resized(item.image_url, size, fmt)
+        except Exception as e:
+            return jsonify({'error':f'could not fetch image: {e}'}), 502
+        resp = app.response_class(data, mimetype=f'image/{fmt}')
+        resp.set_etag(etag)
+        resp.vary.add('Accept')
+        resp.cache_control.public = True
+        if request.args.get('v') == image_proxy.version(item.image_url):
+            resp.cache_control.max_age = image_proxy.IMMUTABLE_MAX_AGE
+            resp.cache_control.immutable = True
+        else:
+            resp.cache_control.max_age = image_proxy.MAX_AGE
+        return resp.make_conditional(request)
 
     # Serve static files (HTML, JS, CSS) from project root
     @app.route('/<path:filename>')
@@ -445,23 +822,22 @@ def create_app():
         # Don't serve index.html here - it should go through the root route
         if filename == 'index.html':
             return "Not Found", 404
-        # Only serve files with allowed extensions for security
-        allowed_ext = ('.html', '.js', '.css', '.png', '.jpg', '.jpeg', '.avif', '.gif', '.webp', '.mp3', '.wav', '.ogg')
-        if not filename.lower().endswith(allowed_ext):
+        asset, immutable = static_assets.store.resolve(filename)
+        if asset is not None:
+            response = static_assets.respond(asset, immutable=immutable, page=filename.lower().endswith('.html'))
+        elif filename.lower().endswith(static_assets.ALLOWED_EXT) and static_assets.top_level(filename) is None:
+            # files in subdirectories are streamed from disk, not kept in memory
+            try:
+                response = send_from_directory(static_assets.ROOT, filename, max_age=static_assets.MAX_AGE)
+            except NotFound:
+                return "Not Found", 404
+        else:
             return "Not Found", 404
-        
-        # Try to serve the file
-        try:
-            response = send_from_directory('.', filename)
-            # Add CORS headers explicitly
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            # Cache static files for 1 hour
-            response.headers['Cache-Control'] = 'public, max-age=3600'
-            return response
-        except Exception as e:
-            return f"Error serving {filename}: {str(e)}", 404
+        # Add CORS headers explicitly
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
 
     # Touch file to trigger reload when static assets change
     return app
@@ -6,6 +6,7 @@ Defaults to Unsplash source. Safe dry-run option to preview before committing.
 Usage:
   python assign_images_by_keyword.py --dry-run --limit 50 --service unsplash
   python assign_images_by_keyword.py --apply --service loremflickr
+  python assign_images_by_keyword.py --apply --chunk 5000   # resumes after an interruption
 
 Services supported:
  - unsplash: https://source.unsplash.com/600x450/?<keywords>
@@ -13,19 +14,12 @@ Services supported:
 """
 import argparse
 import re
-from app import create_app
-from database_models import db, Product, Category
+from functools import partial
+from database_models import create_db_app
+import maintenance
 
 STOPWORDS = set(["and","or","the","with","for","in","on","of","a","an","&"]) 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--dry-run', action='store_true')
-parser.add_argument('--apply', action='store_true')
-parser.add_argument('--limit', type=int, default=0, help='Limit number of products to process (0 = all)')
-parser.add_argument('--service', choices=['unsplash','loremflickr'], default='unsplash')
-args = parser.parse_args()
-
-app = create_app()
 
 def keywords_from_name(name, category_name=None):
     # normalize and split, keep alphanumeric tokens
@@ -42,43 +36,28 @@ def keywords_from_name(name, category_name=None):
         keys = ['product']
     return keys
 
-with app.app_context():
-    query = Product.query.order_by(Product.id)
-    total = query.count()
-    limit = args.limit or total
-    print(f'Total products in DB: {total} — will process up to {limit}')
-
-    processed = 0
-    changed = 0
-    for p in query.limit(limit).all():
-        cat = None
-        if p.category_id:
-            c = Category.query.get(p.category_id)
-            cat = c.name if c else None
-        keys = keywords_from_name(p.name, cat)
-        if args.service == 'unsplash':
-            q = ','.join(keys)
-            new_url = f'https://source.unsplash.com/600x450/?{q}'
-        else:
-            # loremflickr supports single tag; use first keyword
-            tag = keys[0].replace(' ', '%20')
-            new_url = f'https://loremflickr.com/600/450/{tag}'
-
-        processed += 1
-        if p.image_url != new_url:
-            print(f'[#{p.id}] {p.name} -> {new_url}')
-            if args.apply:
-                p.image_url = new_url
-                db.session.add(p)
-                changed += 1
-        else:
-            if processed % 50 == 0:
-                print(f'[{processed}] No change for id={p.id}')
-
-    if args.apply:
-        db.session.commit()
-        print(f'Applied changes: {changed} products updated')
-    else:
-        print(f'Dry-run complete: {processed} processed, {changed} would be changed')
 
-print('Done')
+def keyword_url(row, categories, service='unsplash'):
+    keys = keywords_from_name(row.name, categories.get(row.category_id))
+    if service == 'unsplash':
+        q = ','.join(keys)
+        return {'image_url': f'https://source.unsplash.com/600x450/?{q}'}
+    # loremflickr supports single tag; use first keyword
+    tag = keys[0].replace(' ', '%20')
+    return {'image_url': f'https://loremflickr.com/600/450/{tag}'}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--apply', action='store_true')
+    parser.add_argument('--service', choices=['unsplash','loremflickr'], default='unsplash')
+    maintenance.add_arguments(parser)
+    args = parser.parse_args()
+
+    app = create_db_app()
+    with app.app_context():
+        maintenance.run(f'assign_images_by_keyword-{args.service}', partial(keyword_url, service=args.service),
+                        ('name', 'category_id', 'image_url'), chunk=args.chunk, limit=args.limit,
+                        dry_run=not args.apply, restart=args.restart)
+    print('Done')
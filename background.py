@@ -0,0 +1,29 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared pool for work that must not hold a request worker (cache refreshes etc.)
+_MAX_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 4))
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix='background')
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the shared background pool.
+    Exceptions are swallowed (and printed) so a failed task never surfaces in a request.
+    """
+    def run():
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print(f'background task {getattr(fn, "__name__", fn)} failed: {e}')
+    return _get_executor().submit(run)
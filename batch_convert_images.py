@@ -3,88 +3,184 @@
 Usage:
   Set environment variable RAPIDAPI_KEY to your RapidAPI key first.
   Then run: python batch_convert_images.py --limit 1000
+  Concurrent: python batch_convert_images.py --workers 8 --max-rate 20 --apply
 
-This script loads the Flask app context from `app.create_app()` and updates
+This script loads the Flask app context from `create_db_app()` and updates
 `Product.image_url` when a converted URL is returned by the API.
 
-Note: The script will sleep between requests to avoid hitting rate limits.
+Note: API calls go through a shared rate limiter. It starts at one call per
+--delay seconds. With --max-rate it speeds up while the API keeps answering,
+up to that many calls per second; without it, it stays at the --delay rate.
+It halves its rate and waits out Retry-After whenever the
+API answers 429. Results are cached on disk (see rapid_image.py), so URLs
+converted by an earlier run are skipped without an API call or a wait.
+Updates are applied with one bulk statement per --chunk products.
 """
 import os
 import time
 import argparse
-from app import create_app
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database_models import create_db_app
 from database_models import db, Product
-from rapid_image import convert_image_url
+from rapid_image import cache_stats, cached_result, convert_image_url, mark_converted
+from rate_limit import AdaptiveRateLimiter, parse_retry_after
 
+MAX_ATTEMPTS = 4  # per product, counting retries after a 429
 
-def main(limit=None, delay=0.5, dry_run=True):
-    app = create_app()
+
+def find_url(obj):
+    if isinstance(obj, str) and obj.startswith('http'):
+        return obj
+    if isinstance(obj, dict):
+        for vv in obj.values():
+            r = find_url(vv)
+            if r: return r
+    if isinstance(obj, list):
+        for item in obj:
+            r = find_url(item)
+            if r: return r
+    return None
+
+
+def extract_url(data):
+    """Heuristic: look for a URL in top-level keys or nested 'url' fields"""
+    if isinstance(data, str) and data.startswith('http'):
+        return data
+    if isinstance(data, dict):
+        # common places to find returned URL
+        for k in ('url','converted_url','data','result'):
+            v = data.get(k)
+            if isinstance(v, str) and v.startswith('http'):
+                return v
+        # try deeper search
+        return find_url(data)
+    return None
+
+
+def convert(src, limiter):
+    """Convert one URL, waiting on the shared limiter only when the API is actually called."""
+    cached = cached_result(src)
+    if cached is not None:
+        return {'ok': True, 'from_cache': True, 'result': cached}
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.acquire()
+        res = convert_image_url(src, use_cache=False)
+        if res.get('status') == 429:
+            limiter.throttled(parse_retry_after(res.get('retry_after')))
+            continue
+        if res.get('ok'):
+            limiter.success()
+        return res
+    return res
+
+
+class Progress:
+    def __init__(self, total, every=5.0):
+        self.total = total
+        self.done = 0
+        self.every = every
+        self.started = self.last = time.time()
+        self.lock = threading.Lock()
+
+    def tick(self, limiter):
+        with self.lock:
+            self.done += 1
+            now = time.time()
+            if now - self.last >= self.every or self.done == self.total:
+                self.last = now
+                rate = self.done / max(now - self.started, 1e-6)
+                print(f"progress: {self.done}/{self.total} products, {rate:.1f} products/s, "
+                      f"API rate limit {limiter.rate:.2f}/s")
+
+
+def main(limit=None, delay=0.5, dry_run=True, workers=1, max_rate=None, chunk=500):
+    app = create_db_app()
     with app.app_context():
-        query = Product.query.order_by(Product.id.asc())
+        query = Product.query.with_entities(Product.id, Product.image_url).order_by(Product.id.asc())
         if limit:
             query = query.limit(limit)
         products = query.all()
         print(f"Found {len(products)} products to process")
-        updated = 0
-        for idx, p in enumerate(products, start=1):
+        start_rate = 1.0 / delay if delay > 0 else (max_rate or 10.0)
+        limiter = AdaptiveRateLimiter(start_rate, max_rate or start_rate)  # faster only when asked to
+        progress = Progress(len(products))
+        lock = threading.Lock()
+        pending = []
+        counts = {'updated': 0, 'failed': 0}
+
+        def apply_pending(force=False):
+            # one bulk UPDATE per chunk instead of a commit per product
+            with lock:
+                if not pending or (len(pending) < chunk and not force):
+                    return
+                batch = pending[:]
+                del pending[:]
+                if not dry_run:
+                    db.session.bulk_update_mappings(Product, batch)
+                    db.session.commit()
+                    for m in batch:
+                        mark_converted(m['image_url'])
+
+        def handle(p):
             src = (p.image_url or '').strip()
-            if not src:
-                print(f"{idx}/{len(products)}: id={p.id} no image, skipping")
-                continue
-            print(f"{idx}/{len(products)}: id={p.id} converting {src}")
-            res = convert_image_url(src)
-            if not res.get('ok'):
-                print(f"  -> failed: {res.get('error')}")
-            else:
-                data = res.get('result')
-                # Heuristic: look for a URL in top-level keys or nested 'url' fields
-                new_url = None
-                if isinstance(data, str) and data.startswith('http'):
-                    new_url = data
-                elif isinstance(data, dict):
-                    # common places to find returned URL
-                    for k in ('url','converted_url','data','result'):
-                        v = data.get(k)
-                        if isinstance(v, str) and v.startswith('http'):
-                            new_url = v; break
-                    if not new_url:
-                        # try deeper search
-                        def find_url(obj):
-                            if isinstance(obj, str) and obj.startswith('http'):
-                                return obj
-                            if isinstance(obj, dict):
-                                for vv in obj.values():
-                                    r = find_url(vv)
-                                    if r: return r
-                            if isinstance(obj, list):
-                                for item in obj:
-                                    r = find_url(item)
-                                    if r: return r
-                            return None
-                        new_url = find_url(data)
-
-                if new_url:
-                    print(f"  -> got converted url: {new_url}")
-                    if not dry_run:
-                        p.image_url = new_url
-                        db.session.add(p)
-                        db.session.commit()
-                    updated += 1
-                else:
-                    print("  -> no usable url found in API response; skipping")
-
-            time.sleep(delay)
-
-        print(f"Done. Updated {updated} products (dry_run={dry_run})")
+            try:
+                if not src:
+                    print(f"id={p.id} no image, skipping")
+                    return
+                res = convert(src, limiter)
+                if not res.get('ok'):
+                    print(f"id={p.id} failed: {res.get('error')}")
+                    with lock:
+                        counts['failed'] += 1
+                    return
+                new_url = extract_url(res.get('result'))
+                if not new_url:
+                    print(f"id={p.id} no usable url found in API response; skipping")
+                elif new_url != src:
+                    print(f"id={p.id} {src} -> {new_url}")
+                    with lock:
+                        pending.append({'id': p.id, 'image_url': new_url})
+                        counts['updated'] += 1
+            finally:
+                progress.tick(limiter)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(handle, p): p.id for p in products}
+                # collect on the main thread: the session belongs to this app context
+                while progress.done < len(products):
+                    apply_pending()
+                    time.sleep(0.2)
+            for future, pid in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"id={pid} failed: {e!r}")
+                    counts['failed'] += 1
+        else:
+            for p in products:
+                handle(p)
+                apply_pending()
+        apply_pending(force=True)
+
+        elapsed = time.time() - progress.started
+        print(f"Done. Updated {counts['updated']} products, {counts['failed']} failed "
+              f"in {elapsed:.1f}s ({len(products) / max(elapsed, 1e-6):.1f} products/s, dry_run={dry_run})")
+        print(f"Conversion cache: {cache_stats()}")
 
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument('--limit', type=int, default=None, help='Max products to process')
     ap.add_argument('--delay', type=float, default=float(os.environ.get('IMAGE_RATE_DELAY', '0.45')),
-                    help='Seconds to sleep between requests')
+                    help='Starting seconds between API requests (the limiter adapts from there)')
+    ap.add_argument('--max-rate', type=float, default=None, help='Upper bound on API requests per second (default: the --delay rate, no speed-up)')
+    ap.add_argument('--workers', type=int, default=1, help='Concurrent conversion workers')
+    ap.add_argument('--chunk', type=int, default=500, help='Products per bulk DB update')
     ap.add_argument('--apply', action='store_true', help='Apply changes to DB (default is dry-run)')
     args = ap.parse_args()
     if not os.environ.get('RAPIDAPI_KEY'):
         print('RAPIDAPI_KEY not set in environment. Export it before running.')
-    main(limit=args.limit, delay=args.delay, dry_run=(not args.apply))
+    main(limit=args.limit, delay=args.delay, dry_run=(not args.apply), workers=args.workers,
+         max_rate=args.max_rate, chunk=args.chunk)
@@ -0,0 +1,244 @@
+"""Endpoint benchmarks against generated catalogs of 1k, 100k and 1M products.
+
+For each scale a deterministic SQLite database is generated once (cached
+under cache/bench/) and every endpoint in app.py is driven through the
+Flask test client on a scratch copy of it. Each scale runs in its own
+process so the reported peak RSS belongs to that scale alone.
+
+Results (p50/p95/p99 latency, requests per second, peak RSS) are compared
+with bench/baseline.json; anything slower than the baseline by more than
+--tolerance is reported as a regression and the run exits with status 1.
+Baselines are machine-specific: regenerate them with --update-baseline on
+the box that runs the comparison.
+
+Usage:
+  python -m bench.endpoints --scales 1k,100k
+  python -m bench.endpoints --scales 1k --update-baseline
+  python -m bench.endpoints --scales 1m --requests 50
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+from disk_cache import CACHE_DIR
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BENCH_DIR = os.path.join(CACHE_DIR, 'bench')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def generate_database(path, n_products, seed=42):
+    """Write a deterministic catalog with users, carts, orders and payments to `path` (see seed_synthetic.py)."""
+    from database_models import create_db_app, db
+    import seed_synthetic
+
+    tmp = f'{path}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp}'})
+    with app.app_context():
+        db.create_all()
+        n_users = min(1000, max(20, n_products // 1000))
+        seed_synthetic.seed(db.engine, n_products, seed=seed, n_users=n_users, n_orders=n_users * 5,
+                            lines_per_order=(1, 4), log=lambda msg: print(msg, file=sys.stderr))
+        db.engine.dispose()
+    os.replace(tmp, path)
+
+
+def database_for(n_products, seed):
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    path = os.path.join(BENCH_DIR, f'catalog-{n_products}-{seed}-v3.db')  # v3: catalog_changes.product_ids, script_checkpoints
+    if not os.path.exists(path):
+        t = time.perf_counter()
+        generate_database(path, n_products, seed)
+        print(f'generated {path} in {time.perf_counter() - t:.1f}s', file=sys.stderr)
+    return path
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _measure(fn, n):
+    times = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        resp = fn(i)
+        times.append((time.perf_counter() - t) * 1000)
+        if resp.status_code >= 400:
+            errors += 1
+    total = time.perf_counter() - start
+    times.sort()
+    return {
+        'n': n,
+        'errors': errors,
+        'p50_ms': round(_percentile(times, 50), 3),
+        'p95_ms': round(_percentile(times, 95), 3),
+        'p99_ms': round(_percentile(times, 99), 3),
+        'rps': round(n / total, 1) if total else 0.0,
+    }
+
+
+def run_scale(n_products, requests, seed):
+    """Benchmark every endpoint against a scratch copy of the catalog for this scale."""
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+
+    source = database_for(n_products, seed)
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    path = os.path.join(workdir, 'catalog.db')
+    shutil.copy(source, path)
+    try:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RATE_LIMIT_ENABLED': False})
+        client = app.test_client()
+        rng = random.Random(seed)
+        conn = sqlite3.connect(path)
+        user_id, email = conn.execute(
+            "SELECT u.id, u.email FROM users u JOIN orders o ON o.user_id = u.id "
+            "WHERE u.role = 'customer' GROUP BY u.id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+        order_ids = [r[0] for r in conn.execute('SELECT id FROM orders WHERE user_id = ?', (user_id,))]
+        conn.close()
+        with app.app_context():
+            user_auth = {'Authorization': 'Bearer ' + create_access_token(identity=email)}
+            admin_auth = {'Authorization': 'Bearer ' + create_access_token(identity='admin@example.com')}
+
+        def product_id(i):
+            return rng.randint(1, n_products)
+
+        def add(i, pid=None):
+            return client.post('/api/cart/add', headers=user_auth, json={'product_id': pid or product_id(i), 'quantity': 1})
+
+        def checkout(i):
+            add(i)
+            return client.post('/api/checkout', headers=user_auth, json={'payment_method': 'card'})
+
+        # the full listing serialises the whole table, so scale its iterations down
+        list_n = max(3, min(requests, requests * 1000 // n_products))
+        cases = [
+            ('GET /', requests, lambda i: client.get('/')),
+            ('GET /api/products', list_n, lambda i: client.get('/api/products')),
+            ('GET /api/products/<id>', requests, lambda i: client.get(f'/api/products/{product_id(i)}')),
+            ('GET /api/categories', requests, lambda i: client.get('/api/categories')),
+            ('POST /api/login', min(requests, 10),
+             lambda i: client.post('/api/login', json={'email': email, 'password': 'password'})),
+            ('GET /api/profile', requests, lambda i: client.get('/api/profile', headers=user_auth)),
+            ('POST /api/cart/add', requests, lambda i: add(i, 1 + i % 20)),
+            ('GET /api/cart', requests, lambda i: client.get('/api/cart', headers=user_auth)),
+            ('POST /api/cart/update', requests,
+             lambda i: client.post('/api/cart/update', headers=user_auth, json={'product_id': 1 + i % 20, 'quantity': 2})),
+            ('POST /api/cart/remove', requests,
+             lambda i: client.post('/api/cart/remove', headers=user_auth, json={'product_id': 1 + i % 20})),
+            ('POST /api/checkout', requests, checkout),
+            ('GET /api/orders', requests, lambda i: client.get('/api/orders', headers=user_auth)),
+            ('GET /api/orders/<id>', requests,
+             lambda i: client.get(f'/api/orders/{order_ids[i % len(order_ids)]}', headers=user_auth)),
+            ('GET /invoice/<id>', requests,
+             lambda i: client.get(f'/invoice/{order_ids[i % len(order_ids)]}', headers=user_auth)),
+            ('GET /api/admin/orders', max(3, requests // 10), lambda i: client.get('/api/admin/orders', headers=admin_auth)),
+            ('GET /api/stats/profit', max(3, requests // 10), lambda i: client.get('/api/stats/profit')),
+        ]
+        results = {}
+        for name, n, fn in cases:
+            fn(0)  # warm up
+            results[name] = _measure(fn, n)
+        results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance, floor_ms=1.0):
+    """Return a list of human-readable regressions against the baseline."""
+    regressions = []
+    for scale, endpoints in results.items():
+        base = baseline.get(scale)
+        if not base:
+            continue
+        for name, r in endpoints.items():
+            b = base.get(name)
+            if b is None:
+                continue
+            if name == 'peak_rss_mb':
+                if r > b * (1 + tolerance):
+                    regressions.append(f'{scale} peak RSS {r} MB vs baseline {b} MB')
+                continue
+            # the median is compared because tail percentiles of short runs are too noisy to gate on
+            if r['p50_ms'] > b['p50_ms'] * (1 + tolerance) and r['p50_ms'] - b['p50_ms'] > floor_ms:
+                regressions.append(f"{scale} {name} p50 {r['p50_ms']} ms vs baseline {b['p50_ms']} ms")
+            if r['errors'] > b['errors']:
+                regressions.append(f"{scale} {name} errors {r['errors']} vs baseline {b['errors']}")
+    return regressions
+
+
+def print_report(scale, results):
+    print(f'\n== {scale} ({SCALES[scale]} products) peak RSS {results["peak_rss_mb"]} MB')
+    print(f'{"endpoint":<26}{"n":>6}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"errors":>8}')
+    for name, r in results.items():
+        if name == 'peak_rss_mb':
+            continue
+        print(f'{name:<26}{r["n"]:>6}{r["p50_ms"]:>10.2f}{r["p95_ms"]:>10.2f}{r["p99_ms"]:>10.2f}'
+              f'{r["rps"]:>10.1f}{r["errors"]:>8}')
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Benchmark app.py endpoints on generated catalogs')
+    ap.add_argument('--scales', default='1k', help=f'Comma-separated subset of {",".join(SCALES)}')
+    ap.add_argument('--requests', type=int, default=200, help='Iterations per endpoint')
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--tolerance', type=float, default=0.3, help='Allowed slowdown vs baseline (0.3 = 30%%)')
+    ap.add_argument('--baseline', default=BASELINE_PATH)
+    ap.add_argument('--update-baseline', action='store_true', help='Store these results as the new baseline')
+    ap.add_argument('--worker', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        warnings.simplefilter('ignore')  # keep the worker's stderr readable
+        json.dump(run_scale(SCALES[args.worker], args.requests, args.seed), sys.stdout)
+        return 0
+
+    results = {}
+    for scale in [s.strip() for s in args.scales.split(',') if s.strip()]:
+        if scale not in SCALES:
+            ap.error(f'unknown scale {scale}')
+        out = subprocess.run([sys.executable, '-m', 'bench.endpoints', '--worker', scale,
+                              '--requests', str(args.requests), '--seed', str(args.seed)],
+                             stdout=subprocess.PIPE, check=True)
+        results[scale] = json.loads(out.stdout)
+        print_report(scale, results[scale])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'\nBaseline updated: {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('\nREGRESSIONS:')
+        for r in regressions:
+            print(f'  {r}')
+        return 1
+    print('\nNo regressions against baseline.' if baseline else '\nNo baseline stored yet (use --update-baseline).')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Throughput of event ingestion (events.py) and the cost of its flushes and compaction.
+
+Four measurements:
+  buffer     EventLog.add() alone, batches of --batch rows
+  request    POST /api/events through the Flask test client, one worker thread;
+             events/s here is the ceiling for one worker process
+  sustained  --threads clients posting at --rate events/s for --seconds against
+             one app with its writer thread running. Reports the rate reached,
+             flush count / rows / ms, drops, and checks that every accepted
+             event reached the database
+  compact    --rows raw events spread over 30 days, folded into daily counts
+             (rows/s, and that the counts add up to the rows removed)
+
+Exits with status 1 if the sustained run falls short of --rate, drops events
+or loses any, or compaction miscounts.
+
+Usage:
+  python -m bench.events
+  python -m bench.events --rate 20000 --seconds 10 --threads 8 --rows 2000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import warnings
+
+import events
+
+
+def batch(n, rng, products=10000):
+    now = time.time() * 1000
+    return {'session': f's{rng.randrange(1 << 30)}', 'sent': now,
+            'events': [{'type': rng.choice(events.KINDS), 'product_id': rng.randrange(1, products),
+                        'source': 'grid', 't': now - rng.randrange(5000)} for _ in range(n)]}
+
+
+def bench_buffer(n_batches, size, tmp):
+    log = events.EventLog(os.path.join(tmp, 'buffer.db'), capacity=1 << 20, flush_size=1 << 30, flush_interval=3600)
+    rows, _ = events.parse_batch(batch(size, random.Random(1)))
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        log.add(rows)
+    took = time.perf_counter() - start
+    print(f'buffer    {n_batches * size / took:12,.0f} events/s  ({took / n_batches * 1e6:.1f} us per add of {size})')
+
+
+def make_app(tmp, name, **extra):
+    from app import create_app
+    return create_app(dict({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "app.db")}',
+                            'EVENTS_PATH': os.path.join(tmp, f'{name}.db'),
+                            'SEARCH_INDEX_PRELOAD': False, 'CAMPAIGN_SCHEDULER': False,
+                            'CATALOG_SNAPSHOT': False, 'RATE_LIMIT_ENABLED': False}, **extra))
+
+
+def bench_request(n, size, tmp):
+    app = make_app(tmp, 'request')
+    client = app.test_client()
+    rng = random.Random(2)
+    bodies = [batch(size, rng) for _ in range(64)]
+    times = []
+    for i in range(n + 50):
+        t = time.perf_counter()
+        resp = client.post('/api/events', json=bodies[i % len(bodies)])
+        if i >= 50:
+            times.append(time.perf_counter() - t)
+        assert resp.status_code == 202, resp.get_json()
+    times.sort()
+    p50 = statistics.median(times)
+    print(f'request   {size / p50:12,.0f} events/s  (batch {size}: p50 {p50 * 1e6:.0f} us, '
+          f'p99 {times[int(len(times) * 0.99) - 1] * 1e6:.0f} us)')
+
+
+def bench_sustained(rate, seconds, threads, size, tmp):
+    app = make_app(tmp, 'sustained')
+    log = app.extensions['events']
+    per_thread = rate / threads / size  # requests per second per client
+    sent = [0] * threads
+
+    def client(i):
+        c = app.test_client()
+        rng = random.Random(100 + i)
+        bodies = [batch(size, rng) for _ in range(16)]
+        start = time.perf_counter()
+        k = 0
+        while True:
+            due = start + k / per_thread
+            now = time.perf_counter()
+            if now - start >= seconds:
+                break
+            if due > now:
+                time.sleep(due - now)
+            resp = c.post('/api/events', json=bodies[k % len(bodies)])
+            sent[i] += resp.get_json()['accepted']
+            k += 1
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    took = time.perf_counter() - start
+    achieved = sum(sent) / took
+    log.flush()
+    stats = log.stats()
+    stored = events.table_stats(log.path)['raw']
+    ok = achieved >= rate * 0.95 and not stats['dropped'] and stored == sum(sent)
+    print(f'sustained {achieved:12,.0f} events/s  (target {rate:,}, {threads} clients, batch {size}, {took:.1f}s)')
+    print(f'          {stats["flushes"]} flushes, {stats["flushed"] / max(1, stats["flushes"]):.0f} rows each, '
+          f'avg {stats["flush_ms_avg"]} ms, max {stats["flush_ms_max"]} ms; dropped {stats["dropped"]}; '
+          f'{stored} of {sum(sent)} in the database ({"ok" if ok else "FAILED"})')
+    return ok
+
+
+def bench_compact(n_rows, tmp):
+    log = events.EventLog(os.path.join(tmp, 'compact.db'), capacity=n_rows, flush_size=1 << 30, flush_interval=3600)
+    rng = random.Random(3)
+    now = time.time()
+    rows = [(now - rng.random() * 30 * 86400, rng.choice(events.KINDS), rng.randrange(1, 10000), None, 's', None)
+            for _ in range(n_rows)]
+    rows.sort()  # flushes arrive roughly in time order
+    log.add(rows)
+    t = time.perf_counter()
+    log.flush()
+    print(f'flush     {n_rows / (time.perf_counter() - t):12,.0f} rows/s    ({n_rows} rows in one flush)')
+    result = log.compact(raw_days=7, now=now)
+    conn = events.connect(log.path)
+    total = conn.execute('SELECT sum(n) FROM event_counts').fetchone()[0]
+    left = conn.execute('SELECT count(*) FROM events').fetchone()[0]
+    ok = total == result['rows'] and total + left == n_rows
+    print(f'compact   {result["rows"] / result["seconds"]:12,.0f} rows/s    ({result["rows"]} rows older than 7 days '
+          f'into {result["counts"]} daily counts in {result["seconds"]}s, {left} left; {"ok" if ok else "MISCOUNTED"})')
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--batch', type=int, default=20, help='events per request')
+    ap.add_argument('--adds', type=int, default=100000)
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--rate', type=int, default=10000)
+    ap.add_argument('--seconds', type=float, default=5)
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--rows', type=int, default=1000000)
+    args = ap.parse_args()
+    warnings.filterwarnings('ignore')
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_buffer(args.adds, args.batch, tmp)
+        bench_request(args.requests, args.batch, tmp)
+        ok = bench_sustained(args.rate, args.seconds, args.threads, args.batch, tmp)
+        ok = bench_compact(args.rows, tmp) and ok
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Compare one-off `requests.get` calls against the pooled `http_client` session.
+
+Starts a local stand-in server (plain HTTP, or HTTPS when --certfile/--keyfile
+are given) and reports per-request latency plus how many connections the
+server had to accept, which is the handshake cost the pool saves.
+
+Usage:
+  python -m bench.http_pool --requests 500
+  python -m bench.http_pool --requests 500 --certfile cert.pem --keyfile key.pem
+"""
+import argparse
+import json
+import ssl
+import statistics
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import http_client
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    connections = 0
+    body = json.dumps({'ok': True, 'reviews': [{'title': 'Great', 'content': 'Works as described'}] * 5}).encode()
+
+    def setup(self):
+        super().setup()
+        with _count_lock:
+            StandInHandler.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+_count_lock = threading.Lock()
+
+
+def start_server(certfile=None, keyfile=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    scheme = 'http'
+    if certfile:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(certfile, keyfile)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+        scheme = 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'{scheme}://127.0.0.1:{server.server_port}/top-product-reviews'
+
+
+def run(label, call, url, n):
+    StandInHandler.connections = 0
+    times = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        resp = call(url, params={'asin': f'B{i:08d}'}, timeout=5, verify=False)
+        resp.content
+        times.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - start
+    times.sort()
+    print(f'{label:<10} {n / total:8.0f} req/s  p50 {statistics.median(times):6.2f} ms  '
+          f'p99 {times[int(len(times) * 0.99) - 1]:6.2f} ms  connections {StandInHandler.connections}')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=300)
+    ap.add_argument('--certfile')
+    ap.add_argument('--keyfile')
+    args = ap.parse_args()
+    warnings.filterwarnings('ignore')  # self-signed certificate
+    server, url = start_server(args.certfile, args.keyfile)
+    try:
+        run('requests', requests.get, url, args.requests)
+        run('pooled', http_client.get, url, args.requests)
+    finally:
+        server.shutdown()
+    print(json.dumps(http_client.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Many shoppers at once against a real server: mixed traffic, lock contention, oversell.
+
+Starts the app on a local port (threaded, as `python app.py` runs it, with
+its background work: catalog snapshot, search index, campaign scheduler) on a
+scratch copy of a generated catalog (see bench/endpoints.py), then runs
+--users simulated shoppers as threads for --duration seconds. --lean turns
+the background work off. Each shopper has its own account (added to the
+database up front, or registered through the API with --url and no --db)
+and keep-alive session. All of them log in before the clock starts; then
+they start over --ramp seconds and repeat a funnel, pausing for an
+exponentially distributed think time (mean --think) between steps:
+
+  browse    GET  /api/products (picks from the top of the list are likelier)
+  detail    GET  /api/products/<id>/full, one to three products
+  add       POST /api/cart/add
+  update    POST /api/cart/update
+  checkout  POST /api/checkout
+  orders    GET  /api/orders
+
+--mix sets how far sessions go: "browse" stops after detail, "cart" adds and
+updates but leaves the cart, "buy" checks out and looks at its orders.
+
+Reported: throughput, per-step latency percentiles, error / timeout rates, and
+"database is locked" errors from the server log. When the run ends, stock is
+checked against the orders placed during it: units sold beyond the stock a
+product had (oversold), and products whose final stock is higher than those
+orders imply (lost updates from concurrent checkouts). The run exits with
+status 1 if either check fails. --stock sets every product's stock first, so
+a run can be made to sell out.
+
+Every shopper comes from 127.0.0.1, so the started server runs without the
+rate limiter. A server given with --url keeps its own: shoppers send their
+own X-Forwarded-For (counted per shopper if the server runs with
+RATE_LIMIT_TRUST_FORWARDED=1), registration and login wait out a 429's
+Retry-After, and 429s during the run are reported under errors.
+
+Usage:
+  python -m bench.loadgen
+  python -m bench.loadgen --users 100 --duration 60 --mix browse:40,cart:30,buy:30 --think 0.2
+  python -m bench.loadgen --products 100000 --stock 5 --json loadgen.json
+  python -m bench.loadgen --url http://127.0.0.1:10000 --db instance/hotel.db   # an already running server
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+import rate_limit
+from bench.endpoints import _percentile, database_for
+
+STEPS = ('login', 'browse', 'detail', 'add', 'update', 'checkout', 'orders')
+PROFILES = {'browse': ('browse', 'detail'),
+            'cart': ('browse', 'detail', 'add', 'update'),
+            'buy': ('browse', 'detail', 'add', 'update', 'checkout', 'orders')}
+
+# the app as `python app.py` runs it; every shopper shares one IP, so without the rate limiter
+SERVER = '''
+import json, sys
+from app import create_app
+path, port, events, extra = sys.argv[1], int(sys.argv[2]), sys.argv[3], json.loads(sys.argv[4])
+app = create_app(dict({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'EVENTS_PATH': events,
+                       'RATE_LIMIT_ENABLED': False}, **extra))
+app.run(host='127.0.0.1', port=port, threaded=True)
+'''
+# --lean: background work a shopper never waits on
+LEAN = {'SEARCH_INDEX_PRELOAD': False, 'CATALOG_SNAPSHOT': False, 'CAMPAIGN_SCHEDULER': False}
+LOGIN_TRIES = 10
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition(':')
+        if name.strip() not in PROFILES:
+            raise argparse.ArgumentTypeError(f'unknown profile {name!r} (use {", ".join(PROFILES)})')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    """Latencies and outcomes per step, shared by every shopper."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.sessions = defaultdict(int)
+        self.deadline = None
+
+    def call(self, step, session, method, url, **kwargs):
+        t = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except requests.Timeout:
+            with self.lock:
+                self.timeouts[step] += 1
+            return None
+        except requests.RequestException:
+            with self.lock:
+                self.errors[step] += 1
+                self.statuses['connection'] += 1
+            return None
+        took = time.perf_counter() - t
+        with self.lock:
+            self.times[step].append(took * 1000)
+            if resp.status_code >= 400:
+                self.errors[step] += 1
+                self.statuses[resp.status_code] += 1
+        return resp if resp.status_code < 400 else None
+
+
+def post_retrying(session, url, timeout, **kwargs):
+    """POST, waiting out up to LOGIN_TRIES 429s (a --url server's limiter); None on a connection error."""
+    for _ in range(LOGIN_TRIES):
+        try:
+            resp = session.post(url, timeout=timeout, **kwargs)
+        except requests.RequestException:
+            return None
+        if resp.status_code != 429:
+            return resp
+        time.sleep(rate_limit.parse_retry_after(resp.headers.get('Retry-After')))
+    return resp
+
+
+def shopper(i, base, rec, args, start, mix):
+    rng = random.Random(args.seed * 1000 + i)
+    http = requests.Session()
+    http.headers['X-Forwarded-For'] = f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+    timeout = args.timeout
+    email = f'loadgen{i}@example.com'
+    if args.url and not args.db:
+        post_retrying(http, f'{base}/api/register', timeout,
+                      json={'email': email, 'password': 'password', 'name': f'Shopper {i}'})  # 409 once it exists
+    t = time.perf_counter()
+    resp = post_retrying(http, f'{base}/api/login', timeout, json={'email': email, 'password': 'password'})
+    with rec.lock:
+        if resp is not None and resp.status_code < 400:
+            rec.times['login'].append((time.perf_counter() - t) * 1000)
+        else:
+            rec.errors['login'] += 1
+            rec.statuses[resp.status_code if resp is not None else 'connection'] += 1
+    start.wait()  # every shopper logs in before the clock starts
+    if resp is None or resp.status_code >= 400:
+        return
+    http.headers['Authorization'] = 'Bearer ' + resp.json()['access_token']
+    time.sleep(args.ramp * i / args.users)
+    deadline = rec.deadline
+    names, weights = list(mix), list(mix.values())
+
+    def think():
+        if args.think:
+            time.sleep(min(rng.expovariate(1 / args.think), args.think * 5))
+
+    while time.monotonic() < deadline:
+        profile = rng.choices(names, weights)[0]
+        with rec.lock:
+            rec.sessions[profile] += 1
+        steps = PROFILES[profile]
+        resp = rec.call('browse', http, 'GET', f'{base}/api/products', timeout=timeout)
+        listing = [p['id'] for p in resp.json()] if resp is not None else []
+        if not listing:
+            think()
+            continue
+        # shoppers mostly open what is near the top of the list
+        picks = [listing[min(len(listing) - 1, int(rng.paretovariate(1.2)) - 1)] for _ in range(rng.randint(1, 3))]
+        for pid in picks:
+            think()
+            rec.call('detail', http, 'GET', f'{base}/api/products/{pid}/full', timeout=timeout)
+        if 'add' in steps:
+            for pid in dict.fromkeys(picks[:2]):
+                think()
+                rec.call('add', http, 'POST', f'{base}/api/cart/add', json={'product_id': pid, 'quantity': rng.randint(1, 2)},
+                         timeout=timeout)
+            think()
+            rec.call('update', http, 'POST', f'{base}/api/cart/update',
+                     json={'product_id': picks[0], 'quantity': rng.randint(1, 3)}, timeout=timeout)
+        if 'checkout' in steps:
+            think()
+            if rec.call('checkout', http, 'POST', f'{base}/api/checkout', json={'payment_method': 'card'},
+                        timeout=timeout) is not None:
+                think()
+                rec.call('orders', http, 'GET', f'{base}/api/orders', timeout=timeout)
+        think()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(path, workdir, lean=False):
+    port = free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-c', SERVER, path, str(port), os.path.join(workdir, 'events.db'),
+                             json.dumps(LEAN if lean else {})],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), stdout=log, stderr=log)
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if proc.poll() is not None:
+            raise SystemExit(f'server exited; see {log.name}')
+        try:
+            requests.get(f'{base}/api/test', timeout=1)
+            return proc, base, log.name
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit('server did not start')
+
+
+def create_shoppers(path, n):
+    """Accounts (and carts) loadgen0..n-1@example.com with password 'password', as registering would make."""
+    from werkzeug.security import generate_password_hash
+    password_hash = generate_password_hash('password')
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executemany("INSERT OR IGNORE INTO users (name, email, password_hash, role) VALUES (?, ?, ?, 'customer')",
+                     [(f'Shopper {i}', f'loadgen{i}@example.com', password_hash) for i in range(n)])
+    conn.execute("INSERT INTO carts (user_id) SELECT id FROM users WHERE email LIKE 'loadgen%@example.com' "
+                 'AND id NOT IN (SELECT user_id FROM carts)')
+    conn.commit()
+    conn.close()
+
+
+def stock_state(path):
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        stock = dict(conn.execute('SELECT id, stock FROM products'))
+        last_order = conn.execute('SELECT coalesce(max(id), 0) FROM orders').fetchone()[0]
+    finally:
+        conn.close()
+    return stock, last_order
+
+
+def check_stock(path, before, last_order):
+    """Compare final stock with the orders placed since last_order."""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        sold = dict(conn.execute('SELECT product_id, sum(quantity) FROM order_items WHERE order_id > ? '
+                                 'GROUP BY product_id', (last_order,)))
+        after = dict(conn.execute('SELECT id, stock FROM products'))
+        orders = conn.execute('SELECT count(*) FROM orders WHERE id > ?', (last_order,)).fetchone()[0]
+        empty = conn.execute('SELECT count(*) FROM orders o WHERE o.id > ? AND NOT EXISTS '
+                             '(SELECT 1 FROM order_items i WHERE i.order_id = o.id)', (last_order,)).fetchone()[0]
+    finally:
+        conn.close()
+    oversold = {pid: n - (before.get(pid) or 0) for pid, n in sold.items() if n > (before.get(pid) or 0)}
+    # checkout clamps at zero, so after any order sequence the stock should be max(0, before - sold)
+    lost = {pid: after[pid] - max(0, (before.get(pid) or 0) - n) for pid, n in sold.items()
+            if pid in after and after[pid] > max(0, (before.get(pid) or 0) - n)}
+    return {'orders': orders, 'orders_without_items': empty, 'units_sold': sum(sold.values()),
+            'oversold_products': len(oversold), 'oversold_units': sum(oversold.values()),
+            'lost_update_products': len(lost), 'lost_update_units': sum(lost.values())}
+
+
+def report(rec, took, args, locks, stock):
+    total = sum(len(t) for step, t in rec.times.items() if step != 'login')  # logins happen before the clock
+    out = {'users': args.users, 'seconds': round(took, 1), 'requests': total,
+           'rps': round(total / took, 1), 'sessions': dict(rec.sessions),
+           'statuses': {str(k): v for k, v in rec.statuses.items()}, 'lock_errors': locks, 'steps': {}, 'stock': stock}
+    print(f'{args.users} shoppers for {took:.1f}s, think {args.think}s, mix '
+          + ', '.join(f'{k} {v:g}' for k, v in args.mix.items()))
+    print(f'{"step":<9} {"n":>7} {"err%":>6} {"timeout":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for step in STEPS:
+        times = sorted(rec.times[step])
+        n = len(times) + rec.timeouts[step]
+        if not n:
+            continue
+        row = {'n': n, 'error_rate': round(rec.errors[step] / n, 4), 'timeouts': rec.timeouts[step],
+               'p50_ms': round(_percentile(times, 50), 1), 'p95_ms': round(_percentile(times, 95), 1),
+               'p99_ms': round(_percentile(times, 99), 1), 'max_ms': round(times[-1], 1) if times else 0.0}
+        out['steps'][step] = row
+        print(f'{step:<9} {n:>7} {row["error_rate"] * 100:>6.2f} {row["timeouts"]:>7} {row["p50_ms"]:>8} '
+              f'{row["p95_ms"]:>8} {row["p99_ms"]:>8} {row["max_ms"]:>8}')
+    checkouts = len(rec.times['checkout']) - rec.errors['checkout']
+    out['checkouts_per_s'] = round(checkouts / took, 2)
+    print(f'throughput {out["rps"]} req/s, {out["checkouts_per_s"]} checkouts/s; sessions '
+          + ', '.join(f'{k} {v}' for k, v in rec.sessions.items()))
+    print('errors ' + (', '.join(f'{k}: {v}' for k, v in sorted(rec.statuses.items(), key=str)) or 'none')
+          + (f'; "database is locked" in server log: {locks}' if locks is not None else ''))
+    if stock:
+        print(f'stock  {stock["orders"]} orders, {stock["units_sold"]} units; oversold {stock["oversold_units"]} units '
+              f'on {stock["oversold_products"]} products; lost updates on {stock["lost_update_products"]} products '
+              f'({stock["lost_update_units"]} units); {stock["orders_without_items"]} orders without items')
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--users', type=int, default=50)
+    ap.add_argument('--duration', type=float, default=30)
+    ap.add_argument('--ramp', type=float, default=5, help='seconds over which shoppers start')
+    ap.add_argument('--think', type=float, default=0.5, help='mean think time between steps, seconds')
+    ap.add_argument('--mix', type=parse_mix, default=parse_mix('browse:50,cart:30,buy:20'))
+    ap.add_argument('--products', type=int, default=1000, help='size of the generated catalog')
+    ap.add_argument('--stock', type=int, default=None, help='set every product to this stock before the run')
+    ap.add_argument('--timeout', type=float, default=10, help='client timeout per request, seconds')
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--url', help='use a running server instead of starting one')
+    ap.add_argument('--db', help='with --url: its sqlite file, for the stock checks')
+    ap.add_argument('--lean', action='store_true', help='start the server without its background work')
+    ap.add_argument('--json', help='also write the results here')
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    proc = server_log = None
+    try:
+        if args.url:
+            base, path = args.url.rstrip('/'), args.db
+        else:
+            path = os.path.join(workdir, 'catalog.db')
+            shutil.copy(database_for(args.products, args.seed), path)
+        if path and args.stock is not None:
+            conn = sqlite3.connect(path, timeout=30)
+            conn.execute('UPDATE products SET stock = ?', (args.stock,))
+            conn.commit()
+            conn.close()
+        before, last_order = stock_state(path) if path else (None, None)
+        if path:
+            create_shoppers(path, args.users)
+        if not args.url:
+            proc, base, server_log = start_server(path, workdir, args.lean)
+
+        rec = Recorder()
+        clock = {}
+
+        def go():
+            clock['start'] = time.perf_counter()
+            rec.deadline = time.monotonic() + args.duration
+        start = threading.Barrier(args.users, action=go)
+        threads = [threading.Thread(target=shopper, args=(i, base, rec, args, start, args.mix), daemon=True)
+                   for i in range(args.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        took = time.perf_counter() - clock['start']
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    locks = None
+    if server_log:
+        with open(server_log) as f:
+            locks = f.read().count('database is locked')
+    stock = check_stock(path, before, last_order) if path else None
+    out = report(rec, took, args, locks, stock)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(out, f, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+    ok = not stock or not (stock['oversold_units'] or stock['lost_update_units'])
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Per-request cost of the rate limiter (rate_limit.py).
+
+Three measurements:
+  take      KeyedBuckets / SQLiteBuckets .take() calls, with 1 key and with
+            many distinct keys (a scan from many IPs, past max_keys so the
+            sweep runs)
+  request   GET /api/test through the Flask test client with the limiter off,
+            and with a never-exhausted ip + user policy on that route for each
+            backend (the user scope adds an optional JWT check)
+  shared    --processes workers draining one SQLite bucket at once; the number
+            admitted must equal its capacity
+
+Usage:
+  python -m bench.rate_limit
+  python -m bench.rate_limit --calls 200000 --keys 500000 --processes 8
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+import warnings
+
+import rate_limit
+
+
+def time_takes(bucket, keys, calls):
+    start = time.perf_counter()
+    n = len(keys)
+    for i in range(calls):
+        bucket.take(keys[i % n])
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench_take(calls, n_keys, tmp):
+    many = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(n_keys)]
+    backends = [
+        ('memory', lambda: rate_limit.KeyedBuckets(1e9, 1e9, max_keys=max(1000, n_keys // 4))),
+        ('sqlite', lambda: rate_limit.SQLiteBuckets(os.path.join(tmp, 'take.db'), f'take{time.time_ns()}', 1e9, 1e9)),
+    ]
+    for name, make in backends:
+        sqlite_calls = calls if name == 'memory' else max(1, calls // 10)
+        one = time_takes(make(), ['1.2.3.4'], sqlite_calls)
+        spread = time_takes(make(), many, sqlite_calls)
+        print(f'take {name:<7} one key {one:7.2f} us   {n_keys} keys {spread:7.2f} us')
+
+
+def bench_requests(n, tmp):
+    from app import create_app
+    base = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "app.db")}',
+            'SEARCH_INDEX_PRELOAD': False, 'CAMPAIGN_SCHEDULER': False}
+    policy = {'api_test': [('ip', 1e9, 1, 1e9), ('user', 1e9, 1, 1e9)]}
+    setups = [
+        ('off', {'RATE_LIMIT_ENABLED': False}),
+        ('memory', {'RATE_LIMITS': policy, 'RATE_LIMIT_BACKEND': 'memory'}),
+        ('sqlite', {'RATE_LIMITS': policy, 'RATE_LIMIT_BACKEND': 'sqlite',
+                    'RATE_LIMIT_PATH': os.path.join(tmp, 'requests.db')}),
+    ]
+    clients = {name: create_app(dict(base, **config)).test_client() for name, config in setups}
+    times = {name: [] for name in clients}
+    for i in range(n + 50):
+        # interleaved, so drift over the run (caches, allocator) hits every setup equally
+        for name, client in clients.items():
+            t = time.perf_counter()
+            client.get('/api/test')
+            if i >= 50:
+                times[name].append((time.perf_counter() - t) * 1e6)
+    off = statistics.median(times['off'])
+    for name, ts in times.items():
+        ts.sort()
+        extra = f'  (+{statistics.median(ts) - off:.0f} us)' if name != 'off' else ''
+        print(f'request {name:<7} p50 {statistics.median(ts):7.0f} us  p99 {ts[int(len(ts) * 0.99) - 1]:7.0f} us{extra}')
+
+
+def _drain(path, capacity, attempts, queue):
+    bucket = rate_limit.SQLiteBuckets(path, 'shared', 1e-6, capacity)
+    queue.put(sum(1 for _ in range(attempts) if not bucket.take('one-ip')))
+
+
+def bench_shared(processes, capacity, tmp):
+    path = os.path.join(tmp, 'shared.db')
+    rate_limit.SQLiteBuckets(path, 'shared', 1e-6, capacity)  # create the table before the workers race
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_drain, args=(path, capacity, capacity, queue)) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    admitted = sum(queue.get() for _ in workers)
+    for w in workers:
+        w.join()
+    status = 'ok' if admitted == capacity else 'OVERDRAWN'
+    print(f'shared  {processes} processes x {capacity} attempts on a bucket of {capacity}: {admitted} admitted ({status})')
+    return admitted == capacity
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--calls', type=int, default=100000)
+    ap.add_argument('--keys', type=int, default=200000)
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--processes', type=int, default=4)
+    ap.add_argument('--capacity', type=int, default=500)
+    args = ap.parse_args()
+    warnings.filterwarnings('ignore')
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_take(args.calls, args.keys, tmp)
+        bench_requests(args.requests, tmp)
+        ok = bench_shared(args.processes, args.capacity, tmp)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
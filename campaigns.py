@@ -0,0 +1,257 @@
+"""Set-based repricing: price changes and discount campaigns over many products at once.
+
+A campaign is a target plus a change.
+
+target (all given keys must match):
+  {"category": "Electronics"} | {"category_id": 3} | {"ids": [1, 2, 3]}
+  {"filter": {"min_price", "max_price", "min_rating", "max_rating", "min_stock", "max_stock", "name_contains"}}
+  {"all": true}                 the whole catalog (never implied by an empty target)
+change (exactly one):
+  {"percent": -10}              price *= 1 + percent / 100
+  {"amount": -50}               price += amount
+  {"discount_percent": 20}      discount_price = price * (1 - percent / 100)
+  {"discount_amount": 100}      discount_price = price - amount (products priced above the amount)
+  {"clear_discount": true}      discount_price = NULL (manual and campaign discounts alike)
+
+Applying a campaign is one UPDATE ... WHERE <target>, committed together
+with one catalog.bump(). It replaces one PUT per product, each with its own
+commit and invalidation. New prices are rounded to 2 decimals, never drop
+below 0.01, and clear any discount that would no longer be below the price.
+
+Discount rows are tagged with the campaign id. With an ends_at, ending the
+campaign is one UPDATE ... WHERE campaign_id = :id, which restores the
+undiscounted price. Products with a manual discount (one not set by a
+campaign) are left out of discount campaigns, so ending one never loses
+it; clear_discount them first to include them. A later campaign takes
+over products discounted by an earlier one. Price changes are permanent
+and take no ends_at.
+
+A campaign with a future starts_at, or with an ends_at, is advanced by
+run_due(). The app calls it from a daemon thread every POLL_INTERVAL
+seconds, one per database per process however many apps are created. Each transition claims the campaign with a conditional UPDATE of
+its status in the same transaction, so with several workers it runs once.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from database_models import db, Product, Category, PriceCampaign
+import catalog
+
+POLL_INTERVAL = float(os.environ.get('CAMPAIGN_POLL_INTERVAL', 30))
+MAX_IDS = 10000
+_pollers = set()  # database URIs with a scheduler thread in this process
+_pollers_lock = threading.Lock()
+PRICE_CHANGES = ('percent', 'amount')
+DISCOUNT_CHANGES = ('discount_percent', 'discount_amount', 'clear_discount')
+FILTERS = {
+    'min_price': lambda v: Product.price >= float(v),
+    'max_price': lambda v: Product.price <= float(v),
+    'min_rating': lambda v: Product.rating >= float(v),
+    'max_rating': lambda v: Product.rating <= float(v),
+    'min_stock': lambda v: Product.stock >= int(v),
+    'max_stock': lambda v: Product.stock <= int(v),
+    'name_contains': lambda v: Product.name.icontains(str(v), autoescape=True),
+}
+
+
+def parse_time(value):
+    """ISO 8601 string -> naive UTC datetime (the DB stores utcnow()); None passes through."""
+    if value in (None, ''):
+        return None
+    try:
+        t = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'bad datetime {value!r}')
+    return t.astimezone(timezone.utc).replace(tzinfo=None) if t.tzinfo else t
+
+
+def conditions(target):
+    """SQL conditions for a target dict. Raises ValueError for an empty or invalid target."""
+    if not isinstance(target, dict):
+        raise ValueError('target must be an object')
+    conds = []
+    if target.get('category'):
+        cid = (db.session.query(Category.id)
+               .filter(db.func.lower(Category.name) == str(target['category']).strip().lower()).scalar())
+        if cid is None:
+            raise ValueError(f"unknown category {target['category']!r}")
+        conds.append(Product.category_id == cid)
+    if target.get('category_id') is not None:
+        conds.append(Product.category_id == int(target['category_id']))
+    if target.get('ids') is not None:
+        ids = [int(i) for i in target['ids']]
+        if not ids or len(ids) > MAX_IDS:
+            raise ValueError(f'ids must list 1-{MAX_IDS} product ids')
+        conds.append(Product.id.in_(ids))
+    for key, value in (target.get('filter') or {}).items():
+        if key not in FILTERS:
+            raise ValueError(f'unknown filter {key!r}')
+        conds.append(FILTERS[key](value))
+    if not conds and target.get('all') is not True:
+        raise ValueError('target needs category, category_id, ids, filter or all')
+    return conds
+
+
+def _new_price(change):
+    if 'percent' in change:
+        expr = Product.price * (1 + float(change['percent']) / 100)
+    else:
+        expr = Product.price + float(change['amount'])
+    expr = db.func.round(expr, 2)
+    return db.case((expr < 0.01, 0.01), else_=expr)
+
+
+def values(change, campaign_id=None):
+    """(UPDATE values, extra conditions, fields changed) for a change dict. Raises ValueError."""
+    if not isinstance(change, dict) or len([k for k in change if k in PRICE_CHANGES + DISCOUNT_CHANGES]) != 1:
+        raise ValueError(f'change needs exactly one of {", ".join(PRICE_CHANGES + DISCOUNT_CHANGES)}')
+    if 'percent' in change and float(change['percent']) <= -100:
+        raise ValueError('percent must be above -100')
+    if any(k in change for k in PRICE_CHANGES):
+        price = _new_price(change)
+        # all SET expressions see the old row, so the new price is recomputed for the comparison
+        dropped = Product.discount_price >= price
+        vals = {'price': price, 'discount_price': db.case((dropped, None), else_=Product.discount_price),
+                'campaign_id': db.case((dropped, None), else_=Product.campaign_id)}
+        return vals, [], ('price', 'discount_price')
+    if change.get('clear_discount'):
+        return {'discount_price': None, 'campaign_id': None}, [Product.discount_price.isnot(None)], ('discount_price',)
+    not_manual = db.or_(Product.discount_price.is_(None), Product.campaign_id.isnot(None))
+    if 'discount_percent' in change:
+        pct = float(change['discount_percent'])
+        if not 0 < pct < 100:
+            raise ValueError('discount_percent must be between 0 and 100')
+        discount = db.func.round(Product.price * (1 - pct / 100), 2)
+        return {'discount_price': discount, 'campaign_id': campaign_id}, [discount >= 0.01, not_manual], ('discount_price',)
+    amount = float(change['discount_amount'])
+    if amount <= 0:
+        raise ValueError('discount_amount must be positive')
+    discount = db.func.round(Product.price - amount, 2)
+    return {'discount_price': discount, 'campaign_id': campaign_id}, [discount >= 0.01, not_manual], ('discount_price',)
+
+
+def preview(target, change, limit=5):
+    """{'matched': n, 'sample': [...]} without writing."""
+    conds = conditions(target)
+    vals, extra, _ = values(change)
+    conds += extra
+    matched = db.session.query(db.func.count(Product.id)).filter(*conds).scalar()
+    cols = [Product.id, Product.name, Product.price, Product.discount_price]
+    new = [vals.get('price', Product.price), vals.get('discount_price', Product.discount_price)]
+    sample = [{'id': r[0], 'name': r[1], 'price': r[2], 'discount_price': r[3], 'new_price': r[4],
+               'new_discount_price': r[5]}
+              for r in db.session.query(*cols, *new).filter(*conds).order_by(Product.id).limit(limit)]
+    return {'matched': matched, 'sample': sample}
+
+
+def create(data, now=None):
+    """Validate a request body, store the campaign and apply it if it is due. Raises ValueError."""
+    now = now or datetime.utcnow()
+    target, change = data.get('target'), data.get('change')
+    conditions(target)
+    values(change)
+    starts_at, ends_at = parse_time(data.get('starts_at')), parse_time(data.get('ends_at'))
+    if ends_at is not None:
+        if not any(k in change for k in ('discount_percent', 'discount_amount')):
+            raise ValueError('ends_at only applies to discount_percent / discount_amount campaigns')
+        if ends_at <= max(starts_at or now, now):
+            raise ValueError('ends_at must be after starts_at and in the future')
+    campaign = PriceCampaign(name=(data.get('name') or '')[:200] or None, target=json.dumps(target),
+                             change=json.dumps(change), starts_at=starts_at, ends_at=ends_at, status='scheduled')
+    db.session.add(campaign)
+    db.session.commit()
+    if starts_at is None or starts_at <= now:
+        apply(campaign.id)
+        db.session.refresh(campaign)
+    return campaign
+
+
+def _claim(campaign_id, from_status, to_status, **extra):
+    """Move a campaign between statuses if nobody else has; True if this caller won."""
+    return db.session.execute(
+        db.update(PriceCampaign).where(PriceCampaign.id == campaign_id, PriceCampaign.status == from_status)
+        .values(status=to_status, **extra)).rowcount == 1
+
+
+def apply(campaign_id):
+    """Run a scheduled campaign: one UPDATE plus one catalog bump, in one transaction. Returns rows changed or None."""
+    campaign = db.session.get(PriceCampaign, campaign_id)
+    if campaign is None:
+        return None
+    target, change = json.loads(campaign.target), json.loads(campaign.change)
+    status = 'active' if campaign.ends_at else 'applied'
+    if not _claim(campaign_id, 'scheduled', status, applied_at=datetime.utcnow()):
+        db.session.rollback()
+        return None
+    try:
+        vals, extra, fields = values(change, campaign_id)
+        conds = conditions(target) + extra
+    except ValueError as e:
+        # e.g. the category was deleted since the campaign was scheduled
+        db.session.execute(db.update(PriceCampaign).where(PriceCampaign.id == campaign_id)
+                           .values(status='failed', affected=0))
+        db.session.commit()
+        print(f'campaign {campaign_id} failed: {e}')
+        return None
+    affected = db.session.execute(db.update(Product).where(*conds).values(**vals)
+                                  .execution_options(synchronize_session=False)).rowcount
+    db.session.execute(db.update(PriceCampaign).where(PriceCampaign.id == campaign_id).values(affected=affected))
+    catalog.bump(fields)  # commits the UPDATEs and the claim together
+    return affected
+
+
+def end(campaign_id):
+    """End an active discount campaign (restoring prices) or cancel a scheduled one. Returns rows changed or None."""
+    if _claim(campaign_id, 'scheduled', 'cancelled', ended_at=datetime.utcnow()):
+        db.session.commit()
+        return 0
+    if not _claim(campaign_id, 'active', 'ended', ended_at=datetime.utcnow()):
+        db.session.rollback()
+        return None
+    restored = db.session.execute(
+        db.update(Product).where(Product.campaign_id == campaign_id)
+        .values(discount_price=None, campaign_id=None).execution_options(synchronize_session=False)).rowcount
+    catalog.bump(('discount_price',))
+    return restored
+
+
+def run_due(now=None):
+    """Start and end campaigns whose time has come. Needs an app context. Returns [(id, action, rows)]."""
+    now = now or datetime.utcnow()
+    done = []
+    due = (db.session.query(PriceCampaign.id)
+           .filter(PriceCampaign.status == 'scheduled', PriceCampaign.starts_at <= now).order_by(PriceCampaign.starts_at))
+    for (cid,) in due.all():
+        rows = apply(cid)
+        if rows is not None:
+            done.append((cid, 'applied', rows))
+    ending = (db.session.query(PriceCampaign.id)
+              .filter(PriceCampaign.status == 'active', PriceCampaign.ends_at <= now).order_by(PriceCampaign.ends_at))
+    for (cid,) in ending.all():
+        rows = end(cid)
+        if rows is not None:
+            done.append((cid, 'ended', rows))
+    return done
+
+
+def start(app):
+    """Poll for due campaigns in a daemon thread, unless this process already polls the app's database."""
+    with _pollers_lock:
+        uri = str(app.config.get('SQLALCHEMY_DATABASE_URI'))
+        if uri in _pollers:
+            return
+        _pollers.add(uri)
+
+    def loop():
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                with app.app_context():
+                    for cid, action, rows in run_due():
+                        print(f'campaign {cid} {action}: {rows} products')
+            except Exception as e:
+                print(f'campaign scheduler: {e}')
+    threading.Thread(target=loop, daemon=True, name='campaigns').start()
@@ -0,0 +1,169 @@
+"""Catalog version: bumped once per catalog write.
+
+Anything derived from product data keys on the version or registers an
+on_change() hook. That covers response ETags, the search index, and so on.
+
+bump() inserts a catalog_changes row and commits it together with the
+caller's pending changes, so a write and its bump land atomically. The new
+row id is the version. The row records the product fields that changed.
+bump() then runs this process's hooks. A caller that knows which products it
+touched passes their ids; changed_products() lists them, so readers of a
+single field (the snapshot's stock) can patch those rows instead of rebuilding.
+
+Other workers notice on their next poll(), which runs from a before_request
+hook at most once per CHECK_INTERVAL. It reads the rows added since the
+version the worker last saw and runs its hooks once with the union of their
+fields. Hooks can therefore ignore changes they do not care about, even
+after missing several bumps.
+
+A bulk write (a repricing, an import chunk) is one bump, not one per
+product. Rows older than KEEP versions are pruned.
+
+Hooks and the last seen version belong to the app (app.extensions['catalog'],
+set up by init_app()), so a second create_app() in the same process gets its
+own instead of adding to the first one's. Scripts without init_app() share a
+process-wide default.
+"""
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from database_models import db, CatalogChange
+
+CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', 2))  # seconds between version checks per worker
+KEEP = 1000  # change rows kept; a worker further behind than this treats every field as changed
+MAX_IDS = 1000  # product ids recorded per change; a bigger write records "unknown"
+
+_default = {'hooks': [], 'version': None, 'checked_at': 0.0}  # for code running outside an init_app() app
+_lock = threading.Lock()
+
+
+def _state(app=None):
+    """{'hooks': [(fn, fields or None)], 'version', 'checked_at'} of `app` (default: the current app)."""
+    if app is None and has_app_context():
+        app = current_app
+    state = app.extensions.get('catalog') if app is not None else None
+    return _default if state is None else state
+
+
+def on_change(fn, fields=None, app=None):
+    """Call fn(version, changed fields or None for "any", local) after a catalog change.
+    With `fields`, only when one of them changed. `local` is True in the worker that made the change.
+    Registers on `app` (default: the current app).
+    """
+    _state(app)['hooks'].append((fn, frozenset(fields) if fields else None))
+
+
+def _run_hooks(state, version, changed, local):
+    for fn, fields in state['hooks']:
+        if fields is None or changed is None or fields & changed:
+            try:
+                fn(version, changed, local)
+            except Exception as e:
+                print(f'catalog hook {getattr(fn, "__name__", fn)} failed: {e}')
+
+
+def _changes_since(version, until=None):
+    """(latest version, union of changed fields or None) for changes after `version` (up to `until`)."""
+    q = db.session.query(CatalogChange.id, CatalogChange.fields).filter(CatalogChange.id > version)
+    if until is not None:
+        q = q.filter(CatalogChange.id <= until)
+    rows = q.order_by(CatalogChange.id).all()
+    if not rows:
+        return version, frozenset()
+    changed = set()
+    for _, fields in rows:
+        if fields is None:
+            changed = None
+            break
+        changed.update(fields.split(','))
+    if rows[0][0] != version + 1 and version > 0:
+        changed = None  # pruned (or a rolled-back insert left a gap): unknown
+    return rows[-1][0], frozenset(changed) if changed is not None else None
+
+
+def changed_since(version):
+    """(current version, fields changed after `version` or None for "unknown / any"). Needs an app context."""
+    return _changes_since(version)
+
+
+def changed_products(version, field):
+    """(current version, ids of products whose `field` changed after `version`, or None if unknown). Needs an app context."""
+    rows = (db.session.query(CatalogChange.id, CatalogChange.fields, CatalogChange.product_ids)
+            .filter(CatalogChange.id > version).order_by(CatalogChange.id).all())
+    if not rows:
+        return version, frozenset()
+    if rows[0][0] != version + 1 and version > 0:
+        return rows[-1][0], None
+    ids = set()
+    for _, fields, product_ids in rows:
+        if fields is not None and field not in fields.split(','):
+            continue
+        if not product_ids:
+            return rows[-1][0], None
+        ids.update(int(i) for i in product_ids.split(','))
+    return rows[-1][0], frozenset(ids)
+
+
+def bump(fields=None, product_ids=None):
+    """Record a change and commit the session. Needs an app context. Returns the new version."""
+    ids = sorted({int(i) for i in product_ids}) if product_ids else None
+    change = CatalogChange(fields=','.join(sorted(fields)) if fields else None,
+                           product_ids=','.join(map(str, ids)) if ids and len(ids) <= MAX_IDS else None)
+    db.session.add(change)
+    db.session.commit()
+    version = change.id
+    if version % 100 == 0:
+        CatalogChange.query.filter(CatalogChange.id <= version - KEEP).delete(synchronize_session=False)
+        db.session.commit()
+    state = _state()
+    with _lock:
+        previous = state['version']
+        state['version'], state['checked_at'] = version, time.time()
+    if previous is not None and previous < version - 1:
+        # other workers' changes landed in between: their hooks run here too
+        _, missed = _changes_since(previous, until=version - 1)
+        _run_hooks(state, version, missed, False)
+    _run_hooks(state, version, frozenset(fields) if fields else None, True)
+    return version
+
+
+def poll(force=False):
+    """The current version, re-read at most every CHECK_INTERVAL. Runs hooks for other workers' changes."""
+    state = _state()
+    now = time.time()
+    previous = state['version']
+    if not force and previous is not None and now - state['checked_at'] < CHECK_INTERVAL:
+        return previous
+    if previous is None:
+        version, changed = db.session.query(db.func.max(CatalogChange.id)).scalar() or 0, frozenset()
+    else:
+        version, changed = _changes_since(previous)
+    with _lock:
+        state['version'], state['checked_at'] = max(version, state['version'] or 0), now
+    if previous is not None and version != previous:
+        _run_hooks(state, version, changed, False)
+    return version
+
+
+def version():
+    return poll()
+
+
+def etag(*parts):
+    """Weak-ETag value for a response built from catalog data (plus `parts` such as a page number)."""
+    return '-'.join(str(p) for p in ('catalog', poll()) + parts)
+
+
+def init_app(app):
+    """Give the app its own hooks and seen version, and check the version before requests,
+    so other workers' changes reach this one's hooks. Call it before registering hooks."""
+    if 'catalog' in app.extensions:
+        return
+    app.extensions['catalog'] = {'hooks': [], 'version': None, 'checked_at': 0.0}
+
+    @app.before_request
+    def _poll_catalog_version():
+        poll()
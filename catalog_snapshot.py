@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Columnar, memory-mapped snapshot of the product table for listing, filtering and sorting.
+Usage:
+  python catalog_snapshot.py build                 # build now if the catalog changed
+  python catalog_snapshot.py query [--sort price] [--category-id 3] [--q phone]
+
+One row per product, in id order. Each column is its own .npy file under
+cache/catalog_snapshot/<database>: ids, price, discount (NaN when there is none),
+effective price, rating, stock, category (-1 when there is none), plus
+name_offsets into names.bin, a blob of the lowercased names separated by
+newlines. Sort orders for price, rating and name are computed once at build
+time (argsort), so a sorted listing is one gather through the order plus a
+mask. Every worker maps the same read-only files, so the data sits in the
+page cache once, not once per worker.
+
+Snapshots live in a directory per database (a hash of its resolved URL,
+also recorded in current.json and checked on load), so an app or script
+opened on another database never reads or overwrites this one's listing.
+A snapshot is labelled with the catalog version (catalog.py) it was built
+from. Any product change that touches a snapshot column other than stock
+triggers a rebuild on the background pool: a bump in this worker, or one
+seen through the catalog version. Stock changes with every checkout, so it
+is not rebuilt for: each Reader keeps a small overlay of the products whose
+stock changed since the snapshot read it (catalog.changed_products()) and
+applies it to the in-stock filter. Only when the changed ids are unknown or
+more than OVERLAY_MAX does stock cause a rebuild. A file lock keeps it to one builder per box. Each build
+writes a new generation of files and then atomically replaces current.json
+to point at it, and readers switch on their next lookup. The previous
+generation stays on disk until the next save, so a reader that read
+current.json just before the switch can still open it. Until the first
+build finishes, query() returns None and callers fall back to SQL.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import background
+import catalog
+from disk_cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock, concurrent builds are merely wasted work
+    fcntl = None
+
+SNAPSHOT_DIR = os.environ.get('CATALOG_SNAPSHOT_DIR', os.path.join(CACHE_DIR, 'catalog_snapshot'))
+FIELDS = ('name', 'price', 'discount_price', 'rating', 'category_id')  # changes that need a rebuild
+OVERLAY_MAX = 10000  # stock changes patched per reader before a rebuild folds them in
+COLUMNS = ('ids', 'price', 'discount', 'effective', 'rating', 'stock', 'category', 'name_offsets',
+           'order_price', 'order_rating', 'order_name')
+SORTS = {'id', 'newest', 'price', '-price', 'rating', '-rating', 'name', '-name'}
+RELOAD_INTERVAL = 1.0  # seconds between current.json checks per worker
+BUILD_CHUNK = 50000
+
+
+def location():
+    """(directory, database id) for the bound database's snapshots. Needs an app context."""
+    from database_models import db
+    database = hashlib.sha1(db.engine.url.render_as_string(hide_password=False).encode()).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, database), database
+
+
+def _meta_path(directory):
+    return os.path.join(directory, 'current.json')
+
+
+class Snapshot:
+    """Read-only column arrays of one generation."""
+
+    def __init__(self, columns, names, version, generation, stock_version=None):
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+        self.names = names
+        self.byte_counts = None  # byte histogram of names, for picking the rarest byte of a needle
+        self.version = version
+        self.generation = generation
+        self.stock_version = version if stock_version is None else stock_version  # when the stock column was read
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name_mask(self, text):
+        """Rows whose lowercased name contains `text`. One vectorized pass over the blob finds
+        the needle's rarest byte; those candidates are checked against the rest of the needle
+        and mapped to rows through name_offsets."""
+        needle = np.frombuffer(text.lower().replace('\n', ' ').encode('utf-8'), np.uint8)
+        mask = np.zeros(len(self), bool)
+        m = len(self.names) - len(needle) + 1  # possible start positions
+        if not len(needle) or m <= 0:
+            return mask
+        if self.byte_counts is None:
+            self.byte_counts = np.bincount(self.names, minlength=256)
+        anchor = int(np.argmin(self.byte_counts[needle]))
+        starts = np.flatnonzero(self.names[anchor:anchor + m] == needle[anchor])
+        for i in range(len(needle)):
+            if i != anchor:
+                starts = starts[self.names[starts + i] == needle[i]]
+        mask[np.searchsorted(self.name_offsets, starts, side='right') - 1] = True
+        return mask
+
+    def select(self, category_ids=None, min_price=None, max_price=None, min_rating=None,
+               in_stock=False, on_sale=False, q=None, stock_overlay=None):
+        """Boolean mask of the rows matching every given filter (prices are effective prices).
+        `stock_overlay` ({product id: stock}) overrides the stock column for in_stock."""
+        mask = np.ones(len(self), bool)
+        if category_ids:
+            mask &= np.isin(self.category, np.asarray(category_ids, np.int32))
+        if min_price is not None:
+            mask &= self.effective >= min_price
+        if max_price is not None:
+            mask &= self.effective <= max_price
+        if min_rating is not None:
+            mask &= self.rating >= min_rating
+        if in_stock:
+            available = self.stock > 0
+            if stock_overlay and len(self):
+                pids = np.fromiter(stock_overlay.keys(), np.int64, len(stock_overlay))
+                stock = np.fromiter(stock_overlay.values(), np.int64, len(stock_overlay))
+                rows = np.minimum(np.searchsorted(self.ids, pids), len(self) - 1)
+                found = self.ids[rows] == pids
+                available[rows[found]] = stock[found] > 0
+            mask &= available
+        if on_sale:
+            mask &= ~np.isnan(self.discount)
+        if q:
+            mask &= self.name_mask(q)
+        return mask
+
+    def page(self, mask, sort='id', offset=0, limit=20):
+        """(total matches, product ids of rows [offset, offset + limit) in `sort` order)."""
+        descending = sort.startswith('-') or sort == 'newest'
+        key = sort.lstrip('-')
+        if key in ('id', 'newest'):
+            rows = np.flatnonzero(mask)
+        else:
+            order = getattr(self, f'order_{key}')
+            rows = order[mask[order]]
+        total = len(rows)
+        if descending:
+            rows = rows[::-1]
+        return total, self.ids[rows[offset:offset + limit]].tolist()
+
+
+def read_columns(chunk=BUILD_CHUNK):
+    """Column arrays and lowercased names from the products table, in id order. Needs an app context."""
+    from maintenance import iter_products
+    parts = {c: [] for c in ('ids', 'price', 'discount', 'rating', 'stock', 'category')}
+    names = []
+    for rows in iter_products(['name', 'price', 'discount_price', 'rating', 'stock', 'category_id'], chunk=chunk):
+        ids, name, price, discount, rating, stock, category = zip(*rows)
+        parts['ids'].append(np.array(ids, np.int64))
+        parts['price'].append(np.array(price, np.float64))  # None -> nan
+        parts['discount'].append(np.array(discount, np.float64))
+        parts['rating'].append(np.array([r or 0.0 for r in rating], np.float32))
+        parts['stock'].append(np.array([s or 0 for s in stock], np.int32))
+        parts['category'].append(np.array([-1 if c is None else c for c in category], np.int32))
+        names.extend((n or '').lower().replace('\n', ' ') for n in name)
+    dtypes = {'ids': np.int64, 'price': np.float64, 'discount': np.float64, 'rating': np.float32,
+              'stock': np.int32, 'category': np.int32}
+    cols = {c: (np.concatenate(v) if v else np.zeros(0, dtypes[c])) for c, v in parts.items()}
+    cols['price'] = np.nan_to_num(cols['price'], nan=0.0)
+    cols['effective'] = np.where(np.isnan(cols['discount']), cols['price'], cols['discount'])
+    return cols, names
+
+
+def build_columns(cols, names):
+    """Add name offsets and the precomputed sort orders; returns (columns, names blob)."""
+    encoded = [n.encode('utf-8') for n in names]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(e) + 1 for e in encoded], out=offsets[1:])
+    blob = b'\n'.join(encoded) + b'\n' if encoded else b''
+    ids = cols['ids']
+    n = len(ids)
+    cols['name_offsets'] = offsets
+    # ties broken by id, so paging through equal prices is stable
+    cols['order_price'] = np.lexsort((ids, cols['effective'])).astype(np.int32)
+    cols['order_rating'] = np.lexsort((ids, cols['rating'])).astype(np.int32)
+    cols['order_name'] = np.array(sorted(range(n), key=names.__getitem__), np.int32)
+    return cols, blob
+
+
+def save(cols, blob, version, directory, database):
+    """Write a new generation and point current.json at it (atomic). Returns the generation."""
+    os.makedirs(directory, exist_ok=True)
+    generation = f'{version}-{time.time_ns()}'
+    try:
+        with open(_meta_path(directory)) as f:
+            previous = json.load(f).get('generation')
+    except (OSError, ValueError):
+        previous = None
+    for name in COLUMNS:
+        np.save(os.path.join(directory, f'{generation}.{name}.npy'), cols[name])
+    with open(os.path.join(directory, f'{generation}.names.bin'), 'wb') as f:
+        f.write(blob)
+    _write_meta(directory, {'generation': generation, 'version': version, 'stock_version': version,
+                            'database': database, 'rows': len(cols['ids']), 'built_at': time.time()})
+    # the previous generation stays until the next save: a reader may have just read current.json
+    # pointing at it. Older ones go; readers still mapping them keep the open files alive.
+    keep = {generation, previous}
+    for name in os.listdir(directory):
+        if (name.endswith('.npy') or name.endswith('.bin')) and name.split('.')[0] not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+    return generation
+
+
+def _write_meta(directory, meta):
+    tmp = f'{_meta_path(directory)}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, _meta_path(directory))
+
+
+def _relabel(snapshot, version, directory, database):
+    """Mark an unchanged generation as current for a newer catalog version (its stock stays as read)."""
+    _write_meta(directory, {'generation': snapshot.generation, 'version': version,
+                            'stock_version': snapshot.stock_version, 'database': database,
+                            'rows': len(snapshot), 'built_at': time.time()})
+
+
+def load(directory, database):
+    """The current Snapshot of `database`, or None if none has been built."""
+    try:
+        with open(_meta_path(directory)) as f:
+            meta = json.load(f)
+        if meta.get('database') != database:
+            return None
+        g = meta['generation']
+        columns = {name: np.load(os.path.join(directory, f'{g}.{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        path = os.path.join(directory, f'{g}.names.bin')
+        names = np.memmap(path, np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+    except (OSError, ValueError, KeyError):
+        return None
+    return Snapshot(columns, names, meta['version'], g, meta.get('stock_version'))
+
+
+def build(log=print):
+    """Rebuild from the database unless the snapshot already matches the catalog version.
+    Needs an app context. Returns the version built, or None if there was nothing to do.
+    """
+    directory, database = location()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'build.lock'), 'w') as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None  # another process is building; readers pick its result up
+        built = None
+        while True:
+            current = load(directory, database)
+            if current is not None:
+                version, changed = catalog.changed_since(current.version)
+                if version == current.version:
+                    return built
+                if changed is not None and not changed & set(FIELDS):
+                    stock = catalog.changed_products(current.stock_version, 'stock')[1] if 'stock' in changed else ()
+                    if stock is not None and len(stock) <= OVERLAY_MAX:
+                        # e.g. only image placeholders changed, or stock that readers patch from their overlay
+                        _relabel(current, version, directory, database)
+                        continue
+            version = catalog.poll(force=True)  # read before the rows: a later change re-triggers
+            start = time.time()
+            cols, names = read_columns()
+            cols, blob = build_columns(cols, names)
+            save(cols, blob, version, directory, database)
+            built = version
+            log(f'catalog snapshot v{version}: {len(names)} products in {time.time() - start:.1f}s')
+
+
+class Reader:
+    """Per-process handle on one database's shared snapshot; rebuilds it in the background when the catalog changes."""
+
+    def __init__(self, directory, database, app=None):
+        self.directory = directory
+        self.database = database
+        self.app = app
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.meta_key = None
+        self.building = False
+        self.overlay = None  # {'key': (generation, stock_version), 'version', 'stock': {product id: stock}}
+        self.lock = threading.Lock()
+
+    def get(self):
+        """The latest snapshot; re-reads current.json at most every RELOAD_INTERVAL."""
+        now = time.time()
+        if now - self.checked_at >= RELOAD_INTERVAL:
+            self.checked_at = now
+            try:
+                st = os.stat(_meta_path(self.directory))
+                key = (st.st_ino, st.st_mtime_ns)
+            except OSError:
+                key = None
+            if key != self.meta_key:
+                snap = load(self.directory, self.database)
+                # a failed load (files replaced under us) keeps the snapshot we have and retries next time
+                if snap is not None or key is None:
+                    self.meta_key, self.snapshot = key, snap
+        return self.snapshot
+
+    def schedule(self, app):
+        """Rebuild on the background pool; several changes while a build runs make one more build."""
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        background.submit(self._build, app)
+
+    def _build(self, app):
+        try:
+            with app.app_context():
+                build()
+        finally:
+            with self.lock:
+                self.building = False
+            self.checked_at = 0.0  # look at current.json on the next get()
+
+    def stock_overlay(self, snap):
+        """{product id: current stock} for products whose stock changed after `snap` read it, or None
+        if that is unknown. Unknown or more than OVERLAY_MAX changes schedule a rebuild. Needs an app context."""
+        from database_models import db, Product
+        version = catalog.version()
+        key = (snap.generation, snap.stock_version)
+        with self.lock:
+            if self.overlay is None or self.overlay['key'] != key:
+                self.overlay = {'key': key, 'version': snap.stock_version, 'stock': {}}
+            overlay = self.overlay
+            if overlay['version'] >= version:
+                return overlay['stock']
+            since = overlay['version']
+        latest, ids = catalog.changed_products(since, 'stock')
+        if ids is None:
+            with self.lock:
+                self.overlay = None
+            if self.app is not None:
+                self.schedule(self.app)
+            return None
+        ids = sorted(ids)
+        rows = []
+        for i in range(0, len(ids), 500):
+            rows += db.session.query(Product.id, Product.stock).filter(Product.id.in_(ids[i:i + 500])).all()
+        with self.lock:
+            if overlay['version'] == since:
+                stock = dict(overlay['stock'])  # copied, so a query iterating the old dict is not disturbed
+                stock.update((pid, s or 0) for pid, s in rows)
+                stock.update((pid, 0) for pid in set(ids) - {pid for pid, _ in rows})  # deleted
+                overlay['stock'], overlay['version'] = stock, latest
+            stock = overlay['stock']
+        if len(stock) > OVERLAY_MAX and self.app is not None:
+            self.schedule(self.app)
+        return stock
+
+    def query(self, **filters):
+        """Like Snapshot.page(Snapshot.select(...)), or None before the first build (or while
+        stock changes are unknown and in_stock is asked for). Takes sort, offset and limit plus
+        select()'s filters. Returns (total, ids, snapshot version). Needs an app context for in_stock.
+        """
+        snap = self.get()
+        if snap is None:
+            return None
+        sort, offset, limit = filters.pop('sort', 'id'), filters.pop('offset', 0), filters.pop('limit', 20)
+        if filters.get('in_stock'):
+            filters['stock_overlay'] = self.stock_overlay(snap)
+            if filters['stock_overlay'] is None:
+                return None
+        total, ids = snap.page(snap.select(**filters), sort, offset, limit)
+        return total, ids, snap.version
+
+
+def start(app):
+    """The app's Reader (app.extensions['catalog_snapshot']). Builds the snapshot if it is missing
+    or behind, and rebuilds it whenever the catalog changes."""
+    with app.app_context():
+        reader = Reader(*location(), app=app)
+        app.extensions['catalog_snapshot'] = reader
+        catalog.on_change(lambda version, fields, local: reader.schedule(app), fields=FIELDS)
+        snap = reader.get()
+        behind = snap is None or snap.version < catalog.version()
+    if behind:
+        reader.schedule(app)
+    return reader
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Memory-mapped catalog snapshot.')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('build', help='Rebuild if the catalog changed since the last build')
+    q = sub.add_parser('query', help='Run a listing query against the snapshot')
+    q.add_argument('--sort', default='id', choices=sorted(SORTS))
+    q.add_argument('--category-id', type=int, action='append')
+    q.add_argument('--min-price', type=float)
+    q.add_argument('--max-price', type=float)
+    q.add_argument('--q')
+    q.add_argument('--limit', type=int, default=10)
+    args = ap.parse_args()
+
+    from database_models import create_db_app
+    app = create_db_app()
+    with app.app_context():
+        if args.cmd == 'build':
+            version = build()
+            print(f'built v{version}' if version is not None else 'already up to date')
+        else:
+            reader = Reader(*location())
+            for _ in range(3):
+                t = time.perf_counter()
+                result = reader.query(category_ids=args.category_id, min_price=args.min_price,
+                                      max_price=args.max_price, q=args.q, sort=args.sort, limit=args.limit)
+                print(f'{(time.perf_counter() - t) * 1000:.2f} ms')
+            print(result)
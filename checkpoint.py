@@ -0,0 +1,64 @@
+import json
+import os
+
+from disk_cache import CACHE_DIR
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, 'checkpoints')
+
+
+class Checkpoint:
+    """Resume state for long-running scripts, kept in a small JSON file.
+    Every save replaces the file atomically, so a crash leaves the previous state intact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    @classmethod
+    def for_script(cls, name):
+        return cls(os.path.join(CHECKPOINT_DIR, f'{name}.json'))
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def save(self, **updates):
+        self.state.update(updates)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.state = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DbCheckpoint(Checkpoint):
+    """Resume state kept in the script_checkpoints table instead of a file.
+    save() only stages the row in db.session: the caller's next commit writes it
+    together with the work it records, so the two cannot disagree after a crash.
+    Needs an app context.
+    """
+
+    def __init__(self, name):
+        from database_models import ScriptCheckpoint
+        self.name = name
+        row = ScriptCheckpoint.query.get(name)
+        self.state = json.loads(row.state) if row else {}
+
+    def save(self, **updates):
+        from database_models import db, ScriptCheckpoint
+        self.state.update(updates)
+        db.session.merge(ScriptCheckpoint(name=self.name, state=json.dumps(self.state)))
+
+    def clear(self):
+        from database_models import db, ScriptCheckpoint
+        self.state = {}
+        ScriptCheckpoint.query.filter_by(name=self.name).delete()
+        db.session.commit()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Precompute image placeholders (tiny blurred preview + dominant color) for every product.
+Usage:
+  python compute_lqip.py [--workers 4] [--chunk 1000] [--limit N] [--force] [--dry-run]
+
+Products are read in id order, --chunk at a time. Each distinct image url in
+a chunk is read once on a process pool. A product is skipped when the bytes
+hash to its image_hash (the placeholder is current) unless --force is given,
+so every image is read but only new ones are decoded. The chunk is written
+with one bulk update. Images that could not be read (network errors) are not
+written and are retried on the next run; images that could not be decoded are
+stored without a placeholder.
+"""
+import argparse
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from database_models import create_db_app
+from database_models import Product
+import lqip
+
+
+def shared_hash(products):
+    """The image_hash all `products` have, if they agree: the worker can then skip decoding an unchanged image."""
+    hashes = {r.image_hash for r in products}
+    return hashes.pop() if len(hashes) == 1 else None
+
+
+def main(workers=4, chunk=1000, limit=None, force=False, dry_run=False):
+    app = create_db_app()
+    folder = app.config['UPLOAD_FOLDER']
+    counts = {'seen': 0, 'unchanged': 0, 'updated': 0, 'failed': 0, 'retry': 0}
+    start = time.time()
+    with app.app_context(), ProcessPoolExecutor(max_workers=workers) as pool:
+        last_id = 0
+        while limit is None or counts['seen'] < limit:
+            size = chunk if limit is None else min(chunk, limit - counts['seen'])
+            rows = (Product.query.with_entities(Product.id, Product.image_url, Product.image_hash)
+                    .filter(Product.id > last_id).order_by(Product.id.asc()).limit(size).all())
+            if not rows:
+                break
+            last_id = rows[-1].id
+            counts['seen'] += len(rows)
+            by_url = defaultdict(list)
+            for r in rows:
+                by_url[r.image_url or ''].append(r)
+            urls = list(by_url)
+            known = [None if force else shared_hash(by_url[url]) for url in urls]
+            updates = []
+            for url, result in zip(urls, pool.map(lqip.placeholder, urls, [folder] * len(urls), known,
+                                                  chunksize=max(1, len(urls) // (workers * 4)))):
+                products = by_url[url]
+                if result.get('retry'):
+                    print(f"{url}: {result['retry']} ({len(products)} products, retried next run)")
+                    counts['retry'] += len(products)
+                    continue
+                if result.get('error'):
+                    print(f"{url}: {result['error']} ({len(products)} products)")
+                    counts['failed'] += len(products)
+                for r in products:
+                    if result.get('unchanged') or (not force and r.image_hash == result['image_hash']):
+                        counts['unchanged'] += 1
+                    else:
+                        updates.append(dict(result, id=r.id))
+            counts['updated'] += len(updates)
+            if not dry_run:
+                lqip.store(updates)
+            print(f"progress: up to id {last_id}, {counts['seen']} seen, {counts['updated']} updated, "
+                  f"{counts['unchanged']} unchanged, {counts['seen'] / max(time.time() - start, 1e-6):.0f} products/s")
+    print(f"Done. {counts} in {time.time() - start:.1f}s (dry_run={dry_run})")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Compute low-quality image placeholders for products.')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Worker processes')
+    ap.add_argument('--chunk', type=int, default=1000, help='Products per query / bulk update')
+    ap.add_argument('--limit', type=int, default=None, help='Max products to look at')
+    ap.add_argument('--force', action='store_true', help='Recompute even if the image is unchanged')
+    ap.add_argument('--dry-run', action='store_true', help='Compute but do not write to the DB')
+    args = ap.parse_args()
+    main(workers=args.workers, chunk=args.chunk, limit=args.limit, force=args.force, dry_run=args.dry_run)
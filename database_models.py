@@ -2,9 +2,19 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime
+import contextlib
+import json
+import os
+
+from sqlalchemy import exc
 
 from extensions import db
 
+try:
+    import fcntl
+except ImportError:  # Windows: workers on one box rely on the retry in init_db()
+    fcntl = None
+
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -48,6 +58,11 @@ class Product(db.Model):
     rating = db.Column(db.Float, default=0.0)
     asin = db.Column(db.String(80), nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
+    # inline placeholder shown until the image loads (see lqip.py)
+    lqip = db.Column(db.Text, nullable=True)
+    dominant_color = db.Column(db.String(7), nullable=True)
+    image_hash = db.Column(db.String(40), nullable=True)  # sha1 of the image bytes the placeholder was made from
+    campaign_id = db.Column(db.Integer, nullable=True, index=True)  # price campaign that set discount_price
 
     def to_dict(self):
         return {
@@ -60,7 +75,9 @@ class Product(db.Model):
             'asin': self.asin,
             'stock': self.stock,
             'image_url': self.image_url,
-            'category_id': self.category_id
+            'category_id': self.category_id,
+            'lqip': self.lqip,
+            'dominant_color': self.dominant_color
         }
 
 
@@ -130,3 +147,211 @@ class Payment(db.Model):
     def to_dict(self):
         return {'id': self.id, 'order_id': self.order_id, 'payment_method': self.payment_method, 'payment_status': self.payment_status, 'amount': self.amount, 'created_at': self.created_at.isoformat()}
 
+
+
+class ImageVariant(db.Model):
+    __tablename__ = 'image_variants'
+    id = db.Column(db.Integer, primary_key=True)
+    source_url = db.Column(db.String(400), nullable=False, index=True)
+    preset = db.Column(db.String(40), nullable=False)  # thumb / card / detail
+    format = db.Column(db.String(10), nullable=False)  # webp / avif
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    url = db.Column(db.String(400), nullable=False)
+
+    def to_dict(self):
+        return {'preset': self.preset, 'format': self.format, 'width': self.width, 'height': self.height, 'url': self.url}
+
+
+class UploadBlob(db.Model):
+    """An uploaded file stored once under its SHA-256 (see upload_store.py)."""
+    __tablename__ = 'upload_blobs'
+    hash = db.Column(db.String(64), primary_key=True)
+    ext = db.Column(db.String(10), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {'hash': self.hash, 'ext': self.ext, 'size': self.size, 'content_type': self.content_type, 'created_at': self.created_at.isoformat()}
+
+
+class ProductImage(db.Model):
+    __tablename__ = 'product_images'
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
+    blob_hash = db.Column(db.String(64), db.ForeignKey('upload_blobs.hash'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('product_id', 'blob_hash'),)
+
+    def to_dict(self):
+        return {'id': self.id, 'product_id': self.product_id, 'blob_hash': self.blob_hash, 'created_at': self.created_at.isoformat()}
+
+
+class CatalogChange(db.Model):
+    """One row per catalog write; the highest id is the catalog version (see catalog.py)."""
+    __tablename__ = 'catalog_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    fields = db.Column(db.String(200), nullable=True)  # comma-separated product fields touched; NULL = any
+    product_ids = db.Column(db.Text, nullable=True)  # comma-separated ids of the products touched; NULL = unknown / many
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ScriptCheckpoint(db.Model):
+    """Resume state of a script whose progress must commit with its writes (see checkpoint.DbCheckpoint)."""
+    __tablename__ = 'script_checkpoints'
+    name = db.Column(db.String(200), primary_key=True)
+    state = db.Column(db.Text, nullable=False)  # JSON
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PriceCampaign(db.Model):
+    """A set-based repricing: a price change or a discount rule over a target (see campaigns.py)."""
+    __tablename__ = 'price_campaigns'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=True)
+    target = db.Column(db.Text, nullable=False)  # JSON
+    change = db.Column(db.Text, nullable=False)  # JSON
+    starts_at = db.Column(db.DateTime, nullable=True)
+    ends_at = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='scheduled', index=True)  # scheduled/active/applied/ended/cancelled/failed
+    affected = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_at = db.Column(db.DateTime, nullable=True)
+    ended_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'target': json.loads(self.target),
+            'change': json.loads(self.change),
+            'starts_at': self.starts_at.isoformat() if self.starts_at else None,
+            'ends_at': self.ends_at.isoformat() if self.ends_at else None,
+            'status': self.status,
+            'affected': self.affected,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'applied_at': self.applied_at.isoformat() if self.applied_at else None,
+            'ended_at': self.ended_at.isoformat() if self.ended_at else None,
+        }
+
+
+# Columns added to existing tables after release. db.create_all() only creates
+# missing tables, so upgrade_schema() adds these to databases seeded earlier.
+# init_db() runs it at app start, one worker at a time (see schema_lock()); with
+# SCHEMA_AUTO_UPGRADE=0 that is left to `python database_models.py upgrade`.
+ADDED_COLUMNS = {
+    'products': [('lqip', 'TEXT'), ('dominant_color', 'VARCHAR(7)'), ('image_hash', 'VARCHAR(40)'),
+                 ('campaign_id', 'INTEGER')],
+    'catalog_changes': [('product_ids', 'TEXT')],
+}
+
+
+def missing_schema():
+    """Tables and table.columns the models need but the database lacks. Needs an app context."""
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = [t for t in db.metadata.tables if t not in tables]
+    for table, columns in ADDED_COLUMNS.items():
+        if table in tables:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            missing += [f'{table}.{name}' for name, _ in columns if name not in existing]
+    return missing
+
+
+def upgrade_schema():
+    """Create missing tables, then ALTER TABLE ... ADD COLUMN for any ADDED_COLUMNS the
+    database is missing. Needs an app context."""
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            if table not in tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            for name, ddl in columns:
+                if name not in existing:
+                    conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+
+@contextlib.contextmanager
+def schema_lock():
+    """Serialize schema upgrades between the workers on this box (a file lock under cache/).
+    Workers on other hosts can still race; init_db() re-checks after a failed upgrade."""
+    from disk_cache import CACHE_DIR
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, 'schema.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def db_config():
+    """Database settings shared by app.create_app() and create_db_app()."""
+    from upload_store import UPLOAD_FOLDER
+    return {
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///hotel.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'UPLOAD_FOLDER': UPLOAD_FOLDER,
+    }
+
+
+def init_db(app):
+    """Bind db to `app` and add whatever tables and ADDED_COLUMNS the database lacks
+    (upgrade_schema(), under schema_lock()). Only additive changes are made.
+    With SCHEMA_AUTO_UPGRADE=0 (config or env) nothing is changed, and a database
+    that is out of date raises with the command that upgrades it.
+    """
+    db.init_app(app)
+    with app.app_context():
+        missing = missing_schema()
+        if missing and app.config.get('SCHEMA_AUTO_UPGRADE', os.environ.get('SCHEMA_AUTO_UPGRADE', '1') != '0'):
+            with schema_lock():
+                for _ in range(3):
+                    missing = missing_schema()  # another worker may have upgraded while this one waited
+                    if not missing:
+                        break
+                    print(f'database schema: adding {", ".join(missing)}')
+                    try:
+                        upgrade_schema()
+                    except (exc.OperationalError, exc.ProgrammingError) as e:
+                        print(f'database schema upgrade failed, checking again: {e}')  # e.g. another host's worker
+                missing = missing_schema()
+        if missing:
+            raise RuntimeError(f'database schema is out of date (missing {", ".join(missing)}); '
+                               'run: python database_models.py upgrade')
+
+
+def create_db_app(config=None):
+    """A bare Flask app bound to the database, for scripts that only need db.session.
+
+    Unlike app.create_app() it registers no routes and imports none of the web
+    stack (JWT, CORS, metrics, rate limits, numpy-backed indexes), and starts no
+    background threads. `config` overrides settings as with create_app().
+    """
+    from flask import Flask
+    app = Flask(__name__)  # same root as app.py, so a relative sqlite path opens the same instance/ database
+    app.config.update(db_config())
+    if config:
+        app.config.update(config)
+    init_db(app)
+    return app
+
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Database schema.')
+    ap.add_argument('command', choices=['check', 'upgrade'],
+                    help='check: list what is missing; upgrade: add missing tables and columns')
+    args = ap.parse_args()
+    from flask import Flask
+    app = Flask(__name__)
+    app.config.update(db_config())
+    db.init_app(app)
+    with app.app_context():
+        if args.command == 'upgrade':
+            upgrade_schema()
+        missing = missing_schema()
+        print(f'missing: {", ".join(missing)}' if missing else 'schema is up to date')
+    raise SystemExit(1 if missing else 0)
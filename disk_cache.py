@@ -0,0 +1,118 @@
+"""Small SQLite-backed key/value cache shared by every worker process on a box.
+
+Each entry keeps a JSON value (or an error string for negative entries),
+the time it was stored and the time it stops being fresh. Callers decide
+what to do with stale entries; the cache only bounds its size (least
+recently used rows are evicted) and hands out short leases so that only
+one process refreshes a given key at a time.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+
+Entry = namedtuple('Entry', 'value error stored_at expires_at')
+
+# only rewrite accessed_at when it is older than this, so hot reads stay read-only
+_TOUCH_INTERVAL = 60
+_EVICT_EVERY = 100
+
+
+class DiskCache:
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                     'key TEXT PRIMARY KEY, value TEXT, error TEXT, '
+                     'stored_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed_at)')
+        conn.execute('CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, include_expired=True):
+        """Return the Entry for `key` or None. Expired entries are returned too
+        (callers may serve them stale) unless include_expired is False.
+        """
+        row = self._conn().execute(
+            'SELECT value, error, stored_at, expires_at, accessed_at FROM entries WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or (not include_expired and now >= row[3]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if now - row[4] > _TOUCH_INTERVAL:
+            self._conn().execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        value = json.loads(row[0]) if row[0] is not None else None
+        return Entry(value, row[1], row[2], row[3])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        self._conn().execute(
+            'INSERT OR REPLACE INTO entries (key, value, error, stored_at, expires_at, accessed_at) '
+            'VALUES (?, ?, NULL, ?, ?, ?)', (key, json.dumps(value), now, now + ttl, now))
+        self._maybe_evict()
+
+    def set_error(self, key, error, ttl):
+        """Record a failure. An existing good value is kept (so it can still be
+        served) and only its expiry is pushed out; otherwise a negative entry is stored.
+        """
+        now = time.time()
+        conn = self._conn()
+        cur = conn.execute('UPDATE entries SET error = ?, expires_at = ? WHERE key = ? AND value IS NOT NULL',
+                           (error, now + ttl, key))
+        if cur.rowcount == 0:
+            conn.execute('INSERT OR REPLACE INTO entries (key, value, error, stored_at, expires_at, accessed_at) '
+                         'VALUES (?, NULL, ?, ?, ?, ?)', (key, error, now, now + ttl, now))
+            self._maybe_evict()
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters for this process plus the shared entry count."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def _maybe_evict(self):
+        self._writes += 1
+        if self._writes % _EVICT_EVERY and self._writes > 1:
+            return
+        conn = self._conn()
+        excess = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM entries WHERE key IN '
+                         '(SELECT key FROM entries ORDER BY accessed_at LIMIT ?)', (excess,))
+
+    def acquire_lease(self, key, ttl):
+        """Try to become the only process refreshing `key` for the next `ttl` seconds."""
+        now = time.time()
+        cur = self._conn().execute(
+            'INSERT INTO leases (key, owner, until) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, until = excluded.until '
+            'WHERE leases.until < ?', (key, self.owner, now + ttl, now))
+        return cur.rowcount == 1
+
+    def release_lease(self, key):
+        self._conn().execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, self.owner))
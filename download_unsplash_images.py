@@ -2,140 +2,204 @@
 """
 Download product images using Unsplash Search API and save to uploads folder.
 Usage:
-  python download_unsplash_images.py --query <QUERY> [--dry-run] [--limit N] [--delay 0.5] [--batch 50]
+  python download_unsplash_images.py [--dry-run] [--limit N] [--workers 8] [--rate 50] [--batch 200] [--restart]
 
 Notes:
 - This will perform a search per product using product name and category.
-- Unsplash API rate limits apply (typically 50 requests/hour for demo, check your plan).
+- Searches run on a thread pool; a token bucket keeps API calls within the quota
+  (--rate is requests per hour; typically 50/hour for demo, check your plan).
+  Image downloads come from the CDN and only count against --max-inflight.
+- Products are handled in id order, one --batch at a time. After each batch the
+  image_url updates are written with one bulk update and the last finished id is
+  saved to a checkpoint, so an interrupted run picks up where it stopped
+  (use --restart to ignore the checkpoint). Products whose search or download
+  failed (errors, circuit open, non-200) are kept in the checkpoint and retried
+  first on the next run.
 - Images are saved to the app's UPLOAD_FOLDER and product.image_url is updated to point to /uploads/<filename>.
+- UNSPLASH_API_URL can point the searches at a local stand-in server.
 """
 import argparse
-import time
 import os
 import re
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from urllib.parse import quote_plus
 from werkzeug.utils import secure_filename
-from app import create_app
+from database_models import create_db_app
 from database_models import db, Product, Category
-from PIL import Image
-import requests
-from io import BytesIO
+import http_client
+import image_variants
+from checkpoint import Checkpoint
+from rate_limit import TokenBucket
 
 # Updated to use the provided render key directly
-RENDER_KEY = "4f0ddf6d6f2ba107b0e7141bb95f5019"
-
-parser = argparse.ArgumentParser(description='Download images from Unsplash based on a search query.')
-parser.add_argument('--query', required=True, help='Search query for Unsplash images')
-parser.add_argument('--dry-run', action='store_true', help='Simulate the download process without saving files')
-parser.add_argument('--limit', type=int, default=10, help='Maximum number of images to download')
-parser.add_argument('--delay', type=float, default=0.5, help='Delay between API requests (in seconds)')
-parser.add_argument('--batch', type=int, default=50, help='Number of images to fetch per API request')
+RENDER_KEY = os.environ.get('UNSPLASH_ACCESS_KEY', "4f0ddf6d6f2ba107b0e7141bb95f5019")
+UNSPLASH_API_URL = os.environ.get('UNSPLASH_API_URL', 'https://api.unsplash.com')
 
 # Update the headers to use the RENDER_KEY
 headers = {'Authorization': f'Client-ID {RENDER_KEY}'}
 
-args = parser.parse_args()
-
-app = create_app()
-with app.app_context():
-    upload_folder = app.config.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(__file__), 'uploads')
-    os.makedirs(upload_folder, exist_ok=True)
-
-    query = Product.query.order_by(Product.id)
-    total = query.count()
-    limit = args.limit or total
-    print(f'Total products: {total}, will process: {limit}')
-
-    processed = 0
-    updated = 0
-
-    for p in query.limit(limit).all():
-        processed += 1
-        # build search query
-        cat_name = None
-        if p.category_id:
-            c = Category.query.get(p.category_id)
-            cat_name = c.name if c else None
-        qparts = [p.name] + ([cat_name] if cat_name else [])
-        q = ' '.join([str(x) for x in qparts if x])
-        if not q.strip():
-            q = 'product'
-        try:
-            url = f'https://api.unsplash.com/search/photos?query={quote_plus(q)}&per_page=1'
-            r = requests.get(url, headers=headers, timeout=15)
-            if r.status_code != 200:
-                print(f'[{processed}] Search failed for id={p.id} q="{q}" status={r.status_code}')
-                time.sleep(args.delay)
-                continue
-            data = r.json()
-            results = data.get('results') or []
-            if not results:
-                print(f'[{processed}] No image found for id={p.id} q="{q}"')
-                time.sleep(args.delay)
-                continue
-            img_url = results[0]['urls'].get('regular') or results[0]['urls'].get('full')
-            if not img_url:
-                print(f'[{processed}] No image URL in result for id={p.id} q="{q}"')
-                time.sleep(args.delay)
-                continue
-            # download image
-            ext = '.jpg'
-            fname_base = f'{p.id}-{re.sub(r"[^A-Za-z0-9]+","-", p.name or "product")}'
-            fname = secure_filename(fname_base)[:120] + ext
-            dest = os.path.join(upload_folder, fname)
-            if not args.dry_run:
-                # stream download
-                with requests.get(img_url, stream=True, timeout=30) as img_r:
-                    if img_r.status_code == 200:
-                        with open(dest, 'wb') as fh:
-                            for chunk in img_r.iter_content(chunk_size=8192):
-                                if chunk:
-                                    fh.write(chunk)
-                    else:
-                        print(f'[{processed}] Failed to download image for id={p.id} (status {img_r.status_code})')
-                        time.sleep(args.delay)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Download images from Unsplash for each product.')
+    parser.add_argument('--query', default='', help='Extra keywords added to every product search')
+    parser.add_argument('--dry-run', action='store_true', help='Simulate the download process without saving files')
+    parser.add_argument('--limit', type=int, default=10, help='Maximum number of products to process (0 = all)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent search/download workers')
+    parser.add_argument('--max-inflight', type=int, default=16, help='Maximum products in flight at once')
+    parser.add_argument('--rate', type=float, default=float(os.environ.get('UNSPLASH_RATE_PER_HOUR', 50)),
+                        help='Search API quota in requests per hour')
+    parser.add_argument('--burst', type=int, default=1, help='Searches allowed back to back before rate limiting')
+    parser.add_argument('--batch', type=int, default=200, help='Products per DB bulk update / checkpoint')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file (default cache/checkpoints/...)')
+    parser.add_argument('--restart', action='store_true', help='Ignore any saved checkpoint')
+    return parser
+
+
+def search_image(q, limiter):
+    """Return the image URL of the first search hit for `q`, or None."""
+    limiter.acquire()
+    url = f'{UNSPLASH_API_URL}/search/photos?query={quote_plus(q)}&per_page=1'
+    r = http_client.get(url, headers=headers, timeout=15)
+    if r.status_code != 200:
+        raise RuntimeError(f'search failed (status {r.status_code})')
+    results = r.json().get('results') or []
+    if not results:
+        return None
+    return results[0]['urls'].get('regular') or results[0]['urls'].get('full')
+
+
+def download(img_url, dest):
+    tmp = f'{dest}.part'
+    with http_client.get(img_url, stream=True, timeout=30) as img_r:
+        if img_r.status_code != 200:
+            raise RuntimeError(f'download failed (status {img_r.status_code})')
+        with open(tmp, 'wb') as fh:
+            for chunk in img_r.iter_content(chunk_size=65536):
+                if chunk:
+                    fh.write(chunk)
+    os.replace(tmp, dest)
+
+
+def process(product, cat_name, args, limiter, upload_folder):
+    """Search and download one product's image. Returns (id, new image_url or None, message)."""
+    pid, name = product
+    qparts = [name, cat_name, args.query]
+    q = ' '.join([str(x) for x in qparts if x])
+    if not q.strip():
+        q = 'product'
+    img_url = search_image(q, limiter)
+    if not img_url:
+        return pid, None, f'No image found for id={pid} q="{q}"'
+    # download image
+    ext = '.jpg'
+    fname_base = f'{pid}-{re.sub(r"[^A-Za-z0-9]+", "-", name or "product")}'
+    fname = secure_filename(fname_base)[:120] + ext
+    dest = os.path.join(upload_folder, fname)
+    if args.dry_run:
+        return pid, None, f'[DRY] Would download for id={pid} -> {dest} (img source {img_url})'
+    download(img_url, dest)
+    return pid, f'/uploads/{fname}', f'Downloaded id={pid} -> {fname}'
+
+
+def run_batch(products, categories, args, limiter, upload_folder, pool):
+    """Process one batch with at most --max-inflight products in flight.
+    Returns (DB updates, ids of products that failed and should be retried)."""
+    updates = []
+    failed = []
+    pending = set()
+
+    def collect(done):
+        for fut in done:
+            try:
+                pid, new_url, message = fut.result()
+                print(message)
+                if new_url:
+                    updates.append({'id': pid, 'image_url': new_url})
+            except Exception as e:
+                print(f'Exception for id={fut.product_id}: {e}')
+                failed.append(fut.product_id)
+
+    for p in products:
+        if len(pending) >= args.max_inflight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        fut = pool.submit(process, (p.id, p.name), categories.get(p.category_id), args, limiter, upload_folder)
+        fut.product_id = p.id
+        pending.add(fut)
+    if pending:
+        collect(wait(pending)[0])
+    return updates, sorted(failed)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    app = create_db_app()
+    with app.app_context():
+        upload_folder = app.config.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(__file__), 'uploads')
+        os.makedirs(upload_folder, exist_ok=True)
+
+        checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else Checkpoint.for_script('download_unsplash_images')
+        if args.restart:
+            checkpoint.clear()
+        last_id = checkpoint.get('last_id', 0)
+        retry = checkpoint.get('failed', [])  # failed on an earlier run; tried again first, once
+        still_failed = []
+
+        categories = {c.id: c.name for c in Category.query.all()}
+        query = Product.query.filter(Product.id > last_id).order_by(Product.id)
+        total = query.count()
+        total += len(retry)
+        limit = min(args.limit or total, total)
+        print(f'Products left: {total} ({len(retry)} to retry, the rest after id {last_id}), will process: {limit}')
+
+        limiter = TokenBucket(args.rate / 3600.0, capacity=args.burst)
+        processed = 0
+        updated = 0
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            while processed < limit:
+                columns = Product.query.with_entities(Product.id, Product.name, Product.category_id)
+                size = min(args.batch, limit - processed)
+                if retry:
+                    ids, retry = retry[:size], retry[size:]
+                    batch = columns.filter(Product.id.in_(ids)).order_by(Product.id).all()
+                    processed += len(ids) - len(batch)  # deleted since
+                    if not batch:
                         continue
-                # update product image_url
-                p.image_url = f'/uploads/{fname}'
-                db.session.add(p)
-                updated += 1
-                if processed % args.batch == 0:
+                else:
+                    batch = columns.filter(Product.id > last_id).order_by(Product.id).limit(size).all()
+                    if not batch:
+                        break
+                updates, failed = run_batch(batch, categories, args, limiter, upload_folder, pool)
+                still_failed += failed
+                processed += len(batch)
+                if batch[-1].id > last_id:
+                    last_id = batch[-1].id
+                if not args.dry_run:
+                    # update product image_url
+                    db.session.bulk_update_mappings(Product, updates)
                     db.session.commit()
-                    print(f'Committed after {processed} items. Updated so far: {updated}')
-            else:
-                print(f'[DRY] Would download for id={p.id} -> {dest} (img source {img_url})')
-        except Exception as e:
-            print(f'[{processed}] Exception for id={p.id}: {e}')
-        time.sleep(args.delay)
-
-    if not args.dry_run:
-        db.session.commit()
-        print(f'Final commit done. Total updated: {updated}')
+                    # resized WebP/AVIF variants, decoded once per image in the process pool
+                    jobs = [(u['image_url'], image_variants.submit(upload_folder, os.path.basename(u['image_url'])))
+                            for u in updates]
+                    for url, job in jobs:
+                        try:
+                            image_variants.record_variants(url, job.result())
+                        except Exception as e:
+                            print(f'Variants failed for {url}: {e}')
+                    # failures stay in the checkpoint, so moving last_id past them loses nothing
+                    checkpoint.save(last_id=last_id, failed=sorted(set(still_failed + retry)))
+                    updated += len(updates)
+                    print(f'Committed after {processed} items (last id {last_id}). Updated so far: {updated}'
+                          + (f', failed: {len(still_failed)}' if still_failed else ''))
+        elapsed = time.time() - started
+        print(f'Processed {processed} products in {elapsed:.1f}s. Total updated: {updated}')
+        if still_failed:
+            print(f'{len(still_failed)} products failed and will be retried on the next run')
 
     print('Done')
 
-# Add lazy loading to images
-def lazy_load_images():
-    images = get_images()  # Assuming this function fetches image URLs
-    for image in images:
-        print(f'<img src="{image}" loading="lazy" class="loading" onload="this.classList.remove(\'loading\'); this.classList.add(\'loaded\');">')
-
-# Call the lazy load function
-lazy_load_images()
-
-# Function to download and resize images
-def download_and_resize_image(url, save_path, size=(300, 300)):
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        img = Image.open(BytesIO(response.content))
-        img = img.resize(size, Image.ANTIALIAS)
-        img.save(save_path, optimize=True, quality=85)
-    else:
-        print(f"Failed to download image: {url}")
-
-# Example usage
-images = get_images()  # Assuming this function fetches image URLs
-for idx, image_url in enumerate(images):
-    save_path = os.path.join('assets/images', f'image_{idx}.jpg')
-    download_and_resize_image(image_url, save_path)
+
+if __name__ == '__main__':
+    main()
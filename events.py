@@ -0,0 +1,357 @@
+"""Behavioural events from the storefront: product views, clicks and add-to-cart.
+
+scripts.js batches events and POSTs them to /api/events. The request only
+validates the batch and appends it to this worker's ring buffer; nothing on
+the request path touches a database. A daemon writer thread drains the
+buffer into an append-only SQLite file (EVENTS_PATH, separate from the main
+database so it never waits on the shop's writer lock) whenever FLUSH_SIZE
+events are waiting or FLUSH_INTERVAL seconds have passed, one transaction
+per flush. If the writer falls behind by more than the buffer holds, the
+oldest events are overwritten and counted as dropped.
+
+Compaction rolls raw events older than RAW_DAYS into per-day counts
+(event_counts: day, product_id, kind, n) and deletes them, COMPACT_BATCH rows
+per transaction so flushes get in between. It runs on a connection of its
+own and holds no lock the flushes need. Every COMPACT_INTERVAL seconds the
+writer starts it in a separate thread. A file lock (EVENTS_PATH.compact.lock)
+lets one process compact at a time; the other workers skip their turn.
+`python events.py compact` runs it by hand.
+
+EventLog.stats() reports what the buffer accepted, dropped and flushed, and
+how long flushes and compactions took; /api/admin/events/stats serves it.
+
+  python events.py stats
+  python events.py compact --days 0
+"""
+import atexit
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+from disk_cache import CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process compaction lock; concurrent runs only repeat the edge scans
+    fcntl = None
+
+EVENTS_PATH = os.environ.get('EVENTS_PATH', os.path.join(CACHE_DIR, 'events.db'))
+CAPACITY = int(os.environ.get('EVENTS_BUFFER', 65536))  # events held per worker between flushes
+FLUSH_SIZE = int(os.environ.get('EVENTS_FLUSH_SIZE', 2000))
+FLUSH_INTERVAL = float(os.environ.get('EVENTS_FLUSH_INTERVAL', 2))
+RAW_DAYS = float(os.environ.get('EVENTS_RAW_DAYS', 7))
+COMPACT_INTERVAL = float(os.environ.get('EVENTS_COMPACT_INTERVAL', 3600))
+COMPACT_BATCH = 100000
+
+KINDS = ('view', 'click', 'add_to_cart')
+MAX_BATCH = 500  # events per request
+MAX_AGE = 3600  # seconds an event may have waited in the browser
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, ts REAL NOT NULL, kind TEXT NOT NULL, '
+    'product_id INTEGER NOT NULL, user_id INTEGER, session TEXT, source TEXT)',
+    'CREATE INDEX IF NOT EXISTS events_ts ON events (ts)',
+    'CREATE TABLE IF NOT EXISTS event_counts (day INTEGER NOT NULL, product_id INTEGER NOT NULL, '
+    'kind TEXT NOT NULL, n INTEGER NOT NULL, PRIMARY KEY (day, product_id, kind)) WITHOUT ROWID',
+)
+
+
+def parse_batch(data, user_id=None, now=None):
+    """(rows, rejected) for a POSTed batch: {session, sent, events: [{type, product_id, t, source}]}.
+
+    `t` and `sent` are the browser's clock in ms; only their difference is used,
+    so a wrong client clock does not move events in time.
+    """
+    now = time.time() if now is None else now
+    items = data.get('events')
+    if not isinstance(items, list):
+        raise ValueError('events must be a list')
+    if len(items) > MAX_BATCH:
+        raise ValueError(f'at most {MAX_BATCH} events per batch')
+    session = data.get('session')
+    session = str(session)[:64] if session else None
+    sent = data.get('sent')
+    sent = sent if isinstance(sent, (int, float)) else None
+    rows = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        kind = item.get('type')
+        pid = item.get('product_id')
+        if isinstance(pid, str) and pid.isdigit():
+            pid = int(pid)
+        if kind not in KINDS or type(pid) is not int or pid <= 0:
+            continue
+        ts = now
+        t = item.get('t')
+        if sent is not None and isinstance(t, (int, float)):
+            ts -= min(MAX_AGE, max(0.0, (sent - t) / 1000))
+        source = item.get('source')
+        rows.append((ts, kind, pid, user_id, session, str(source)[:40] if source else None))
+    return rows, len(items) - len(rows)
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for ddl in SCHEMA:
+        conn.execute(ddl)
+    return conn
+
+
+class EventLog:
+    """A per-worker ring buffer of event rows and the thread that flushes it to SQLite."""
+
+    def __init__(self, path=EVENTS_PATH, capacity=CAPACITY, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 raw_days=RAW_DAYS, compact_interval=COMPACT_INTERVAL):
+        self.path = path
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.raw_days = raw_days
+        self.compact_interval = compact_interval
+        self._ring = [None] * capacity
+        self._head = 0  # events ever added
+        self._tail = 0  # events ever handed to the writer (or overwritten)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._retry = []  # rows from a failed flush, written first next time
+        self._last_compact = time.monotonic()
+        self._compactor = None
+        self.accepted = self.dropped = self.flushed = self.flushes = self.flush_errors = 0
+        self.flush_seconds = self.flush_seconds_max = 0.0
+        self.last_flush = None  # (rows, seconds)
+        self.compactions = 0
+        self.last_compaction = None  # {rows, counts, seconds}
+
+    def add(self, rows):
+        """Append rows to the buffer and wake the writer once FLUSH_SIZE are waiting."""
+        n = len(rows)
+        if not n:
+            return
+        cap = self.capacity
+        if n > cap:
+            rows, n = rows[-cap:], cap
+        with self._lock:
+            start = self._head % cap
+            end = start + n
+            if end <= cap:
+                self._ring[start:end] = rows
+            else:
+                self._ring[start:] = rows[:cap - start]
+                self._ring[:end - cap] = rows[cap - start:]
+            self._head += n
+            self.accepted += n
+            if self._head - self._tail > cap:
+                self.dropped += self._head - cap - self._tail
+                self._tail = self._head - cap
+            pending = self._head - self._tail
+        if self._thread is None:
+            self.start()
+        if pending >= self.flush_size:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return self._head - self._tail + len(self._retry)
+
+    def _take(self):
+        with self._lock:
+            cap = self.capacity
+            start, end = self._tail % cap, self._tail % cap + (self._head - self._tail)
+            if end <= cap:
+                rows = self._ring[start:end]
+            else:
+                rows = self._ring[start:] + self._ring[:end - cap]
+            self._tail = self._head
+        return rows
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name='events-writer')
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if self.compact_interval and time.monotonic() - self._last_compact > self.compact_interval:
+                    self._last_compact = time.monotonic()
+                    self._start_compaction()
+            except Exception as e:
+                print(f'events writer: {e}')
+
+    def _start_compaction(self):
+        """Compact in a thread of its own, so the writer keeps flushing meanwhile."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._compact_in_background, daemon=True, name='events-compact')
+        self._compactor.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact(wait=False)
+        except Exception as e:
+            print(f'events compaction: {e}')
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def flush(self):
+        """Write everything buffered in one transaction. Returns the number of rows written."""
+        with self._flush_lock:
+            rows = self._retry + self._take()
+            self._retry = []
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            try:
+                conn = self._db()
+                conn.execute('BEGIN')
+                conn.executemany('INSERT INTO events (ts, kind, product_id, user_id, session, source) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', rows)
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+                self.flush_errors += 1
+                # keep them for the next flush, within what the buffer would have held
+                self.dropped += max(0, len(rows) - self.capacity)
+                self._retry = rows[-self.capacity:]
+                print(f'events flush failed ({len(rows)} rows kept): {e}')
+                return 0
+            seconds = time.perf_counter() - start
+            self.flushed += len(rows)
+            self.flushes += 1
+            self.flush_seconds += seconds
+            self.flush_seconds_max = max(self.flush_seconds_max, seconds)
+            self.last_flush = (len(rows), seconds)
+            return len(rows)
+
+    def compact(self, raw_days=None, now=None, wait=True):
+        """Fold raw events older than raw_days into event_counts. Returns {rows, counts, seconds},
+        or None if another process is compacting and `wait` is False."""
+        raw_days = self.raw_days if raw_days is None else raw_days
+        cutoff = (time.time() if now is None else now) - raw_days * 86400
+        with compaction_lock(self.path, wait) as locked:
+            if not locked:
+                return None
+            conn = connect(self.path)  # not the writer's: flushes go on between batches
+            try:
+                result = compact(conn, cutoff)
+            finally:
+                conn.close()
+        self.compactions += 1
+        self.last_compaction = result
+        return result
+
+    def stats(self):
+        with self._lock:
+            buffered = self._head - self._tail
+        return {
+            'pid': os.getpid(),
+            'capacity': self.capacity,
+            'buffered': buffered + len(self._retry),
+            'accepted': self.accepted,
+            'dropped': self.dropped,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'flush_ms_avg': round(self.flush_seconds / self.flushes * 1000, 2) if self.flushes else None,
+            'flush_ms_max': round(self.flush_seconds_max * 1000, 2),
+            'last_flush': {'rows': self.last_flush[0], 'ms': round(self.last_flush[1] * 1000, 2)} if self.last_flush else None,
+            'compactions': self.compactions,
+            'last_compaction': self.last_compaction,
+        }
+
+
+@contextlib.contextmanager
+def compaction_lock(path, wait=True):
+    """Yields True while holding the events database's compaction lock (False if busy and not `wait`)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.compact.lock', 'w') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def compact(conn, cutoff):
+    """Roll events with ts < cutoff into event_counts, COMPACT_BATCH rows per transaction."""
+    start = time.perf_counter()
+    rows = 0
+    while True:
+        # the ts COMPACT_BATCH rows in bounds this transaction; for the last one, the cutoff does
+        edge = conn.execute('SELECT ts FROM events WHERE ts < ? ORDER BY ts LIMIT 1 OFFSET ?',
+                            (cutoff, COMPACT_BATCH)).fetchone()
+        # inclusive at the edge, so a run of equal timestamps cannot stall it
+        where, upto = ('ts <= ?', edge[0]) if edge else ('ts < ?', cutoff)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO event_counts (day, product_id, kind, n) '
+                f'SELECT CAST(ts / 86400 AS INTEGER), product_id, kind, count(*) FROM events WHERE {where} '
+                'GROUP BY 1, 2, 3 ON CONFLICT (day, product_id, kind) DO UPDATE SET n = n + excluded.n', (upto,))
+            rows += conn.execute(f'DELETE FROM events WHERE {where}', (upto,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if not edge:
+            break
+    counts = conn.execute('SELECT count(*) FROM event_counts').fetchone()[0]
+    return {'rows': rows, 'counts': counts, 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def table_stats(path=EVENTS_PATH):
+    """Row counts and file size of the events database (all workers)."""
+    if not os.path.exists(path):
+        return {'raw': 0, 'oldest': None, 'counts': 0, 'bytes': 0}
+    conn = connect(path)
+    try:
+        raw, oldest = conn.execute('SELECT count(*), min(ts) FROM events').fetchone()
+        counts = conn.execute('SELECT count(*) FROM event_counts').fetchone()[0]
+    finally:
+        conn.close()
+    size = sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+    return {'raw': raw, 'oldest': oldest, 'counts': counts, 'bytes': size}
+
+
+def init_app(app):
+    """The worker's EventLog, at app.config['EVENTS_PATH'] if set."""
+    log = EventLog(app.config.get('EVENTS_PATH', EVENTS_PATH))
+    app.extensions['events'] = log
+    return log
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    ap = argparse.ArgumentParser(description='Inspect or compact the events database')
+    ap.add_argument('command', choices=['stats', 'compact'])
+    ap.add_argument('--path', default=EVENTS_PATH)
+    ap.add_argument('--days', type=float, default=RAW_DAYS, help='keep raw events this many days (compact)')
+    args = ap.parse_args()
+    if args.command == 'compact':
+        conn = connect(args.path)
+        with compaction_lock(args.path):
+            result = compact(conn, time.time() - args.days * 86400)
+        print(f'compacted {result["rows"]} events in {result["seconds"]}s; {result["counts"]} daily counts')
+    print(json.dumps(table_stats(args.path), indent=2))
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+
+# Pools for the parts of aggregated responses (see /api/products/<id>/full). Separate from
+# background.py: these are waited on by a request, and a slow upstream must not delay
+# cache refreshes queued there (or the other way round). Parts calling an outside API get
+# their own smaller pool, so a slow upstream cannot hold the threads local parts need; when
+# every upstream thread is busy a part is skipped rather than queued behind them.
+_POOL_SIZES = {
+    'local': int(os.environ.get('FANOUT_WORKERS', 16)),
+    'upstream': int(os.environ.get('FANOUT_UPSTREAM_WORKERS', 8)),
+}
+_pools = {}  # name -> (executor, semaphore counting free threads)
+_lock = threading.Lock()
+
+
+def _get_pool(name):
+    if name not in _pools:
+        with _lock:
+            if name not in _pools:
+                size = _POOL_SIZES[name]
+                _pools[name] = (ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'fanout-{name}'),
+                                threading.BoundedSemaphore(size))
+    return _pools[name]
+
+
+class Fanout:
+    """Run independent parts of a response concurrently, each with its own deadline.
+
+    Parts are submitted as soon as their inputs are known; collect() then waits for
+    each one until `budget` seconds after the fan-out started. A part that misses its
+    deadline keeps running (it usually fills a cache for the next request), but the
+    response goes out without it and lists it in `timed_out`. So does a part skipped
+    because its pool had no free thread.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.started = time.monotonic()
+        self.parts = []  # (name, future or None if skipped, budget)
+
+    def submit(self, name, budget, fn, *args, pool='local'):
+        """Start fn(*args) on `pool` ('local', or 'upstream' for outside API calls)."""
+        executor, free = _get_pool(pool)
+        if not free.acquire(blocking=False):
+            self.parts.append((name, None, budget))
+            return
+
+        usage = metrics.current()  # the part's SQL and outbound time count towards the request
+
+        def run():
+            try:
+                with metrics.attach(usage):
+                    if self.app is None:
+                        return fn(*args)
+                    with self.app.app_context():
+                        return fn(*args)
+            finally:
+                free.release()
+        self.parts.append((name, executor.submit(run), budget))
+
+    def collect(self):
+        """({name: result}, [timed out names], {name: error}) once every part is done or past its deadline."""
+        results, timed_out, errors = {}, [], {}
+        for name, future, budget in sorted(self.parts, key=lambda p: p[2]):
+            if future is None:
+                timed_out.append(name)
+                continue
+            try:
+                results[name] = future.result(timeout=max(0.0, self.started + budget - time.monotonic()))
+            except TimeoutError:
+                timed_out.append(name)
+            except Exception as e:
+                errors[name] = str(e)
+        return results, timed_out, errors
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Delete content-addressed uploads that no product refers to.
+Usage:
+  python gc_uploads.py [--min-age 24] [--apply]
+
+A blob is in use while a product_images row points at it or a product's
+image_url is its URL. Everything else older than --min-age hours is removed
+together with its resized variants (files and image_variants rows) and its
+upload_blobs row. Without --apply it only reports what would be deleted.
+The age grace period keeps blobs that were just uploaded for a product that
+has not been saved yet.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+from database_models import create_db_app
+from database_models import db, Product, UploadBlob, ProductImage, ImageVariant
+import upload_store
+
+
+def find_orphans(min_age_hours):
+    referenced = {h for (h,) in db.session.query(ProductImage.blob_hash).distinct()}
+    for (url,) in Product.query.with_entities(Product.image_url).filter(Product.image_url.like('/uploads/%')):
+        parsed = upload_store.parse_blob_url(url)
+        if parsed:
+            referenced.add(parsed[0])
+    cutoff = datetime.utcnow() - timedelta(hours=min_age_hours)
+    return [b for b in UploadBlob.query.filter(UploadBlob.created_at < cutoff) if b.hash not in referenced]
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def main(min_age=24.0, dry_run=True):
+    app = create_db_app()
+    folder = app.config['UPLOAD_FOLDER']
+    with app.app_context():
+        orphans = find_orphans(min_age)
+        freed = 0
+        for blob in orphans:
+            url = upload_store.blob_url(blob.hash, blob.ext)
+            variants = ImageVariant.query.filter_by(source_url=url).all()
+            print(f"{'would delete' if dry_run else 'deleting'} {url} ({blob.size} bytes, {len(variants)} variants)")
+            freed += blob.size or 0
+            if dry_run:
+                continue
+            remove_file(os.path.join(folder, upload_store.blob_path(blob.hash, blob.ext)))
+            for v in variants:
+                remove_file(os.path.join(folder, v.url[len('/uploads/'):]))
+                db.session.delete(v)
+            db.session.delete(blob)
+            db.session.commit()
+        print(f"Done. {len(orphans)} orphaned blobs, {freed} bytes (dry_run={dry_run})")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Garbage-collect unreferenced uploads.')
+    ap.add_argument('--min-age', type=float, default=24.0, help='Only delete blobs older than this many hours')
+    ap.add_argument('--apply', action='store_true', help='Delete files and rows (default is dry-run)')
+    args = ap.parse_args()
+    main(min_age=args.min_age, dry_run=not args.apply)
@@ -0,0 +1,207 @@
+"""Shared outbound HTTP client.
+
+Every module that talks to a third-party API goes through here so calls reuse
+one pooled keep-alive `requests.Session` (no fresh TCP+TLS handshake per call),
+get jittered retries on connection errors and 502/503/504, and stop hammering
+a host that keeps failing (per-host circuit breaker). Per-host latency counters
+are kept for `stats()`.
+
+Only idempotent methods are retried by default. A POST (e.g. a paid conversion)
+may have been carried out even when the response never arrived, so it is sent
+once unless the caller passes `retries=` itself. `max_duration()` is the
+longest a call can block, for callers that hold a lease or deadline around it.
+
+Usage is the same as `requests`: `http_client.get(url, params=..., timeout=...)`.
+Errors are still `requests.RequestException` subclasses.
+
+`requests` itself (with urllib3, certifi, charset detection) is imported on
+the first call, not with this module. Importing http_client is cheap, so
+metrics.py and other modules can import it without slowing down startup.
+"""
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))  # connections kept per host
+RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.3))
+BREAKER_THRESHOLD = int(os.environ.get('HTTP_BREAKER_THRESHOLD', 5))  # consecutive failures
+BREAKER_COOLDOWN = float(os.environ.get('HTTP_BREAKER_COOLDOWN', 30))
+
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class _HostState:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+_session = None
+_lock = threading.Lock()
+_hosts = {}
+_listeners = []
+_circuit_open_error = None
+
+
+def _circuit_open_class():
+    """CircuitOpenError, defined on first use because it subclasses requests.ConnectionError."""
+    global _circuit_open_error
+    if _circuit_open_error is None:
+        import requests
+
+        class CircuitOpenError(requests.ConnectionError):
+            """Raised without touching the network while a host's breaker is open."""
+
+        _circuit_open_error = CircuitOpenError
+    return _circuit_open_error
+
+
+def __getattr__(name):
+    if name == 'CircuitOpenError':
+        return _circuit_open_class()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def add_listener(fn):
+    """Call fn(host, seconds, ok) after every attempt (used by metrics.py)."""
+    _listeners.append(fn)
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+                s.mount('http://', adapter)
+                s.mount('https://', adapter)
+                _session = s
+    return _session
+
+
+def _host(host):
+    state = _hosts.get(host)
+    if state is None:
+        with _lock:
+            state = _hosts.setdefault(host, _HostState())
+    return state
+
+
+def _allow(state):
+    with _lock:
+        if state.opened_at is None:
+            return True
+        if time.time() - state.opened_at < BREAKER_COOLDOWN or state.trial_running:
+            state.rejected += 1
+            return False
+        # half-open: let a single trial request through
+        state.trial_running = True
+        return True
+
+
+def _record(state, seconds, ok):
+    with _lock:
+        state.requests += 1
+        state.seconds += seconds
+        state.max_seconds = max(state.max_seconds, seconds)
+        state.trial_running = False
+        if ok:
+            state.failures = 0
+            state.opened_at = None
+        else:
+            state.errors += 1
+            state.failures += 1
+            if state.failures >= BREAKER_THRESHOLD:
+                state.opened_at = time.time()
+
+
+def _notify(host, seconds, ok):
+    for fn in _listeners:
+        fn(host, seconds, ok)
+
+
+def default_retries(method):
+    return RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+
+
+def max_duration(timeout, retries=RETRIES):
+    """Worst-case seconds a request with this timeout and retry count can take, backoff included."""
+    per_try = sum(timeout) if isinstance(timeout, (tuple, list)) else timeout
+    return per_try * (retries + 1) + BACKOFF * (2 ** retries - 1)
+
+
+def request(method, url, retries=None, **kwargs):
+    """Send a request through the shared session with retries and the circuit breaker.
+    `retries` defaults to RETRIES for idempotent methods and 0 for the rest."""
+    import requests
+    host = urlsplit(url).netloc
+    state = _host(host)
+    retries = default_retries(method) if retries is None else retries
+    session = get_session()
+    for attempt in range(retries + 1):
+        if not _allow(state):
+            raise _circuit_open_class()(f'circuit open for {host}')
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            elapsed = time.perf_counter() - start
+            _record(state, elapsed, ok=False)
+            _notify(host, elapsed, False)
+            # only a dropped connection or a timeout may go through on another try
+            if attempt == retries or not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                raise
+        except BaseException:
+            with _lock:
+                state.trial_running = False  # else a half-open host would reject every later call
+            raise
+        else:
+            failed = resp.status_code in RETRY_STATUSES
+            elapsed = time.perf_counter() - start
+            _record(state, elapsed, ok=not failed)
+            _notify(host, elapsed, not failed)
+            if not failed or attempt == retries:
+                return resp
+            resp.close()
+        with _lock:
+            state.retries += 1
+        time.sleep(random.uniform(0, BACKOFF * (2 ** attempt)))
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def stats():
+    """Per-host counters: {host: {requests, errors, retries, rejected, avg_ms, max_ms, circuit}}"""
+    out = {}
+    with _lock:
+        for host, s in _hosts.items():
+            out[host] = {
+                'requests': s.requests,
+                'errors': s.errors,
+                'retries': s.retries,
+                'rejected': s.rejected,
+                'avg_ms': round(1000 * s.seconds / s.requests, 2) if s.requests else 0.0,
+                'max_ms': round(1000 * s.max_seconds, 2),
+                'circuit': 'open' if s.opened_at is not None else 'closed',
+            }
+    return out
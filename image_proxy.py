@@ -0,0 +1,247 @@
+"""Resize proxy for external product images.
+
+`/img/<preset>/<product_id>` fetches the product's image_url once, scales it
+to one of the image_variants PRESETS and keeps the result in a size-bounded
+LRU directory under cache/img. The bound (IMG_PROXY_MAX_BYTES) is for the
+directory, shared by every worker process, not per process. Cache hits are
+served straight from disk.
+The source image is cached too, once per URL, and every preset and format is
+derived from it. Misses are coalesced per URL across threads (single flight)
+and across worker processes (a file lock per stripe of URLs, re-checking the
+cache once it is held), so a cold product page costs one upstream fetch. Product payloads carry the proxy URLs with a
+`v=` version derived from the source URL. While the version is current the
+response is immutable for a year; a changed image_url changes the URL.
+"""
+import contextlib
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+import http_client
+from disk_cache import CACHE_DIR
+from image_variants import PRESETS
+from singleflight import SingleFlight
+
+PROXY_DIR = os.environ.get('IMG_PROXY_DIR', os.path.join(CACHE_DIR, 'img'))
+MAX_BYTES = int(os.environ.get('IMG_PROXY_MAX_BYTES', 512 * 1024 * 1024))  # for the directory, across all workers
+MAX_SOURCE_BYTES = int(os.environ.get('IMG_PROXY_MAX_SOURCE_BYTES', 15 * 1024 * 1024))
+FETCH_TIMEOUT = float(os.environ.get('IMG_PROXY_TIMEOUT', 10))
+FETCH_LOCKS = 256  # lock files under PROXY_DIR that serialize source fetches across workers
+MAX_AGE = 86400  # unversioned or outdated URLs
+IMMUTABLE_MAX_AGE = 31536000
+QUALITY = {'webp': 80, 'jpeg': 82}
+
+try:
+    import fcntl
+except ImportError:  # Windows: the size bound holds per process only
+    fcntl = None
+
+_flight = SingleFlight()
+
+
+class FileLRU:
+    """Files in a directory, evicted least-recently-used first once their total size passes max_bytes.
+
+    Worker processes share the directory, so the running total is kept in it
+    too: put() updates a `.size` file under an flock on `.lock`. When the
+    total passes max_bytes, that put() re-scans the directory and deletes the
+    oldest files by mtime (get() touches what it reads) down to LOW_WATER of
+    max_bytes. However many workers write, the directory stays within
+    max_bytes plus the files being written at that moment. A lost or
+    unreadable `.size` is rebuilt from a scan.
+    """
+
+    LOW_WATER = 0.9  # evict below the limit, so the next put() does not scan again
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serialize size updates across threads and worker processes."""
+        with self.lock, open(os.path.join(self.path, '.lock'), 'w') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _scan(self):
+        """[(mtime, name, size)] of the cached files, oldest first."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, entry.name, st.st_size))
+        entries.sort()
+        return entries
+
+    def _total(self):
+        """Bytes recorded in `.size`, or None if it is missing or unreadable."""
+        try:
+            with open(os.path.join(self.path, '.size')) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _evict(self):
+        """Delete the oldest files down to LOW_WATER of max_bytes (keeping the newest). Returns the new total."""
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        for _, name, size in entries[:-1]:
+            if total <= self.max_bytes * self.LOW_WATER:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def get(self, name):
+        """Bytes of `name`, or None. Marks it recently used."""
+        path = os.path.join(self.path, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # the recency order eviction goes by
+        except OSError:
+            pass
+        return data
+
+    def put(self, name, data):
+        path = os.path.join(self.path, name)
+        tmp = os.path.join(self.path, f'.{name}.{os.getpid()}.{threading.get_ident()}')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self._locked():
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+            total = self._total()
+            if total is None:
+                total = sum(size for _, _, size in self._scan())
+            else:
+                total += len(data) - replaced
+            if total > self.max_bytes:
+                total = self._evict()
+            with open(os.path.join(self.path, '.size'), 'w') as f:
+                f.write(str(total))
+
+    def stats(self):
+        total = self._total()
+        return {'files': sum(1 for name in os.listdir(self.path) if not name.startswith('.')),
+                'bytes': total if total is not None else sum(size for _, _, size in self._scan()),
+                'max_bytes': self.max_bytes}
+
+
+_lru = None
+_lru_lock = threading.Lock()
+
+
+def get_lru():
+    global _lru
+    if _lru is None:
+        with _lru_lock:
+            if _lru is None:
+                _lru = FileLRU(PROXY_DIR, MAX_BYTES)
+    return _lru
+
+
+def version(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+
+
+def is_external(url):
+    return bool(url) and url.startswith(('http://', 'https://'))
+
+
+def proxy_urls(product_id, url):
+    """{preset: '/img/<preset>/<id>?v=...'} for an external image url, else None."""
+    if not is_external(url):
+        return None
+    v = version(url)
+    return {preset: f'/img/{preset}/{product_id}?v={v}' for preset in PRESETS}
+
+
+def fetch_source(url):
+    resp = http_client.get(url, timeout=FETCH_TIMEOUT, stream=True)
+    try:
+        resp.raise_for_status()
+        data = io.BytesIO()
+        for chunk in resp.iter_content(1 << 16):
+            data.write(chunk)
+            if data.tell() > MAX_SOURCE_BYTES:
+                raise ValueError(f'source image larger than {MAX_SOURCE_BYTES} bytes')
+        return data.getvalue()
+    finally:
+        resp.close()
+
+
+def resize(data, width, fmt):
+    with Image.open(io.BytesIO(data)) as im:
+        img = ImageOps.exif_transpose(im)
+        img = img.convert('RGB')
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, fmt.upper(), quality=QUALITY[fmt])
+    return out.getvalue()
+
+
+@contextlib.contextmanager
+def _fetch_lock(key):
+    """Held by one worker process at a time per stripe of source keys."""
+    with open(os.path.join(get_lru().path, f'.fetch-{int(key[:2], 16) % FETCH_LOCKS}.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def get_source(url, key):
+    """Source bytes of `url` (cached as `<key>.src`), fetched once however many threads and workers ask."""
+    lru = get_lru()
+    name = f'{key}.src'
+
+    def load():
+        data = lru.get(name)
+        if data is not None:
+            return data
+        with _fetch_lock(key):
+            data = lru.get(name)  # another worker may have fetched it while this one waited
+            if data is None:
+                data = fetch_source(url)
+                lru.put(name, data)
+        return data
+    return _flight.do(name, load)
+
+
+def get_resized(url, preset, fmt):
+    """(bytes, etag) of `url` resized to `preset` in `fmt`, fetching and resizing only on a cache miss."""
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    name = f'{key}-{preset}.{fmt}'
+    lru = get_lru()
+    data = lru.get(name)
+    if data is None:
+        def build():
+            cached = lru.get(name)  # a flight that just finished may have stored it
+            if cached is not None:
+                return cached
+            out = resize(get_source(url, key), PRESETS[preset], fmt)
+            lru.put(name, out)
+            return out
+        data = _flight.do(name, build)
+    return data, f'{key[:16]}-{preset}-{fmt}'
@@ -0,0 +1,117 @@
+"""Resized WebP/AVIF derivatives of uploaded product images.
+
+Each upload is decoded once with Pillow and scaled down through the PRESETS
+(largest first, each step resizing the previous result), and every size is
+encoded in each supported format. The work runs in a process pool so the
+upload request only pays for saving the original. Once a job finishes its
+variants are recorded in the `image_variants` table, and the product
+endpoints return them as srcset-ready data.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+import background
+
+# preset -> target width in px (height follows the aspect ratio)
+PRESETS = {'detail': 800, 'card': 320, 'thumb': 160}
+FORMATS = [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+QUALITY = {'avif': 55, 'webp': 78}
+VARIANT_DIR = 'variants'  # inside UPLOAD_FOLDER
+
+_MAX_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+_pool = None
+_lock = threading.Lock()
+
+
+def generate_variants(src_path, out_dir, stem):
+    """Decode `src_path` once and write every preset/format to `out_dir`.
+    Returns a list of {preset, format, width, height, filename}. Runs in a worker process.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with Image.open(src_path) as im:
+        img = ImageOps.exif_transpose(im)
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    out = []
+    for preset, width in sorted(PRESETS.items(), key=lambda kv: -kv[1]):
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        for fmt in FORMATS:
+            filename = f'{stem}-{preset}.{fmt}'
+            img.save(os.path.join(out_dir, filename), fmt.upper(), quality=QUALITY[fmt])
+            out.append({'preset': preset, 'format': fmt, 'width': img.width, 'height': img.height,
+                        'filename': filename})
+    return out
+
+
+def get_pool():
+    """Process pool shared by the image jobs (variants, placeholders)."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=_MAX_WORKERS)
+    return _pool
+
+
+def submit(upload_folder, filename):
+    """Queue variant generation for uploads/<filename> in the process pool; returns a Future."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return get_pool().submit(generate_variants, os.path.join(upload_folder, filename),
+                              os.path.join(upload_folder, VARIANT_DIR), stem)
+
+
+def record_variants(source_url, variants):
+    """Replace the stored variants of `source_url`. Needs an app context."""
+    from database_models import db, ImageVariant
+    ImageVariant.query.filter_by(source_url=source_url).delete()
+    db.session.add_all([ImageVariant(source_url=source_url, preset=v['preset'], format=v['format'],
+                                     width=v['width'], height=v['height'],
+                                     url=f"/uploads/{VARIANT_DIR}/{v['filename']}") for v in variants])
+    import catalog
+    catalog.bump(('image_variants',))
+
+
+def schedule(app, source_url, filename):
+    """Generate and record variants for an upload without blocking the caller."""
+    fut = submit(app.config['UPLOAD_FOLDER'], filename)
+
+    def store(variants):
+        with app.app_context():
+            record_variants(source_url, variants)
+
+    def done(f):
+        if f.exception() is not None:
+            print(f'image variants failed for {source_url}: {f.exception()}')
+            return
+        background.submit(store, f.result())
+    fut.add_done_callback(done)
+    return fut
+
+
+def srcset_data(variants):
+    """Group ImageVariant rows into {'srcset': {format: '<url> <w>w, ...'}, 'sizes': [...]}."""
+    by_format = {}
+    seen = set()
+    for v in sorted(variants, key=lambda v: v.width):
+        # small originals give several presets the same width; srcset needs unique descriptors
+        if (v.format, v.width) not in seen:
+            seen.add((v.format, v.width))
+            by_format.setdefault(v.format, []).append(f'{v.url} {v.width}w')
+    return {
+        'srcset': {fmt: ', '.join(parts) for fmt, parts in by_format.items()},
+        'sizes': [v.to_dict() for v in variants],
+    }
+
+
+def variants_for(urls):
+    """{source_url: srcset_data} for the uploaded images among `urls` (one query per 500 urls)."""
+    from database_models import ImageVariant
+    uploads = sorted({u for u in urls if u and u.startswith('/uploads/')})
+    rows = {}
+    for i in range(0, len(uploads), 500):
+        for v in ImageVariant.query.filter(ImageVariant.source_url.in_(uploads[i:i + 500])):
+            rows.setdefault(v.source_url, []).append(v)
+    return {url: srcset_data(vs) for url, vs in rows.items()}
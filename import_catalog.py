@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Import a supplier catalog (CSV or JSONL) into the products table.
+Usage:
+  python import_catalog.py catalog.csv [--key asin] [--chunk 5000] [--workers 4] [--dry-run]
+  python import_catalog.py catalog.jsonl --create-categories --errors rejected.jsonl
+  python import_catalog.py catalog.csv --restart
+
+Columns / keys: name, description, price, discount_price, stock, rating, asin,
+image_url, and category (name) or category_id. Prices may carry a currency
+sign and thousands separators ("₹1,299.00").
+
+The file is read as a stream and cut into --chunk rows. Chunks are validated
+and normalized on a process pool, a few ahead of the writer. Each chunk is
+upserted in order: products whose --key (asin or name) already exists are
+updated with one bulk update, the rest are bulk inserted. Rows without a
+--key value are rejected, since nothing could match them on a rerun. The
+byte offset reached in the file is stored in the script_checkpoints table
+and committed in the same transaction as the chunk, so a crash can neither
+skip a chunk nor import one twice. A crashed or interrupted import resumes
+mid-file; --restart ignores the checkpoint. Rows that are not valid UTF-8 are
+rejected like any other bad row. Memory stays bounded by a few chunks
+however large the file is.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from database_models import create_db_app
+from database_models import db, Product, Category
+from checkpoint import DbCheckpoint
+import catalog
+
+FIELDS = ('name', 'description', 'price', 'discount_price', 'stock', 'rating', 'asin', 'image_url')
+INSERT_DEFAULTS = {'description': '', 'discount_price': None, 'stock': 0, 'rating': 0.0, 'asin': None, 'image_url': ''}
+_NUMBER = re.compile(r'[^0-9.\-]')
+_BAD_BYTES = re.compile('[\udc80-\udcff]')  # undecodable bytes, kept by errors='surrogateescape'
+BAD_UTF8 = 'invalid UTF-8'
+
+
+class LineReader:
+    """Iterates decoded lines of a binary file and tracks the byte offset consumed so far.
+    csv.reader pulls lines only as it needs them, so after each record `offset` is where the next one starts.
+    Bytes that are not UTF-8 decode to lone surrogates, so read_records() can reject just their row.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = self.offset
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        text = line.decode('utf-8', 'surrogateescape')
+        return text.lstrip('\ufeff') if start == 0 else text
+
+
+def read_records(path, fmt, offset=0, line=0):
+    """Yield (record dict, record number, byte offset after the record) starting at `offset`.
+    `line` is the number of records before `offset` (from the checkpoint).
+    """
+    with open(path, 'rb') as f:
+        if fmt == 'csv':
+            header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+            header = [h.strip().lower() for h in header]
+            if offset:
+                f.seek(offset)
+            lines = LineReader(f)
+            for n, values in enumerate(csv.reader(lines), start=line + 1):
+                if values:
+                    record = dict(zip(header, values))
+                    if any(_BAD_BYTES.search(v) for v in values):
+                        record['_error'] = BAD_UTF8
+                    yield record, n, lines.offset
+        else:
+            f.seek(offset)
+            lines = LineReader(f)
+            for n, text in enumerate(lines, start=line + 1):
+                if text.strip():
+                    if _BAD_BYTES.search(text):
+                        yield {'_error': BAD_UTF8, 'line': text}, n, lines.offset
+                        continue
+                    try:
+                        yield json.loads(text), n, lines.offset
+                    except ValueError as e:
+                        yield {'_error': f'invalid JSON: {e}'}, n, lines.offset
+
+
+def _number(value, cast=float):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, str):
+        value = _NUMBER.sub('', value)
+    return cast(float(value))
+
+
+def normalize(raw):
+    """(row, None) with cleaned product fields, or (None, error). Runs in a worker process."""
+    if not isinstance(raw, dict):
+        return None, 'record is not an object'
+    if raw.get('_error'):
+        return None, raw['_error']
+    raw = {str(k).strip().lower(): v for k, v in raw.items()}
+    name = str(raw.get('name') or '').strip()
+    if not name:
+        return None, 'missing name'
+    try:
+        price = _number(raw.get('price'))
+        discount = _number(raw.get('discount_price'))
+        stock = _number(raw.get('stock'), int)
+        rating = _number(raw.get('rating'))
+        category_id = _number(raw.get('category_id'), int)
+    except (TypeError, ValueError) as e:
+        return None, f'bad number: {e}'
+    if price is None or price <= 0:
+        return None, f'bad price {raw.get("price")!r}'
+    if discount is not None:
+        if discount <= 0 or discount > price:
+            return None, f'discount {discount} outside (0, price {price}]'
+        if discount == price:
+            discount = None
+    if stock is not None and stock < 0:
+        return None, f'negative stock {stock}'
+    if rating is not None and not 0 <= rating <= 5:
+        return None, f'rating {rating} outside 0-5'
+    asin = str(raw.get('asin') or '').strip().upper() or None
+    row = {
+        'name': name[:300],
+        'description': str(raw.get('description') or '').strip(),
+        'price': round(price, 2),
+        'discount_price': round(discount, 2) if discount is not None else None,
+        'stock': stock or 0,
+        'rating': rating or 0.0,
+        'asin': asin[:80] if asin else None,
+        'image_url': str(raw.get('image_url') or '').strip()[:400],
+    }
+    # columns the file does not have are left alone on update (and defaulted on insert)
+    row = {k: v for k, v in row.items() if k in raw or k in ('name', 'price')}
+    row['category'] = ' '.join(str(raw.get('category') or raw.get('category_name') or '').split())
+    row['category_id'] = category_id
+    row['has_category'] = any(k in raw for k in ('category', 'category_name', 'category_id'))
+    return row, None
+
+
+def normalize_chunk(records):
+    return [normalize(r) for r in records]
+
+
+def chunks(records, size):
+    """Group (record, line, offset) tuples into (records, first line, last line, end offset) chunks."""
+    batch = []
+    for rec, n, offset in records:
+        batch.append((rec, n))
+        if len(batch) >= size:
+            yield [r for r, _ in batch], batch[0][1], batch[-1][1], offset
+            batch = []
+    if batch:
+        yield [r for r, _ in batch], batch[0][1], batch[-1][1], offset
+
+
+class Importer:
+    def __init__(self, key, create_categories, dry_run, errors_file=None, counts=None):
+        self.key = key
+        self.create_categories = create_categories
+        self.dry_run = dry_run
+        self.errors_file = errors_file
+        self.categories = {name.lower(): cid for cid, name in db.session.query(Category.id, Category.name)}
+        self.category_ids = set(self.categories.values())
+        self.counts = dict(counts or {'rows': 0, 'inserted': 0, 'updated': 0, 'rejected': 0})
+
+    def reject(self, line, raw, error):
+        self.counts['rejected'] += 1
+        if self.counts['rejected'] <= 20:
+            print(f'row {line}: {error}')
+        if self.errors_file:
+            self.errors_file.write(json.dumps({'row': line, 'error': error, 'record': raw}, default=str) + '\n')
+
+    def category_id(self, row):
+        if row['category_id'] is not None:
+            return row['category_id'] if row['category_id'] in self.category_ids else False
+        name = row['category']
+        if not name:
+            return None
+        cid = self.categories.get(name.lower())
+        if cid is None and self.create_categories:
+            c = Category(name=name)
+            db.session.add(c)
+            db.session.flush()
+            cid = self.categories[name.lower()] = c.id
+            self.category_ids.add(cid)
+        return cid if cid is not None else False
+
+    def apply(self, records, results, first_line):
+        by_key = {}
+        for i, (raw, (row, error)) in enumerate(zip(records, results)):
+            line = first_line + i
+            if error is None:
+                cid = self.category_id(row)
+                if cid is False:
+                    error = f'unknown category {row["category"] or row["category_id"]!r}'
+            if error is not None:
+                self.reject(line, raw, error)
+                continue
+            has_category = row['has_category']
+            row = {k: row[k] for k in FIELDS if k in row}
+            if has_category:
+                row['category_id'] = cid
+            if not row.get(self.key):
+                self.reject(line, raw, f'missing {self.key}')  # it would be inserted again on every run
+                continue
+            by_key[row[self.key]] = row  # a later line with the same key wins
+        self.counts['rows'] += len(records)
+        column = getattr(Product, self.key)
+        existing = {}
+        keys = list(by_key)
+        for i in range(0, len(keys), 500):
+            existing.update({k: pid for pid, k in db.session.query(Product.id, column).filter(column.in_(keys[i:i + 500]))})
+        updates = [dict(row, id=existing[k]) for k, row in by_key.items() if k in existing]
+        inserts = [dict(INSERT_DEFAULTS, **row) for k, row in by_key.items() if k not in existing]
+        self.counts['updated'] += len(updates)
+        self.counts['inserted'] += len(inserts)
+        if self.dry_run:
+            db.session.rollback()
+            return
+        if updates:
+            db.session.bulk_update_mappings(Product, updates)
+        if inserts:
+            db.session.bulk_insert_mappings(Product, inserts)
+
+
+def checkpoint_for(path):
+    """The import's checkpoint row. Needs an app context."""
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+    return DbCheckpoint(f'import_catalog-{digest}')
+
+
+def main(path, fmt=None, key='asin', chunk=5000, workers=4, dry_run=False, restart=False,
+         create_categories=False, errors=None):
+    fmt = fmt or ('jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+    st = os.stat(path)
+    app = create_db_app()
+    with app.app_context():
+        checkpoint = checkpoint_for(path)
+        if restart:
+            checkpoint.clear()
+    offset = 0 if dry_run else checkpoint.get('offset', 0)
+    line = checkpoint.get('line', 0) if offset else 0
+    if offset and (checkpoint.get('size'), checkpoint.get('mtime')) != (st.st_size, st.st_mtime):
+        print(f'{path} changed since the checkpoint was written; use --restart to import it from the start')
+        return None
+    if offset:
+        print(f'Resuming {path} at byte {offset} of {st.st_size}')
+
+    started = time.time()
+    errors_file = open(errors, 'a', encoding='utf-8') if errors else None
+    try:
+        with app.app_context(), ProcessPoolExecutor(max_workers=workers) as pool:
+            importer = Importer(key, create_categories, dry_run, errors_file, checkpoint.get('counts') if offset else None)
+            resumed_rows = importer.counts['rows']
+            pending = []
+
+            def finish_one():
+                records, first, last, end, fut = pending.pop(0)
+                importer.apply(records, fut.result(), first)
+                if not dry_run:
+                    checkpoint.save(offset=end, line=last, size=st.st_size, mtime=st.st_mtime, counts=importer.counts)
+                    catalog.bump()  # one catalog version per chunk; commits the chunk and its checkpoint together
+                rate = (importer.counts['rows'] - resumed_rows) / max(time.time() - started, 1e-6)
+                print(f"progress: lines {first}-{last}, {end * 100 // max(st.st_size, 1)}% of file, "
+                      f"{importer.counts}, {rate:.0f} rows/s")
+
+            # keep a few chunks validating ahead of the writer, but no more (bounded memory)
+            for records, first, last, end in chunks(read_records(path, fmt, offset, line), chunk):
+                pending.append((records, first, last, end, pool.submit(normalize_chunk, records)))
+                if len(pending) > workers * 2:
+                    finish_one()
+            while pending:
+                finish_one()
+            if not dry_run:
+                checkpoint.clear()
+            print(f'Done. {importer.counts} in {time.time() - started:.1f}s (dry_run={dry_run})')
+            return importer.counts
+    finally:
+        if errors_file:
+            errors_file.close()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Import products from a CSV or JSONL catalog file.')
+    ap.add_argument('path', help='CSV (with a header row) or JSONL file')
+    ap.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='Default: from the file extension')
+    ap.add_argument('--key', choices=['asin', 'name'], default='asin', help='Column that identifies an existing product')
+    ap.add_argument('--chunk', type=int, default=5000, help='Rows per bulk upsert / checkpoint')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Validation worker processes')
+    ap.add_argument('--create-categories', action='store_true', help='Create categories that do not exist yet')
+    ap.add_argument('--errors', default=None, help='Append rejected rows to this JSONL file')
+    ap.add_argument('--dry-run', action='store_true', help='Validate and report without writing')
+    ap.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start at the top of the file')
+    args = ap.parse_args()
+    main(args.path, fmt=args.format, key=args.key, chunk=args.chunk, workers=args.workers, dry_run=args.dry_run,
+         restart=args.restart, create_categories=args.create_categories, errors=args.errors)
@@ -0,0 +1,124 @@
+"""Low-quality image placeholders stored on the product row.
+
+Each product image is reduced to a ~16px-wide WebP data URI (a few hundred
+bytes) and its dominant color. Both go out inline in `to_dict()`, so the
+grid can paint a blurred preview before the real image arrives.
+`image_hash` (sha1 of the image bytes) records which image the placeholder
+was made from, so a url that serves a different image each time (a random
+picsum link) is picked up by the next compute_lqip.py run. An unchanged image
+is still read, but not decoded or written. Product writes recompute the
+placeholder in the background when the image_url changes.
+
+An image that cannot be decoded is stored as "no placeholder" under its hash
+and left alone until its bytes change. An image that cannot be read (network
+error, missing file) is not written at all, so the next run retries it.
+"""
+import base64
+import hashlib
+import io
+import os
+
+from PIL import Image, ImageOps
+
+import background
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WIDTH = 16
+QUALITY = 40
+
+
+def image_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def from_bytes(data):
+    """(data URI, '#rrggbb') for encoded image bytes."""
+    with Image.open(io.BytesIO(data)) as im:
+        im.draft('RGB', (WIDTH * 4, WIDTH * 4))  # JPEG: decode at reduced scale
+        img = ImageOps.exif_transpose(im).convert('RGB')
+    img.thumbnail((WIDTH, WIDTH * 4), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, 'WEBP', quality=QUALITY)
+    # most common color of a 5-color palette: closer to "the" color than a plain average
+    pal = img.quantize(colors=5)
+    index = max(pal.getcolors(), key=lambda c: c[0])[1]
+    r, g, b = pal.getpalette()[index * 3:index * 3 + 3]
+    return 'data:image/webp;base64,' + base64.b64encode(out.getvalue()).decode('ascii'), f'#{r:02x}{g:02x}{b:02x}'
+
+
+def load_image(url, upload_folder):
+    """Bytes of a product image: /uploads/ urls and bare file names are read from disk, http(s) urls fetched."""
+    if url.startswith(('http://', 'https://')):
+        from image_proxy import fetch_source
+        return fetch_source(url)
+    if url.startswith('/uploads/'):
+        root, rel = upload_folder, url[len('/uploads/'):]
+    else:
+        root, rel = ROOT, url.lstrip('/')  # static images shipped with the site, e.g. o2_featured_v2.avif
+    path = os.path.normpath(os.path.join(root, rel))
+    if not path.startswith(os.path.normpath(root) + os.sep):
+        raise ValueError(f'bad image path {url!r}')
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def placeholder(url, upload_folder, known_hash=None):
+    """Placeholder fields for one image url. Runs in a worker process.
+    Returns {image_hash, lqip, dominant_color}, plus 'error' if the image could not be decoded,
+    'unchanged' if its hash is `known_hash`, or 'retry' if it could not be read.
+    """
+    row = {'image_hash': None, 'lqip': None, 'dominant_color': None}
+    if not url:
+        return row
+    try:
+        data = load_image(url, upload_folder)
+    except Exception as e:
+        row['retry'] = str(e)
+        return row
+    row['image_hash'] = image_hash(data)
+    if row['image_hash'] == known_hash:
+        row['unchanged'] = True
+        return row
+    try:
+        row['lqip'], row['dominant_color'] = from_bytes(data)
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+
+def store(rows):
+    """Write placeholder() results with product ids; unchanged and unreadable images are left as they are.
+    Returns the number of products written. Needs an app context.
+    """
+    from database_models import db, Product
+    import catalog
+    rows = [{k: v for k, v in r.items() if k != 'error'} for r in rows if not (r.get('retry') or r.get('unchanged'))]
+    if not rows:
+        return 0
+    db.session.bulk_update_mappings(Product, rows)
+    catalog.bump(('lqip', 'dominant_color'), product_ids=[r['id'] for r in rows])
+    return len(rows)
+
+
+def schedule(app, product):
+    """Recompute `product`'s placeholder in the image process pool. Call it when the image_url changes."""
+    from image_variants import get_pool
+    fut = get_pool().submit(placeholder, product.image_url or '', app.config['UPLOAD_FOLDER'], product.image_hash)
+
+    def save(row):
+        with app.app_context():
+            store([row])
+
+    def done(f):
+        if f.exception() is not None:
+            print(f'placeholder failed for product {product_id}: {f.exception()}')
+            return
+        row = f.result()
+        if row.get('retry'):
+            print(f'placeholder for product {product_id} not computed, will retry on the next run: {row["retry"]}')
+            return
+        if not row.get('unchanged'):
+            background.submit(save, dict(row, id=product_id))
+    product_id = product.id
+    fut.add_done_callback(done)
+    return fut
@@ -0,0 +1,90 @@
+"""Shared runner for catalog maintenance scripts.
+
+`run()` walks the products table in id order, one --chunk at a time, and only
+holds that chunk in memory. A script supplies `compute(row, categories)` that
+returns the fields it wants to change. Unchanged fields are dropped, and the
+remaining diffs are written with one bulk_update_mappings per chunk. With
+dry_run they are printed instead. After each applied chunk the last id is
+saved to a checkpoint, so an interrupted run resumes from there. Pass
+restart=True to start over.
+
+Chunks are fetched with keyset pagination (id > last id) rather than one
+long yield_per cursor. Committing between chunks would invalidate that
+cursor, and on SQLite an open read cursor blocks the writes.
+"""
+import time
+
+import catalog
+from checkpoint import Checkpoint
+from database_models import db, Product, Category
+
+
+def add_arguments(parser, chunk=1000):
+    """Add the common --chunk/--limit/--restart flags to a script's parser."""
+    parser.add_argument('--chunk', '--batch', dest='chunk', type=int, default=chunk,
+                        help='Products per query / bulk update')
+    parser.add_argument('--limit', type=int, default=0, help='Max products to process (0 = all)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the first product')
+
+
+def category_names():
+    """{category id: name}, loaded once instead of one query per product."""
+    return dict(db.session.query(Category.id, Category.name))
+
+
+def iter_products(columns, start_after=0, chunk=1000, limit=None):
+    """Yield lists of product rows (only `columns`, plus id) in id order, `chunk` rows at a time."""
+    cols = [Product.id] + [getattr(Product, c) for c in columns if c != 'id']
+    last_id = start_after
+    seen = 0
+    while not limit or seen < limit:
+        size = chunk if not limit else min(chunk, limit - seen)
+        rows = db.session.query(*cols).filter(Product.id > last_id).order_by(Product.id.asc()).limit(size).all()
+        if not rows:
+            return
+        seen += len(rows)
+        last_id = rows[-1].id
+        yield rows
+
+
+def run(name, compute, columns, chunk=1000, limit=None, dry_run=False, restart=False):
+    """Apply `compute(row, categories) -> {field: value} or None` to every product.
+    Needs an app context. Returns {'processed', 'changed'}.
+    """
+    checkpoint = Checkpoint.for_script(name)
+    if restart:
+        checkpoint.clear()
+    start_after = 0 if dry_run else checkpoint.get('last_id', 0)
+    if start_after:
+        print(f'Resuming after product id {start_after} (use --restart to start over)')
+    categories = category_names()
+    total = Product.query.filter(Product.id > start_after).count()
+    if limit:
+        total = min(total, limit)
+    print(f'{total} products to process')
+    processed = changed = 0
+    started = time.time()
+    for rows in iter_products(columns, start_after, chunk, limit):
+        diffs = []
+        for row in rows:
+            updates = compute(row, categories) or {}
+            diff = {k: v for k, v in updates.items() if getattr(row, k) != v}
+            if diff:
+                diffs.append(dict(diff, id=row.id))
+                if dry_run:
+                    print(f'id={row.id} ' + ', '.join(f'{k}: {getattr(row, k)!r} -> {v!r}' for k, v in diff.items()))
+        processed += len(rows)
+        changed += len(diffs)
+        if not dry_run:
+            if diffs:
+                db.session.bulk_update_mappings(Product, diffs)
+                catalog.bump({k for d in diffs for k in d if k != 'id'}, product_ids=[d['id'] for d in diffs])
+            else:
+                db.session.commit()
+            checkpoint.save(last_id=rows[-1].id)
+        rate = processed / max(time.time() - started, 1e-6)
+        print(f'progress: {processed}/{total} processed, {changed} changed, {rate:.0f} products/s')
+    if not dry_run and (not limit or processed < limit):
+        checkpoint.clear()  # reached the end: the next run starts from the beginning
+    print(f'Done. {processed} processed, {changed} {"would change" if dry_run else "changed"} (dry_run={dry_run})')
+    return {'processed': processed, 'changed': changed}
@@ -0,0 +1,270 @@
+"""Request instrumentation exposed as Prometheus text on /metrics.
+
+`init_app(app)` registers before/after request hooks and SQLAlchemy engine
+events. Per route it records latency, response size, and how many SQL
+statements each request ran and how long they took. Time spent in outbound
+HTTP calls (RapidAPI etc., via http_client) is recorded per request and per host.
+Work a request hands to other threads counts towards it when the thread runs
+under `attach(current())`; fanout.py does this for the parts of /full.
+
+Each worker keeps its own counters in memory and writes a snapshot to
+METRICS_DIR every few seconds; /metrics merges every worker's snapshot so a
+scrape sees totals for the whole box no matter which worker answers it.
+Snapshots are named <pid>-<start time>.json. A scrape deletes those of
+workers that have exited, and the older of two files with the same pid (a
+reused pid), so restarts do not pile files up. The totals then drop by the
+dead worker's counts, which Prometheus reads as a counter reset.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import http_client
+from disk_cache import CACHE_DIR
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(CACHE_DIR, 'metrics'))
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+# name -> (type, help, buckets or None, label names)
+FAMILIES = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route.', LATENCY_BUCKETS, ('method', 'route', 'status')),
+    'http_response_size_bytes': ('histogram', 'Response body size by route.', SIZE_BUCKETS, ('method', 'route')),
+    'db_statements_per_request': ('histogram', 'SQL statements executed per request.', STATEMENT_BUCKETS, ('method', 'route')),
+    'db_statement_seconds_total': ('counter', 'Time spent executing SQL, by route.', None, ('method', 'route')),
+    'outbound_http_seconds_per_request_total': ('counter', 'Time spent in outbound HTTP calls, by route.', None, ('method', 'route')),
+    'outbound_http_duration_seconds': ('histogram', 'Outbound HTTP attempt latency by host.', LATENCY_BUCKETS, ('host', 'outcome')),
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_series = {name: {} for name in FAMILIES}
+_last_flush = 0.0
+_started = int(time.time() * 1000)  # tells a restarted worker from an old one with the same pid
+_engine_hooks_installed = False
+
+
+def _observe(name, labels, value):
+    buckets = FAMILIES[name][2]
+    with _lock:
+        series = _series[name].get(labels)
+        if buckets is None:
+            _series[name][labels] = (series or 0.0) + value
+            return
+        if series is None:
+            # one slot per bucket plus +Inf, then sum and count
+            series = _series[name][labels] = [0] * (len(buckets) + 1) + [0.0, 0]
+        series[bisect_left(buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['metrics_start'].pop()
+    usage = getattr(_local, 'usage', None)
+    if usage is not None:
+        usage.add(statements=1, sql=time.perf_counter() - start)
+
+
+def _handle_error(context):
+    starts = context.connection.info.get('metrics_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _on_outbound(host, seconds, ok):
+    _observe('outbound_http_duration_seconds', (host, 'ok' if ok else 'error'), seconds)
+    usage = getattr(_local, 'usage', None)
+    if usage is not None:
+        usage.add(outbound=seconds)
+
+
+class Usage:
+    """SQL statements, SQL seconds and outbound HTTP seconds of one request, from any thread."""
+
+    def __init__(self):
+        self.statements = 0
+        self.sql = 0.0
+        self.outbound = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, statements=0, sql=0.0, outbound=0.0):
+        with self._lock:
+            self.statements += statements
+            self.sql += sql
+            self.outbound += outbound
+
+
+def current():
+    """The Usage of the request this thread is serving (None outside a request)."""
+    return getattr(_local, 'usage', None)
+
+
+@contextlib.contextmanager
+def attach(usage):
+    """Count this thread's SQL and outbound HTTP towards `usage` (from current() in the request's thread)."""
+    previous = getattr(_local, 'usage', None)
+    _local.usage = usage
+    try:
+        yield
+    finally:
+        _local.usage = previous
+
+
+def _before_request():
+    _local.start = time.perf_counter()
+    _local.usage = Usage()
+
+
+def _after_request(response):
+    start = getattr(_local, 'start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    method = request.method
+    usage = _local.usage
+    _observe('http_request_duration_seconds', (method, route, str(response.status_code)), elapsed)
+    size = response.calculate_content_length()
+    if size is not None:
+        _observe('http_response_size_bytes', (method, route), size)
+    _observe('db_statements_per_request', (method, route), usage.statements)
+    _observe('db_statement_seconds_total', (method, route), usage.sql)
+    if usage.outbound:
+        _observe('outbound_http_seconds_per_request_total', (method, route), usage.outbound)
+    _local.start = _local.usage = None
+    if time.time() - _last_flush > FLUSH_INTERVAL:
+        flush()
+    return response
+
+
+def flush():
+    """Write this worker's counters to METRICS_DIR/<pid>-<start time>.json."""
+    global _last_flush
+    _last_flush = time.time()
+    with _lock:
+        data = {name: [[list(labels), value] for labels, value in series.items()]
+                for name, series in _series.items()}
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}-{_started}.json')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    if os.name != 'posix':
+        return True  # os.kill(pid, 0) is not a probe on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def _prune(fnames):
+    """Delete the snapshots of exited workers (and <pid>.json files from older versions); returns the rest."""
+    newest = {}  # pid -> (start time, file name)
+    for fname in fnames:
+        parts = fname[:-len('.json')].split('-')
+        if len(parts) == 2 and all(p.isdigit() for p in parts):
+            pid, started = int(parts[0]), int(parts[1])
+            if pid not in newest or started > newest[pid][0]:
+                newest[pid] = (started, fname)
+    keep = {fname for pid, (_, fname) in newest.items() if _alive(pid)}
+    for fname in fnames:
+        if fname not in keep:
+            try:
+                os.remove(os.path.join(METRICS_DIR, fname))
+            except OSError:
+                pass
+    return sorted(keep)
+
+
+def collect():
+    """Merge the snapshots of every live worker (including this one, flushed first)."""
+    flush()
+    merged = {name: {} for name in FAMILIES}
+    for fname in _prune([f for f in os.listdir(METRICS_DIR) if f.endswith('.json')]):
+        try:
+            with open(os.path.join(METRICS_DIR, fname)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, series in data.items():
+            if name not in merged:
+                continue
+            for labels, value in series:
+                key = tuple(labels)
+                current = merged[name].get(key)
+                if current is None:
+                    merged[name][key] = value
+                elif isinstance(value, list):
+                    merged[name][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[name][key] = current + value
+    return merged
+
+
+def _label_str(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(merged):
+    lines = []
+    for name, (kind, help_text, buckets, label_names) in FAMILIES.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(merged[name].items()):
+            if buckets is None:
+                lines.append(f'{name}{_label_str(label_names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ['+Inf'], value[:-2]):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_label_str(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_label_str(label_names, labels)} {value[-2]}')
+            lines.append(f'{name}_count{_label_str(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    global METRICS_DIR, _engine_hooks_installed
+    METRICS_DIR = app.config.get('METRICS_DIR', METRICS_DIR)
+    if not _engine_hooks_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        http_client.add_listener(_on_outbound)
+        _engine_hooks_installed = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(render(collect()), mimetype='text/plain; version=0.0.4')
@@ -1,32 +1,67 @@
+import hashlib
 import os
-import time
 import requests
 
-# Simple in-memory cache: {url: (timestamp, data)}
-_cache = {}
-_CACHE_TTL = int(os.environ.get('IMAGE_CACHE_TTL', 86400))
+import http_client
+from disk_cache import CACHE_DIR, DiskCache
+
+# Results are cached on disk keyed by a hash of the source URL, so reruns of
+# batch_convert_images.py don't pay for URLs that were already converted.
+_CACHE_TTL = int(os.environ.get('IMAGE_CACHE_TTL', 86400 * 30))
+_CACHE_MAX = int(os.environ.get('IMAGE_CACHE_MAX', 500000))
+_CACHE_PATH = os.environ.get('IMAGE_CACHE_PATH', os.path.join(CACHE_DIR, 'images.sqlite3'))
 
 # RapidAPI host for the image conversion tool
 RAPIDIMAGE_HOST = os.environ.get('RAPIDIMAGE_HOST', '1688-product2.p.rapidapi.com')
 RAPIDAPI_KEY = os.environ.get('RAPIDAPI_KEY')
+CONVERT_URL = os.environ.get('RAPIDIMAGE_CONVERT_URL', f'https://{RAPIDIMAGE_HOST}/1688/tools/image/convert_url')
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = DiskCache(_CACHE_PATH, max_entries=_CACHE_MAX)
+    return _cache
+
+
+def _key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def cached_result(url):
+    """Return the cached conversion result for `url`, or None (no network call)."""
+    entry = _get_cache().get(_key(url), include_expired=False) if url else None
+    return entry.value if entry else None
+
+
+def mark_converted(url):
+    """Remember that `url` is itself a conversion output, so a later run
+    treats it as already done instead of paying to convert it again.
+    """
+    _get_cache().set(_key(url), {'url': url}, _CACHE_TTL)
+
+
+def cache_stats():
+    return _get_cache().stats()
 
 
-def convert_image_url(url):
+def convert_image_url(url, use_cache=True):
     """Convert/normalize an external image URL using the RapidAPI image convert endpoint.
     Returns {'ok': True, 'result': {...}} or {'ok': False, 'error': '...'}
+    Pass use_cache=False when the caller has already checked `cached_result`.
     """
     if not url:
         return {'ok': False, 'error': 'missing url'}
 
-    now = int(time.time())
-    cached = _cache.get(url)
-    if cached and (now - cached[0] < _CACHE_TTL):
-        return {'ok': True, 'from_cache': True, 'result': cached[1]}
+    cached = cached_result(url) if use_cache else None
+    if cached is not None:
+        return {'ok': True, 'from_cache': True, 'result': cached}
 
     if not RAPIDAPI_KEY:
         return {'ok': False, 'error': 'RAPIDAPI_KEY not set in environment'}
 
-    api_url = f'https://{RAPIDIMAGE_HOST}/1688/tools/image/convert_url'
     headers = {
         'Content-Type': 'application/json',
         'x-rapidapi-host': RAPIDIMAGE_HOST,
@@ -34,10 +69,14 @@ def convert_image_url(url):
     }
     payload = {'url': url}
     try:
-        resp = requests.post(api_url, json=payload, headers=headers, timeout=12)
+        resp = http_client.post(CONVERT_URL, json=payload, headers=headers, timeout=12)
         resp.raise_for_status()
         data = resp.json()
-        _cache[url] = (now, data)
+        _get_cache().set(_key(url), data, _CACHE_TTL)
         return {'ok': True, 'from_cache': False, 'result': data}
+    except requests.HTTPError as e:
+        # surface the status (and Retry-After on 429) so callers can back off
+        return {'ok': False, 'error': str(e), 'status': e.response.status_code,
+                'retry_after': e.response.headers.get('Retry-After')}
     except requests.RequestException as e:
         return {'ok': False, 'error': str(e)}
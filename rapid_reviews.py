@@ -2,41 +2,118 @@ import os
 import time
 import requests
 
-# Simple in-memory cache: {asin: (timestamp, data)}
-_cache = {}
+import background
+import http_client
+from disk_cache import CACHE_DIR, DiskCache
+from singleflight import SingleFlight
+
+# Reviews are cached on disk so every worker shares them and they survive restarts.
+# Fresh entries are served as-is; older ones are still served immediately while a
+# background refresh runs. Failures are negative-cached for a short while.
 _CACHE_TTL = int(os.environ.get('REVIEWS_CACHE_TTL', 3600))
+_NEGATIVE_TTL = int(os.environ.get('REVIEWS_NEGATIVE_TTL', 120))
+_CACHE_MAX = int(os.environ.get('REVIEWS_CACHE_MAX', 5000))
+_CACHE_PATH = os.environ.get('REVIEWS_CACHE_PATH', os.path.join(CACHE_DIR, 'reviews.sqlite3'))
+_TIMEOUT = 8
+_RETRIES = 1  # background refreshes only: a request waiting on the fetch gets one try
+# total seconds a request with nothing cached waits for reviews: lease wait and fetch together
+_FOREGROUND_BUDGET = float(os.environ.get('REVIEWS_FOREGROUND_BUDGET', _TIMEOUT))
+# a fetch can take this long with its retries; the lease must outlast it or another worker starts the same fetch
+_LEASE = http_client.max_duration(_TIMEOUT, _RETRIES) + 2
 
 RAPIDAPI_HOST = 'real-time-amazon-data.p.rapidapi.com'
 RAPIDAPI_KEY = os.environ.get('RAPIDAPI_KEY')
+REVIEWS_URL = os.environ.get('RAPIDAPI_REVIEWS_URL', f'https://{RAPIDAPI_HOST}/top-product-reviews')
 
+_cache = None
+_flight = SingleFlight()
 
-def get_reviews(asin, country='US'):
-    """Fetch top reviews for a product ASIN from RapidAPI service.
-    Returns dict {ok: True, reviews: [...] } or {ok: False, error: '...'}
-    """
-    if not asin:
-        return {'ok': False, 'error': 'missing asin'}
 
-    now = int(time.time())
-    cached = _cache.get(asin)
-    if cached and (now - cached[0] < _CACHE_TTL):
-        return {'ok': True, 'from_cache': True, 'reviews': cached[1]}
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = DiskCache(_CACHE_PATH, max_entries=_CACHE_MAX)
+    return _cache
 
-    if not RAPIDAPI_KEY:
-        return {'ok': False, 'error': 'RAPIDAPI_KEY not set in environment'}
 
-    url = f'https://{RAPIDAPI_HOST}/top-product-reviews'
+def _fetch(asin, country, timeout=_TIMEOUT, retries=_RETRIES):
     params = {'asin': asin, 'country': country}
     headers = {
         'x-rapidapi-host': RAPIDAPI_HOST,
         'x-rapidapi-key': RAPIDAPI_KEY
     }
+    resp = http_client.get(REVIEWS_URL, params=params, headers=headers, timeout=timeout, retries=retries)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _refresh(asin, country, deadline=None):
+    """Fetch from upstream and store the outcome. Only one process does this per
+    ASIN at a time. With a `deadline` (a request is waiting), everything is done by
+    then: the fetch gets one try, and if another process holds the lease this waits
+    for its result until the deadline and then answers with an error rather than
+    fetching too. Without one (a background refresh) it returns None when another
+    process is already at it.
+    """
+    cache = _get_cache()
+    key = f'{country}:{asin}'
+    if not cache.acquire_lease(key, _LEASE):
+        if deadline is None:
+            return None
+        # only called on a miss, so any entry is the other process's result
+        while time.time() < deadline:
+            time.sleep(0.1)
+            entry = cache.get(key)
+            if entry is not None:
+                return _from_entry(entry)
+        return {'ok': False, 'error': 'reviews are being fetched by another worker; try again shortly'}
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=8)
-        resp.raise_for_status()
-        data = resp.json()
-        # store in cache
-        _cache[asin] = (now, data)
+        entry = cache.get(key) if deadline is not None else None
+        if entry is not None:
+            return _from_entry(entry)  # stored by another process between the miss and the lease
+        if deadline is None:
+            data = _fetch(asin, country)
+        else:
+            data = _fetch(asin, country, timeout=max(deadline - time.time(), 0.5), retries=0)
+        cache.set(key, data, _CACHE_TTL)
         return {'ok': True, 'from_cache': False, 'reviews': data}
-    except requests.RequestException as e:
+    except (requests.RequestException, ValueError) as e:
+        cache.set_error(key, str(e), _NEGATIVE_TTL)
         return {'ok': False, 'error': str(e)}
+    finally:
+        cache.release_lease(key)
+
+
+def _from_entry(entry, from_cache=True, stale=False):
+    if entry.value is None:
+        return {'ok': False, 'from_cache': from_cache, 'error': entry.error}
+    return {'ok': True, 'from_cache': from_cache, 'stale': stale, 'reviews': entry.value}
+
+
+def _background_refresh(asin, country):
+    _flight.do(f'{country}:{asin}', lambda: _refresh(asin, country))
+
+
+def get_reviews(asin, country='US'):
+    """Fetch top reviews for a product ASIN from RapidAPI service.
+    Returns dict {ok: True, reviews: [...] } or {ok: False, error: '...'}
+
+    Only blocks on upstream when nothing at all is cached for the ASIN, and then
+    for at most _FOREGROUND_BUDGET seconds.
+    """
+    if not asin:
+        return {'ok': False, 'error': 'missing asin'}
+
+    key = f'{country}:{asin}'
+    entry = _get_cache().get(key)
+    if entry is not None:
+        stale = time.time() >= entry.expires_at
+        if stale and RAPIDAPI_KEY and not _flight.busy(key):
+            background.submit(_background_refresh, asin, country)
+        return _from_entry(entry, stale=stale)
+
+    if not RAPIDAPI_KEY:
+        return {'ok': False, 'error': 'RAPIDAPI_KEY not set in environment'}
+
+    deadline = time.time() + _FOREGROUND_BUDGET
+    return _flight.do(key, lambda: _refresh(asin, country, deadline))
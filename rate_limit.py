@@ -0,0 +1,320 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available. Returns 0 on success, otherwise the seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to the upstream: every success nudges the
+    rate up (additive increase, capped at `max_rate`), every 429 halves it and
+    pauses all callers for the server's Retry-After (multiplicative decrease).
+    """
+
+    def __init__(self, rate, max_rate, min_rate=0.1, step=0.1):
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.step = float(step)
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def acquire(self):
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+                continue
+            wait = self.bucket.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _set_rate(self, rate):
+        with self.bucket._lock:
+            self.bucket._refill(time.monotonic())
+            self.bucket.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def success(self):
+        with self._lock:
+            self._set_rate(self.rate + self.step)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self._set_rate(self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+def parse_retry_after(value, default=1.0):
+    """Seconds from a Retry-After header (delta-seconds form); `default` if missing or an HTTP date."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+# Server-side admission control: per-IP / per-user buckets for the routes in POLICIES.
+
+class KeyedBuckets:
+    """Token buckets for many keys (IPs, emails) in one process.
+
+    State is two floats per key in flat arrays, indexed through a dict of
+    key -> slot. A full bucket behaves the same as a missing one, so when
+    max_keys is reached every key that has refilled is dropped. If that frees
+    too little, the least recently used half goes as well.
+    """
+
+    def __init__(self, rate, capacity, max_keys=100000):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_keys = max_keys
+        self.slots = {}
+        self.tokens = array('d')
+        self.updated = array('d')
+        self.free = []
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1.0, now=None):
+        """Take `cost` tokens from key's bucket. Returns 0 on success, otherwise the seconds to wait."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                if len(self.slots) >= self.max_keys:
+                    self._sweep(now)
+                slot = self._new_slot(key, now)
+            tokens = min(self.capacity, self.tokens[slot] + (now - self.updated[slot]) * self.rate)
+            self.updated[slot] = now
+            if tokens >= cost:
+                self.tokens[slot] = tokens - cost
+                return 0.0
+            self.tokens[slot] = tokens
+            return (cost - tokens) / self.rate
+
+    def _new_slot(self, key, now):
+        if self.free:
+            slot = self.free.pop()
+            self.tokens[slot], self.updated[slot] = self.capacity, now
+        else:
+            slot = len(self.tokens)
+            self.tokens.append(self.capacity)
+            self.updated.append(now)
+        self.slots[key] = slot
+        return slot
+
+    def _sweep(self, now):
+        refill = self.capacity / self.rate
+        drop = [k for k, s in self.slots.items() if now - self.updated[s] >= refill]
+        if len(drop) < self.max_keys // 10:
+            by_age = sorted(self.slots, key=lambda k: self.updated[self.slots[k]])
+            drop = by_age[:len(by_age) // 2]
+        for k in drop:
+            self.free.append(self.slots.pop(k))
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class SQLiteBuckets:
+    """The same buckets in a SQLite file, shared by every worker process on the box.
+
+    A take is one UPSERT ... RETURNING that refills, checks and debits in a
+    single statement, so concurrent workers cannot overdraw a bucket. A
+    refused take costs one more read for the wait time. Rows that have
+    refilled are pruned now and then. A take that cannot get the file within
+    TIMEOUT seconds raises sqlite3.OperationalError; RequestLimiter admits
+    the request and counts it.
+    """
+
+    PRUNE_EVERY = 1000
+    TIMEOUT = 5
+
+    def __init__(self, path, name, rate, capacity):
+        self.path = path
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._local = threading.local()
+        self._takes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn().execute('CREATE TABLE IF NOT EXISTS buckets ('
+                             'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # losing a few debits in a crash is harmless
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, cost=1.0, now=None):
+        now = time.time() if now is None else now
+        key = f'{self.name}:{key}'
+        conn = self._conn()
+        refilled = 'min(:cap, tokens + (:now - updated) * :rate)'
+        params = {'key': key, 'cap': self.capacity, 'now': now, 'rate': self.rate, 'cost': cost}
+        row = conn.execute(
+            'INSERT INTO buckets (key, tokens, updated) VALUES (:key, :cap - :cost, :now) '
+            f'ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - :cost, updated = :now '
+            f'WHERE {refilled} >= :cost RETURNING tokens', params).fetchone()
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM buckets WHERE key LIKE :prefix AND updated < :now - :cap / :rate',
+                         {'prefix': f'{self.name}:%', 'now': now, 'cap': self.capacity, 'rate': self.rate})
+        if row is not None:
+            return 0.0
+        row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        tokens = min(self.capacity, row[0] + (now - row[1]) * self.rate) if row else self.capacity
+        return max(0.0, (cost - tokens) / self.rate) or 1.0 / self.rate
+
+
+# endpoint -> [(scope, requests, per seconds, burst)]. "ip" keys on the client address,
+# "user" on the account the request is about (login email, or the JWT identity).
+POLICIES = {
+    'api_login': [('ip', 20, 60, 10), ('user', 5, 60, 5)],
+    'api_register': [('ip', 5, 60, 5)],
+    'reviews_proxy': [('ip', 30, 60, 10), ('user', 60, 60, 20)],
+    'product_full': [('ip', 120, 60, 30)],  # also reaches the reviews upstream
+    'api_events': [('ip', 120, 60, 60)],  # a page sends a batch every few seconds at most
+}
+
+
+def client_ip(request, trust_forwarded=False):
+    if trust_forwarded:
+        forwarded = request.headers.get('X-Forwarded-For', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.remote_addr or '-'
+
+
+def request_user(request):
+    """The account a request acts on: the email being logged into, else the JWT identity; None if anonymous."""
+    if request.endpoint == 'api_login':
+        email = (request.get_json(silent=True) or {}).get('email')
+        return str(email).strip().lower() if email else None
+    from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+class RequestLimiter:
+    """Applies POLICIES (or app.config['RATE_LIMITS']) to requests, before the view runs.
+    If a bucket fails (the shared SQLite file is locked or broken), the request is admitted
+    and counted in `errors`: a limiter outage must not take the routes it guards down.
+    """
+
+    def __init__(self, policies, backend='memory', path=None, trust_forwarded=False):
+        self.trust_forwarded = trust_forwarded
+        self.limits = {}
+        for endpoint, rules in policies.items():
+            buckets = []
+            for scope, requests, per, burst in rules:
+                rate = requests / per
+                if backend == 'sqlite':
+                    buckets.append((scope, SQLiteBuckets(path, f'{endpoint}:{scope}', rate, burst)))
+                else:
+                    buckets.append((scope, KeyedBuckets(rate, burst)))
+            self.limits[endpoint] = buckets
+        self.rejected = 0
+        self.errors = 0
+
+    def check(self, request):
+        """Seconds the client must wait before this request is admitted; 0 to admit it."""
+        buckets = self.limits.get(request.endpoint)
+        if not buckets:
+            return 0.0
+        user = False  # resolved lazily: most checks stop at the IP bucket
+        for scope, bucket in buckets:
+            if scope == 'ip':
+                key = client_ip(request, self.trust_forwarded)
+            else:
+                if user is False:
+                    user = request_user(request)
+                if user is None:
+                    continue
+                key = user
+            try:
+                wait = bucket.take(key)
+            except sqlite3.Error as e:
+                self.errors += 1
+                if self.errors == 1 or self.errors % 1000 == 0:
+                    print(f'rate limit {request.endpoint} failed open ({self.errors} times): {e}')
+                continue
+            if wait:
+                self.rejected += 1
+                return wait
+        return 0.0
+
+
+def init_app(app):
+    """Reject over-limit requests with 429 and Retry-After.
+
+    Config: RATE_LIMIT_ENABLED (default on), RATE_LIMITS (policies, default POLICIES),
+    RATE_LIMIT_BACKEND ('memory' per process, or 'sqlite' shared by the workers on a box),
+    RATE_LIMIT_PATH (the sqlite file), RATE_LIMIT_TRUST_FORWARDED (key on X-Forwarded-For
+    behind a proxy).
+    """
+    if not app.config.get('RATE_LIMIT_ENABLED', os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'):
+        return None
+    from flask import request, jsonify
+    from disk_cache import CACHE_DIR
+    limiter = RequestLimiter(
+        app.config.get('RATE_LIMITS', POLICIES),
+        backend=app.config.get('RATE_LIMIT_BACKEND', os.environ.get('RATE_LIMIT_BACKEND', 'memory')),
+        path=app.config.get('RATE_LIMIT_PATH', os.environ.get('RATE_LIMIT_PATH', os.path.join(CACHE_DIR, 'rate_limit.db'))),
+        trust_forwarded=app.config.get('RATE_LIMIT_TRUST_FORWARDED', os.environ.get('RATE_LIMIT_TRUST_FORWARDED') == '1'))
+    app.extensions['rate_limit'] = limiter
+
+    @app.before_request
+    def _rate_limit():
+        wait = limiter.check(request)
+        if wait:
+            retry_after = max(1, math.ceil(wait))
+            resp = jsonify({'error': 'too many requests', 'retry_after': retry_after})
+            resp.status_code = 429
+            resp.headers['Retry-After'] = str(retry_after)
+            return resp
+    return limiter
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+"Frequently bought together" from product co-occurrence in order_items.
+Usage:
+  python recommendations.py rebuild        # full rebuild from order history
+  python recommendations.py show <product_id> [-k 10]
+
+Counts live in a CSR snapshot under cache/recommendations: for product p,
+indices[indptr[p]:indptr[p + 1]] are the products bought with it (most
+frequent first), and counts holds how many orders had both. Each row keeps
+its top MAX_NEIGHBORS. The arrays are memory-mapped .npy files, so every
+worker shares one copy, and a lookup is an array slice.
+
+The snapshot records the last order_items.id it covers. Newer lines are
+applied incrementally: checkout() triggers catch_up() on the background
+pool, which reads only order_items past that id and adds their pairs to an
+in-memory overlay. Other workers do the same on their next lookup. Once the
+overlay passes COMPACT_AT pairs it is merged into a new snapshot generation.
+Other workers pick up the new generation when current.json changes.
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import background
+from disk_cache import CACHE_DIR
+
+RECS_DIR = os.environ.get('RECS_DIR', os.path.join(CACHE_DIR, 'recommendations'))
+MAX_NEIGHBORS = int(os.environ.get('RECS_MAX_NEIGHBORS', 100))
+MAX_ORDER_ITEMS = 50  # bigger orders are truncated: pairs grow quadratically and say little
+COMPACT_AT = int(os.environ.get('RECS_COMPACT_AT', 50000))  # overlay pairs
+CATCH_UP_INTERVAL = float(os.environ.get('RECS_CATCH_UP_INTERVAL', 10))  # seconds between DB checks per worker
+
+
+def pairs_from_orders(order_ids, product_ids):
+    """Co-occurrence (left, right, count) arrays from parallel order/product id arrays."""
+    if len(order_ids) == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+    # distinct (order, product), grouped by order: ids are below 2**31, so one int64 key holds both
+    keys = np.unique((np.asarray(order_ids, np.int64) << 32) | np.asarray(product_ids, np.int64))
+    orders, products = keys >> 32, keys & 0xFFFFFFFF
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+    sizes = np.diff(np.r_[starts, len(orders)])
+    # truncate very large orders
+    rank = np.arange(len(orders)) - np.repeat(starts, sizes)
+    keep = rank < MAX_ORDER_ITEMS
+    orders, products = orders[keep], products[keep]
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]])
+    sizes = np.diff(np.r_[starts, len(orders)])
+    # every line pairs with each line of its order: repeat line i (size of its order) times
+    line_size = np.repeat(sizes, sizes)
+    line_start = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(orders)), line_size)
+    block = np.repeat(np.cumsum(line_size) - line_size, line_size)
+    right = np.arange(len(left)) - block + np.repeat(line_start, line_size)
+    mask = left != right
+    left, right = products[left[mask]], products[right[mask]]
+    return _sum_pairs(left, right, np.ones(len(left), np.int64))
+
+
+def _sum_pairs(left, right, counts):
+    if len(left) == 0:
+        return left, right, counts
+    width = int(max(left.max(), right.max())) + 1
+    keys, inverse = np.unique(left * width + right, return_inverse=True)
+    summed = np.bincount(inverse, weights=counts).astype(np.int64)
+    return keys // width, keys % width, summed
+
+
+def to_csr(left, right, counts, n_products):
+    """CSR arrays (indptr, indices, counts) with each row sorted by count desc and cut to MAX_NEIGHBORS."""
+    order = np.lexsort((-counts, left))
+    left, right, counts = left[order], right[order], counts[order]
+    starts = np.searchsorted(left, left, side='left')
+    keep = (np.arange(len(left)) - starts) < MAX_NEIGHBORS
+    left, right, counts = left[keep], right[keep], counts[keep]
+    indptr = np.zeros(n_products + 2, np.int64)
+    np.cumsum(np.bincount(left, minlength=n_products + 1), out=indptr[1:])
+    return indptr, right.astype(np.int32), counts.astype(np.int32)
+
+
+class Snapshot:
+    def __init__(self, indptr, indices, counts, last_item_id=0, generation=0):
+        self.indptr, self.indices, self.counts = indptr, indices, counts
+        self.last_item_id = last_item_id
+        self.generation = generation
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(1, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32))
+
+    def row(self, pid):
+        if pid < 0 or pid + 1 >= len(self.indptr):
+            return self.indices[:0], self.counts[:0]
+        a, b = self.indptr[pid], self.indptr[pid + 1]
+        return self.indices[a:b], self.counts[a:b]
+
+    def triples(self):
+        left = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        return left, self.indices.astype(np.int64), self.counts.astype(np.int64)
+
+
+def _to_array(rows):
+    """(n, 3) int64 array from (id, order_id, product_id) rows; much faster than np.array on Row objects."""
+    return np.fromiter(itertools.chain.from_iterable(rows), np.int64, count=len(rows) * 3).reshape(-1, 3)
+
+
+def _meta_path():
+    return os.path.join(RECS_DIR, 'current.json')
+
+
+def save_snapshot(indptr, indices, counts, last_item_id):
+    """Write a new generation and point current.json at it (atomic). Returns the generation."""
+    os.makedirs(RECS_DIR, exist_ok=True)
+    generation = time.time_ns()
+    previous = _current_generation()
+    for name, arr in (('indptr', indptr), ('indices', indices), ('counts', counts)):
+        np.save(os.path.join(RECS_DIR, f'{generation}.{name}.npy'), arr)
+    tmp = f'{_meta_path()}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'generation': generation, 'last_item_id': int(last_item_id), 'built_at': time.time()}, f)
+    os.replace(tmp, _meta_path())
+    # the previous generation stays until the next save: a worker may have just read current.json
+    # pointing at it. Older ones go; workers still mapping them keep the open files alive (on Windows
+    # the unlink fails while mapped and is retried after the next build).
+    keep = {str(generation), str(previous)}
+    for name in os.listdir(RECS_DIR):
+        if name.endswith('.npy') and name.split('.')[0] not in keep:
+            try:
+                os.remove(os.path.join(RECS_DIR, name))
+            except OSError:
+                pass
+    return generation
+
+
+def load_snapshot():
+    """The current snapshot; empty if none was built yet, None if it could not be read (retry later)."""
+    try:
+        with open(_meta_path()) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return Snapshot.empty()
+    except (OSError, ValueError):
+        return None
+    try:
+        g = meta['generation']
+        arrays = [np.load(os.path.join(RECS_DIR, f'{g}.{name}.npy'), mmap_mode='r')
+                  for name in ('indptr', 'indices', 'counts')]
+    except (OSError, ValueError, KeyError):
+        return None
+    return Snapshot(*arrays, last_item_id=meta['last_item_id'], generation=g)
+
+
+class Recommender:
+    """Per-process view: the shared snapshot plus pairs from orders placed since it was built."""
+
+    def __init__(self):
+        self.snapshot = load_snapshot() or Snapshot.empty()
+        self.overlay = {}  # product id -> {other id: count}
+        self.overlay_pairs = 0
+        self.last_item_id = self.snapshot.last_item_id
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.catching_up = False
+        self.dirty = False
+
+    def neighbors(self, pid):
+        """{other id: count} for one product (snapshot row + overlay)."""
+        indices, counts = self.snapshot.row(pid)
+        out = dict(zip(indices.tolist(), counts.tolist()))
+        extra = self.overlay.get(pid)
+        if extra:
+            for other, n in list(extra.items()):
+                out[other] = out.get(other, 0) + n
+        return out
+
+    def top(self, product_ids, k=10):
+        """[(product id, score)] for products bought with any of `product_ids`, excluding them."""
+        product_ids = [int(p) for p in product_ids]
+        if len(product_ids) == 1 and product_ids[0] not in self.overlay:
+            indices, counts = self.snapshot.row(product_ids[0])  # fast path: already sorted
+            return [(i, c) for i, c in zip(indices[:k + 1].tolist(), counts[:k + 1].tolist())
+                    if i != product_ids[0]][:k]
+        scores = {}
+        for pid in product_ids:
+            for other, n in self.neighbors(pid).items():
+                scores[other] = scores.get(other, 0) + n
+        for pid in product_ids:
+            scores.pop(pid, None)
+        return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+
+    def maybe_catch_up(self, app, force=False):
+        """Schedule catch_up() on the background pool: always with force (after a checkout),
+        otherwise only if this worker has not looked at the DB for CATCH_UP_INTERVAL seconds.
+        """
+        if not force and time.time() - self.checked_at < CATCH_UP_INTERVAL:
+            return
+        self.dirty = True
+        if not self.catching_up:
+            self.catching_up = True
+            background.submit(self._catch_up_in, app)
+
+    def _catch_up_in(self, app):
+        try:
+            with app.app_context():
+                while self.dirty:  # a checkout during a run asks for one more pass
+                    self.dirty = False
+                    self.catch_up()
+        finally:
+            self.catching_up = False
+
+    def catch_up(self):
+        """Fold order lines newer than last_item_id into the overlay. Needs an app context."""
+        from database_models import db, OrderItem
+        with self.lock:
+            self.checked_at = time.time()
+            current = _current_generation()
+            snapshot = load_snapshot() if current and current != self.snapshot.generation else None
+            if snapshot is not None:
+                # another worker compacted: start over from its snapshot. If it could not be read
+                # (replaced meanwhile), keep ours and its last_item_id rather than replay all history.
+                self.snapshot = snapshot
+                self.overlay, self.overlay_pairs = {}, 0
+                self.last_item_id = self.snapshot.last_item_id
+            rows = (db.session.query(OrderItem.id, OrderItem.order_id, OrderItem.product_id)
+                    .filter(OrderItem.id > self.last_item_id).order_by(OrderItem.id).all())
+            if not rows:
+                return 0
+            arr = _to_array(rows)
+            left, right, counts = pairs_from_orders(arr[:, 1], arr[:, 2])
+            for a, b, n in zip(left.tolist(), right.tolist(), counts.tolist()):
+                row = self.overlay.setdefault(a, {})
+                if b not in row:
+                    self.overlay_pairs += 1
+                row[b] = row.get(b, 0) + n
+            self.last_item_id = int(arr[:, 0].max())
+            if self.overlay_pairs >= COMPACT_AT:
+                self.compact()
+            return len(rows)
+
+    def compact(self):
+        """Merge the overlay into a new snapshot generation (caller holds the lock)."""
+        left, right, counts = self.snapshot.triples()
+        o_left = np.array([a for a, row in self.overlay.items() for _ in row], np.int64)
+        o_right = np.array([b for row in self.overlay.values() for b in row], np.int64)
+        o_counts = np.array([n for row in self.overlay.values() for n in row.values()], np.int64)
+        left, right, counts = _sum_pairs(np.r_[left, o_left], np.r_[right, o_right], np.r_[counts, o_counts])
+        n = max(len(self.snapshot.indptr) - 2, int(left.max()) if len(left) else 0)
+        save_snapshot(*to_csr(left, right, counts, n), self.last_item_id)
+        snapshot = load_snapshot()
+        if snapshot is not None:  # else keep the old snapshot plus overlay; catch_up() reloads later
+            self.snapshot = snapshot
+            self.overlay, self.overlay_pairs = {}, 0
+
+
+def _current_generation():
+    try:
+        with open(_meta_path()) as f:
+            return json.load(f)['generation']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+_recommender = None
+_init_lock = threading.Lock()
+
+
+def get_recommender():
+    global _recommender
+    if _recommender is None:
+        with _init_lock:
+            if _recommender is None:
+                _recommender = Recommender()
+    return _recommender
+
+
+def rebuild(chunk=1000000, log=print):
+    """Recompute every count from order_items and write a fresh snapshot. Needs an app context."""
+    from database_models import db, OrderItem
+    start = time.perf_counter()
+    orders, products = [], []
+    last_id = max_id = 0
+    while True:
+        rows = (db.session.query(OrderItem.id, OrderItem.order_id, OrderItem.product_id)
+                .filter(OrderItem.id > last_id).order_by(OrderItem.id).limit(chunk).all())
+        if not rows:
+            break
+        arr = _to_array(rows)
+        orders.append(arr[:, 1])
+        products.append(arr[:, 2])
+        last_id = max_id = int(arr[-1, 0])
+        log(f'  read {sum(len(o) for o in orders)} order lines')
+    orders = np.concatenate(orders) if orders else np.zeros(0, np.int64)
+    products = np.concatenate(products) if products else np.zeros(0, np.int64)
+    left, right, counts = pairs_from_orders(orders, products)
+    n = int(products.max()) if len(products) else 0
+    indptr, indices, counts = to_csr(left, right, counts, n)
+    generation = save_snapshot(indptr, indices, counts, max_id)
+    log(f'rebuilt from {len(orders)} order lines: {len(indices)} pairs for {n} products '
+        f'in {time.perf_counter() - start:.1f}s (generation {generation})')
+    global _recommender
+    _recommender = None
+    return {'order_lines': len(orders), 'pairs': len(indices)}
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Frequently-bought-together index.')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('rebuild', help='Recompute all counts from order history')
+    show = sub.add_parser('show', help='Print the top products bought with one product')
+    show.add_argument('product_id', type=int)
+    show.add_argument('-k', type=int, default=10)
+    args = ap.parse_args()
+
+    from database_models import create_db_app
+    app = create_db_app()
+    with app.app_context():
+        if args.cmd == 'rebuild':
+            rebuild()
+        else:
+            rec = get_recommender()
+            rec.catch_up()
+            for pid, n in rec.top([args.product_id], args.k):
+                print(f'{pid}\t{n}')
@@ -3,6 +3,7 @@
    - Uses JWT (localStorage.access_token) for authenticated cart/checkout
    - Falls back to localStorage for unauthenticated users
    - Product detail modal with reviews from /api/reviews (if ASIN present)
+   - Batches product view / click / add-to-cart events to /api/events
 */
 
 console.log('=== MyShop Loading ===');
@@ -43,7 +44,9 @@ function getAuthToken(){ return localStorage.getItem('access_token') }
 async function fetchProducts(){
   try{
     console.log('Fetching products from /api/products...');
-    const resp = await fetch('/api/products');
+    // logged-in users get the list ranked for them
+    const token = getAuthToken();
+    const resp = await fetch('/api/products', token ? { headers: { 'Authorization': 'Bearer ' + token } } : {});
     console.log('Response status:', resp.status);
     console.log('Response headers:', {
       'content-type': resp.headers.get('content-type'),
@@ -109,6 +112,42 @@ function filterByCategory(catId) {
   renderProducts(document.getElementById('search').value);
 }
 
+// Card image: a <picture> with AVIF/WebP srcsets when the server has resized variants
+function productImageHtml(p) {
+  // blurred inline placeholder painted until the image itself arrives
+  const ph = p.lqip ? ` style="background:${p.dominant_color || '#eee'} url('${p.lqip}') center/cover"`
+    : (p.dominant_color ? ` style="background:${p.dominant_color}"` : '');
+  const px = p.image_proxy;
+  if (px) {
+    // external image: resized copies from the server's /img proxy
+    return `<img loading="lazy" src="${px.card}" srcset="${px.thumb} 160w, ${px.card} 320w" sizes="(max-width:620px) 100vw, 320px" alt="${p.name}"${ph} />`;
+  }
+  const img = `<img loading="lazy" src="${p.image_url || 'o2_featured_v2.avif'}" alt="${p.name}"${ph} />`;
+  const v = p.image_variants;
+  if (!v || !v.srcset) return img;
+  const sizes = '(max-width:620px) 100vw, 320px';
+  const sources = ['avif', 'webp'].filter(f => v.srcset[f])
+    .map(f => `<source type="image/${f}" srcset="${v.srcset[f]}" sizes="${sizes}" />`).join('');
+  return `<picture>${sources}${img}</picture>`;
+}
+
+// Typo-tolerant search on the server (/api/search); falls back to local substring filtering
+let searchResults = null;
+async function runSearch(q) {
+  const query = (q || '').trim();
+  searchResults = null;
+  if (query) {
+    try {
+      const resp = await fetch(`/api/search?q=${encodeURIComponent(query)}&limit=60`);
+      if (resp.ok) {
+        const data = await resp.json();
+        if (!data.index) searchResults = { query, items: data.results, didYouMean: data.did_you_mean };
+      }
+    } catch (e) { /* offline: local filtering */ }
+  }
+  renderProducts(query);
+}
+
 // Render product grid with search and category filter
 function renderProducts(q = '') {
   console.log('renderProducts called with query:', q);
@@ -120,11 +159,28 @@ function renderProducts(q = '') {
   }
   root.innerHTML = '';
   const query = (q || '').trim().toLowerCase();
-  const list = products.filter(p => {
+  // server-side fuzzy results for this query, if the search box has been submitted
+  const fuzzy = searchResults && searchResults.query.toLowerCase() === query ? searchResults : null;
+  const list = (fuzzy ? fuzzy.items : products).filter(p => {
     if (activeCategory && p.category_id !== activeCategory) return false;
-    if (!query) return true;
+    if (!query || fuzzy) return true;
     return p.name.toLowerCase().includes(query) || (p.description || '').toLowerCase().includes(query);
   });
+  if (fuzzy && fuzzy.didYouMean) {
+    const hint = document.createElement('p');
+    hint.className = 'did-you-mean';
+    hint.style.gridColumn = '1 / -1';
+    const link = document.createElement('a');
+    link.href = '#';
+    link.textContent = fuzzy.didYouMean;
+    link.onclick = (e) => {
+      e.preventDefault();
+      document.getElementById('search').value = fuzzy.didYouMean;
+      runSearch(fuzzy.didYouMean);
+    };
+    hint.append('Did you mean ', link, '?');
+    root.appendChild(hint);
+  }
   console.log('Filtered products:', list.length);
   list.forEach(p => {
     const card = document.createElement('article');
@@ -134,7 +190,7 @@ function renderProducts(q = '') {
       ? `<div style="display:flex;align-items:center;gap:8px"><span class="price">₹${p.discount_price}</span><span class="old-price">₹${p.price}</span><span class="discount">${discountPct}% OFF</span></div>`
       : `<div class="price">₹${p.price}</div>`;
     card.innerHTML = `
-      <img loading="lazy" src="${p.image_url || 'o2_featured_v2.avif'}" alt="${p.name}" />
+      ${productImageHtml(p)}
       <div class="meta">
         <div>
           <div style="font-weight:800;margin-bottom:4px">${p.name}</div>
@@ -148,6 +204,7 @@ function renderProducts(q = '') {
     // Open product detail on card click (not on button click)
     card.onclick = (e) => {
       if (e.target && e.target.classList && e.target.classList.contains('add-btn')) return;
+      trackEvent('click', p.id, fuzzy ? 'search' : 'grid');
       openProductDetails(p.id);
     };
     root.appendChild(card);
@@ -157,6 +214,7 @@ function renderProducts(q = '') {
     btn.onclick = async (e) => {
       e.stopPropagation();
       const id = btn.dataset.id;
+      trackEvent('add_to_cart', id, 'grid');
       await addToCartApi(id, 1);
       updateCartCount();
       btn.animate([{ transform: 'scale(1)' }, { transform: 'scale(1.04)' }, { transform: 'scale(1)' }], { duration: 160 });
@@ -165,6 +223,44 @@ function renderProducts(q = '') {
   console.log('Rendered ' + list.length + ' product cards in grid');
 }
 
+// Behavioural events (view / click / add_to_cart), queued and sent to /api/events in batches
+const EVENT_BATCH = 20;
+const EVENT_DELAY = 5000;
+let eventQueue = [];
+let eventTimer = null;
+
+function eventSession(){
+  let s = sessionStorage.getItem('event_session');
+  if(!s){
+    s = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    sessionStorage.setItem('event_session', s);
+  }
+  return s;
+}
+
+function trackEvent(type, productId, source){
+  eventQueue.push({type, product_id: Number(productId), source, t: Date.now()});
+  if(eventQueue.length >= EVENT_BATCH) flushEvents();
+  else if(!eventTimer) eventTimer = setTimeout(flushEvents, EVENT_DELAY);
+}
+
+function flushEvents(beacon=false){
+  clearTimeout(eventTimer);
+  eventTimer = null;
+  if(!eventQueue.length) return;
+  const body = JSON.stringify({session: eventSession(), sent: Date.now(), events: eventQueue.splice(0, 500)});
+  if(eventQueue.length) eventTimer = setTimeout(flushEvents, EVENT_DELAY);
+  // the page is going away: a beacon still gets out (without the token, so anonymously)
+  if(beacon && navigator.sendBeacon && navigator.sendBeacon('/api/events', body)) return;
+  const token = getAuthToken();
+  const headers = {'Content-Type':'application/json'};
+  if(token) headers['Authorization'] = 'Bearer ' + token;
+  fetch('/api/events', {method:'POST', headers, body, keepalive:true}).catch(e => console.warn('events not sent', e));
+}
+
+document.addEventListener('visibilitychange', () => { if(document.visibilityState === 'hidden') flushEvents(true); });
+window.addEventListener('pagehide', () => flushEvents(true));
+
 async function addToCartApi(productId, qty=1){
   const token = getAuthToken();
   if(token){
@@ -325,13 +421,28 @@ if (checkoutBtn) {
 }
 
 // Product detail modal
+function renderReviews(reviewsEl, data) {
+  if (data && data.ok && data.reviews) {
+    const arr = data.reviews?.reviews || data.reviews || [];
+    if (arr.length === 0) reviewsEl.textContent = 'No reviews available.';
+    else reviewsEl.innerHTML = arr.map(rv => `<div style="margin-bottom:10px"><strong>${rv.title || rv.heading || rv.displayTitle || 'Review'}</strong><div style="font-size:0.95rem;color:var(--muted)">${rv.content || rv.reviewText || rv.review || ''}</div></div>`).join('\n');
+  } else {
+    reviewsEl.textContent = (data && data.error) || 'Unable to fetch reviews.';
+  }
+}
+
 async function openProductDetails(id) {
   try {
-    const resp = await fetch(`/api/products/${id}`);
+    // product, reviews and related items in one round trip; slow parts come back in timed_out
+    const resp = await fetch(`/api/products/${id}/full`);
     if (!resp.ok) { alert('Product not found'); return; }
-    const p = await resp.json();
+    const full = await resp.json();
+    const p = full.product;
+    trackEvent('view', p.id, 'detail');
     document.getElementById('productTitle').textContent = p.name || 'Product';
-    document.getElementById('productDetailImage').src = p.image_url || 'o2_featured_v2.avif';
+    const detailImg = document.getElementById('productDetailImage');
+    const detailVariant = (p.image_variants?.sizes || []).find(v => v.preset === 'detail' && v.format === 'webp');
+    detailImg.src = detailVariant ? detailVariant.url : (p.image_proxy?.detail || p.image_url || 'o2_featured_v2.avif');
     document.getElementById('productDetailDesc').textContent = p.description || '';
     const priceEl = document.getElementById('productDetailPrice');
     priceEl.textContent = p.discount_price ? `₹${p.discount_price} (was ₹${p.price})` : `₹${p.price}`;
@@ -339,27 +450,25 @@ async function openProductDetails(id) {
     modal.classList.remove('hidden');
     const addBtn = document.getElementById('productAddBtn');
     addBtn.onclick = async () => {
+      trackEvent('add_to_cart', p.id, 'detail');
       await addToCartApi(p.id, 1);
       updateCartCount();
       alert('Added to cart!');
     };
-    // Fetch reviews
     const reviewsEl = document.getElementById('productReviews');
-    reviewsEl.textContent = 'Loading reviews...';
-    if (p.asin) {
+    if (!p.asin) {
+      reviewsEl.textContent = 'No reviews data available for this product.';
+    } else if (full.reviews) {
+      renderReviews(reviewsEl, full.reviews);
+    } else if ((full.timed_out || []).includes('reviews')) {
+      // still loading upstream: ask again on the plain endpoint, which joins the same fetch
+      reviewsEl.textContent = 'Loading reviews...';
       try {
         const r = await fetch(`/api/reviews?asin=${encodeURIComponent(p.asin)}`);
-        const data = await r.json();
-        if (data.ok && data.reviews) {
-          const arr = data.reviews?.reviews || data.reviews || [];
-          if (arr.length === 0) reviewsEl.textContent = 'No reviews available.';
-          else reviewsEl.innerHTML = arr.map(rv => `<div style="margin-bottom:10px"><strong>${rv.title || rv.heading || rv.displayTitle || 'Review'}</strong><div style="font-size:0.95rem;color:var(--muted)">${rv.content || rv.reviewText || rv.review || ''}</div></div>`).join('\n');
-        } else {
-          reviewsEl.textContent = data.error || 'Unable to fetch reviews.';
-        }
+        renderReviews(reviewsEl, await r.json());
       } catch (e) { reviewsEl.textContent = 'Reviews unavailable'; }
     } else {
-      reviewsEl.textContent = 'No reviews data available for this product.';
+      reviewsEl.textContent = 'Reviews unavailable';
     }
   } catch (e) { console.error(e); alert('Failed to load product'); }
 }
@@ -376,7 +485,7 @@ if (closeProductDetailBtn) {
 const searchBtn = document.getElementById('searchBtn');
 if (searchBtn) {
   searchBtn.onclick = () => {
-    renderProducts(document.getElementById('search').value);
+    runSearch(document.getElementById('search').value);
   };
 }
 
@@ -476,4 +585,4 @@ window.addEventListener('load', () => {
   fetchProducts();
   updateCartCount();
   renderCart();
-});
\ No newline at end of file
+});
\ No newline at end of file
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Typo-tolerant product search: an in-memory trigram index, no search server.
+Usage:
+  python search_index.py "bluetoth headphons"     # build once and query
+
+Product names are split into lowercase words. Two indexes are built, both
+as sorted numpy arrays (CSR posting lists) with vectorized code, so 1M
+products take seconds and a few compact arrays rather than millions of
+Python objects:
+
+  - word -> product rows that contain the word
+  - trigram -> vocabulary words that contain the trigram. Each word is
+    padded ("  word ") and cut into byte trigrams, encoded as 24-bit ints.
+
+A query word that is a known word matches itself (similarity 1). An unknown
+word ("headphons") is looked up in the trigram index and expands to the
+EXPANSIONS most similar known words. Similarity is shared trigrams over the
+larger trigram count, and words below WORD_SIMILARITY are dropped. Matching
+typos against the vocabulary, rather than against every product, keeps the
+posting lists short: common trigrams such as " ca" sit in most product names
+but in few distinct words.
+
+Candidates come from intersecting the word posting lists: the smallest list
+is probed against the others with searchsorted. Products score the mean
+similarity of their matched words. If fewer than `limit` products match
+every word, products matching at least MIN_SIMILARITY of the words are added
+at a lower score. Ties go to the shorter name, then the lower id.
+
+"Did you mean" is the query with each unknown word replaced by its best
+expansion.
+
+The index is built in a daemon thread on the first search (at startup with
+SEARCH_INDEX_PRELOAD=1). Until it is ready, search falls back to a SQL LIKE
+on the literal query. Product writes in this process apply at once as
+overrides of the indexed rows. Other workers' creates, renames and deletes
+arrive through the catalog version (catch_up()) and become overrides too,
+looked up by the product ids the change recorded. Past REBUILD_AFTER
+overrides, when those ids are unknown, or when another worker changes the
+product count or max id, the index is rebuilt in the background and swapped
+in. A rebuild asked for while one runs is queued and runs right after it.
+
+The index, its overrides and the per-row stale flags are published together
+as one immutable State tuple. Writers build a new one and swap it in, so a
+search (which reads `state` once, without the lock) never pairs one
+generation's flags with another's index.
+"""
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+WORD_SIMILARITY = float(os.environ.get('SEARCH_WORD_SIMILARITY', 0.45))
+MIN_SIMILARITY = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.5))  # share of query words a partial match needs
+EXPANSIONS = 3  # known words tried per unknown query word
+MAX_WORDS = 8  # query words looked at
+REBUILD_AFTER = int(os.environ.get('SEARCH_REBUILD_AFTER', 2000))  # overrides before a full rebuild
+CHECK_INTERVAL = float(os.environ.get('SEARCH_CHECK_INTERVAL', 60))  # seconds between checks for other writers
+BUILD_CHUNK = 100000
+_WORD = re.compile(r'[^\W_]+')
+
+
+# overrides: product id -> (seq, set of name words, or None if deleted); stale: read-only bool per index row
+State = namedtuple('State', 'index overrides stale')
+
+
+def words(text):
+    return _WORD.findall((text or '').lower())
+
+
+def _sorted_unique(a):
+    """Sorted distinct values; sort + diff is far faster than np.unique on large int64 arrays."""
+    a = np.sort(a)
+    return a[np.r_[True, a[1:] != a[:-1]]] if len(a) else a
+
+
+def _windows(texts):
+    """Distinct (trigram code << 32 | row) keys for a list of words, sorted."""
+    encoded = [f'  {t} '.encode('utf-8') for t in texts]
+    lengths = np.fromiter(map(len, encoded), np.int64, count=len(encoded))
+    buf = np.frombuffer(b''.join(encoded), np.uint8).astype(np.int64)
+    if len(buf) < 3:
+        return np.zeros(0, np.int64)
+    ends = np.cumsum(lengths)
+    row = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)[:-2]
+    valid = np.arange(len(buf) - 2) + 2 < ends[row]
+    code = (buf[:-2] << 16) | (buf[1:-1] << 8) | buf[2:]
+    return _sorted_unique((code[valid] << 32) | row[valid])
+
+
+def trigrams(word):
+    """Sorted distinct trigram codes of one word."""
+    return _windows([word]) >> 32
+
+
+class TrigramIndex:
+    """Trigram posting lists over a list of words; row i is words[i]."""
+
+    def __init__(self, texts):
+        keys = _windows(texts)
+        codes = keys >> 32
+        first = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0, np.int64)
+        self.codes = codes[first]
+        self.starts = np.r_[first, len(codes)].astype(np.int64)
+        self.rows = (keys & 0xFFFFFFFF).astype(np.int32)
+        self.lengths = np.bincount(self.rows, minlength=len(texts))  # trigrams per word
+
+    def match(self, codes, min_similarity):
+        """(rows, similarity) for words sharing at least min_similarity of trigrams with `codes`."""
+        i = np.searchsorted(self.codes, codes)
+        i = i[(i < len(self.codes)) & (self.codes[np.minimum(i, len(self.codes) - 1)] == codes)]
+        if not len(i):
+            return np.zeros(0, np.int64), np.zeros(0)
+        hits = np.concatenate([self.rows[self.starts[j]:self.starts[j + 1]] for j in i])
+        rows, shared = np.unique(hits, return_counts=True)  # a few thousand at most
+        similarity = shared / np.maximum(len(codes), self.lengths[rows])
+        keep = similarity >= min_similarity
+        return rows[keep], similarity[keep]
+
+
+class SearchIndex:
+    def __init__(self, ids, names, fingerprint=None):
+        start = time.perf_counter()
+        self.ids = np.asarray(ids, np.int64)  # sorted (loaded in id order)
+        tokens = [dict.fromkeys(words(name)) for name in names]  # distinct words per name, in order
+        lengths = np.fromiter(map(len, tokens), np.int64, count=len(tokens))
+        vocab = {}
+        word_ids = np.fromiter((vocab.setdefault(w, len(vocab)) for t in tokens for w in t), np.int64,
+                               count=int(lengths.sum()))
+        rows = np.repeat(np.arange(len(tokens), dtype=np.int64), lengths)
+        keys = np.sort((word_ids << 32) | rows)
+        self.starts = np.searchsorted(keys >> 32, np.arange(len(vocab) + 1))
+        self.rows = (keys & 0xFFFFFFFF).astype(np.int32)  # product rows per word, sorted
+        self.name_words = np.minimum(lengths, 1023)
+        self.word_ids = vocab
+        self.vocab = list(vocab)
+        self.df = np.diff(self.starts)  # products per word
+        self.trigrams = TrigramIndex(self.vocab)
+        self.fingerprint = fingerprint
+        self.build_seconds = time.perf_counter() - start
+
+    def row_of(self, product_id):
+        i = np.searchsorted(self.ids, product_id)
+        return i if i < len(self.ids) and self.ids[i] == product_id else None
+
+    def expand(self, word):
+        """[(word id, similarity)]: the word itself if known, else its closest known words."""
+        wid = self.word_ids.get(word)
+        if wid is not None:
+            return [(wid, 1.0)]
+        if len(word) < 3 or word.isdigit():
+            return []
+        rows, similarity = self.trigrams.match(trigrams(word), WORD_SIMILARITY)
+        order = np.lexsort((-self.df[rows], -similarity))[:EXPANSIONS]
+        return [(int(rows[i]), float(similarity[i])) for i in order]
+
+    def word_rows(self, expansion):
+        """(sorted product rows, similarity per row) for one expanded query word."""
+        if len(expansion) == 1:
+            wid, sim = expansion[0]
+            rows = self.rows[self.starts[wid]:self.starts[wid + 1]]
+            return rows, np.full(len(rows), sim, np.float32)
+        rows = np.concatenate([self.rows[self.starts[w]:self.starts[w + 1]] for w, _ in expansion])
+        sims = np.concatenate([np.full(self.df[w], s, np.float32) for w, s in expansion])
+        order = np.lexsort((-sims, rows))  # best similarity first within a row
+        rows, sims = rows[order], sims[order]
+        first = np.r_[True, rows[1:] != rows[:-1]]
+        return rows[first], sims[first]
+
+    def match(self, expansions, n_words, limit):
+        """(rows, summed similarity) of products matching the query words."""
+        lists = sorted((self.word_rows(e) for e in expansions if e), key=lambda x: len(x[0]))
+        if not lists:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        # products with every matchable word: probe the smallest list against the others
+        rows, score = lists[0]
+        for other, other_sims in lists[1:]:
+            if not len(rows):
+                break
+            pos = np.minimum(np.searchsorted(other, rows), len(other) - 1)
+            hit = other[pos] == rows
+            rows, score = rows[hit], score[hit] + other_sims[pos[hit]]
+        if len(rows) >= limit or len(lists) == 1:
+            return rows, score
+        # not enough: also products with at least MIN_SIMILARITY of the words
+        need = max(1, math.ceil(MIN_SIMILARITY * n_words))
+        rows = np.concatenate([r for r, _ in lists])
+        sims = np.concatenate([s for _, s in lists])
+        order = np.argsort(rows, kind='stable')
+        rows, sims = rows[order], sims[order]
+        first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        counts = np.diff(np.r_[first, len(rows)])
+        score = np.add.reduceat(sims, first) if len(first) else sims[:0]
+        keep = counts >= need
+        return rows[first][keep], score[keep]
+
+
+class Searcher:
+    """The live index for this process, plus product writes made since it was built."""
+
+    def __init__(self):
+        self.state = State(None, {}, None)  # replaced whole, never modified in place
+        self.seq = 0
+        self.version = None  # catalog version the index (plus overrides) reflects
+        self.lock = threading.Lock()
+        self.building = False
+        self.pending = False  # another build was asked for while one ran
+        self.checked_at = 0.0
+        self.app = None
+
+    @property
+    def index(self):
+        return self.state.index
+
+    def start(self, app):
+        """Build in a daemon thread so startup (and scripts using create_app) never wait for it.
+        During a build, queue one more so changes made meanwhile are not lost."""
+        self.app = app
+        with self.lock:
+            if self.building:
+                self.pending = True
+                return
+            self.building = True
+        threading.Thread(target=self._run, args=(app,), daemon=True, name='search-index').start()
+
+    def _run(self, app):
+        while True:
+            with self.lock:
+                self.pending = False
+            try:
+                self._build(app)
+            finally:
+                with self.lock:
+                    if not self.pending:
+                        self.building = False
+            if not self.building:
+                return
+
+    def catch_up(self, app, version):
+        """Apply other workers' product creates, renames and deletes up to catalog `version`:
+        targeted updates when the changed products are known, else a rebuild. Needs an app context."""
+        import catalog
+        from database_models import db, Product
+        since = self.version
+        if since is None or version <= since:
+            return  # not built yet: the build reads current names
+        latest, ids = catalog.changed_products(since, 'name')
+        if ids is None or len(ids) > REBUILD_AFTER:
+            self.start(app)
+            return
+        ids = sorted(ids)
+        names = {}
+        for i in range(0, len(ids), 500):
+            names.update(db.session.query(Product.id, Product.name).filter(Product.id.in_(ids[i:i + 500])).all())
+        self.update_many([(pid, (names[pid] or '') if pid in names else None) for pid in ids])
+        with self.lock:
+            self.version = max(self.version or 0, latest)
+
+    def _build(self, app):
+        try:
+            with app.app_context():
+                import catalog
+                from database_models import db, Product
+                since = self.seq
+                version = catalog.poll(force=True)  # read before the rows: later changes are caught up
+                ids, names = [], []
+                last_id = 0
+                while True:
+                    rows = (db.session.query(Product.id, Product.name).filter(Product.id > last_id)
+                            .order_by(Product.id).limit(BUILD_CHUNK).all())
+                    if not rows:
+                        break
+                    ids.extend(r[0] for r in rows)
+                    names.extend(r[1] or '' for r in rows)
+                    last_id = rows[-1][0]
+                index = SearchIndex(ids, names, (len(ids), last_id))
+            with self.lock:
+                overrides = {pid: o for pid, o in self.state.overrides.items() if o[0] > since}
+                stale = np.zeros(len(ids), bool)
+                for pid in overrides:
+                    row = index.row_of(pid)
+                    if row is not None:
+                        stale[row] = True
+                stale.flags.writeable = False
+                self.state = State(index, overrides, stale)
+                self.version = max(self.version or 0, version)
+                self.checked_at = time.time()
+            print(f'search index: {len(ids)} products, {len(index.vocab)} words in {index.build_seconds:.1f}s')
+        except Exception as e:
+            print(f'search index build failed: {e}')
+
+    def update(self, product_id, name):
+        """Reflect a create/rename (name) or delete (None) in this process right away."""
+        self.update_many([(product_id, name)])
+
+    def update_many(self, changes):
+        """update() for [(product id, name or None)], publishing one new state for all of them."""
+        with self.lock:
+            index, overrides, stale = self.state
+            overrides = dict(overrides)
+            if index is not None:
+                stale = stale.copy()
+            for product_id, name in changes:
+                self.seq += 1
+                overrides[product_id] = (self.seq, set(words(name)) if name is not None else None)
+                row = index.row_of(product_id) if index is not None else None
+                if row is not None:
+                    stale[row] = True
+            if stale is not None:
+                stale.flags.writeable = False
+            self.state = State(index, overrides, stale)
+            rebuild = len(overrides) > REBUILD_AFTER
+        if rebuild and self.app is not None:
+            self.start(self.app)
+
+    def maybe_refresh(self, app):
+        """Build on first use; rebuild if another worker added or deleted products (count / max id changed)."""
+        if self.building or time.time() - self.checked_at < CHECK_INTERVAL:
+            return
+        self.checked_at = time.time()
+        if self.index is None:
+            self.start(app)
+            return
+        from database_models import db, Product
+        count, max_id = db.session.query(db.func.count(Product.id), db.func.max(Product.id)).one()
+        if self.index is not None and (count, max_id or 0) != self.index.fingerprint:
+            self.start(app)
+
+    def search(self, query, limit=20):
+        """{'product_ids': [...], 'scores': [...], 'did_you_mean': str or None} or None if not built yet."""
+        index, overrides, stale = self.state
+        if index is None:
+            return None
+        limit = max(1, int(limit))
+        query_words = list(dict.fromkeys(words(query)))[:MAX_WORDS]
+        expansions = [index.expand(w) for w in query_words]
+        n = max(len(query_words), 1)
+        rows, score = index.match(expansions, n, limit)
+        if overrides:
+            keep = ~stale[rows]
+            rows, score = rows[keep], score[keep]
+        ids, name_words = index.ids[rows], index.name_words[rows]
+        if overrides:
+            extra = self._match_overrides(overrides, index, query_words, expansions, n)
+            if extra:
+                ids = np.r_[ids, [e[0] for e in extra]]
+                score = np.r_[score, [e[1] for e in extra]]
+                name_words = np.r_[name_words, [e[2] for e in extra]]
+        # one int64 sort key: score (4 decimals) desc, then shorter name, then lower id
+        key = (((10000 - np.round(score / n * 10000).astype(np.int64)) * 1024 + name_words) << 32) | ids
+        if len(key) > limit:
+            key = key[np.argpartition(key, limit - 1)[:limit]]
+        key = np.sort(key)
+        corrected = [index.vocab[e[0][0]] if e and index.word_ids.get(w) is None else w
+                     for w, e in zip(query_words, expansions)]
+        return {
+            'product_ids': (key & 0xFFFFFFFF).tolist(),
+            'scores': np.round(1 - (key >> 42) / 10000, 4).tolist(),
+            'did_you_mean': ' '.join(corrected) if corrected != query_words else None,
+        }
+
+    @staticmethod
+    def _match_overrides(overrides, index, query_words, expansions, n):
+        """[(product id, summed similarity, name words)] for products written since the build."""
+        need = max(1, math.ceil(MIN_SIMILARITY * n))
+        out = []
+        for pid, (_, name_words) in overrides.items():
+            if not name_words:
+                continue
+            total, matched = 0.0, 0
+            for w, expansion in zip(query_words, expansions):
+                sims = [s for wid, s in expansion if index.vocab[wid] in name_words]
+                if w in name_words:
+                    sims.append(1.0)
+                if sims:
+                    total += max(sims)
+                    matched += 1
+            if matched >= need:
+                out.append((pid, total, min(len(name_words), 1023)))
+        return out
+
+
+searcher = Searcher()
+
+
+def start(app):
+    searcher.start(app)
+
+
+def update(product):
+    searcher.update(product.id, product.name)
+
+
+def remove(product_id):
+    searcher.update(product_id, None)
+
+
+if __name__ == '__main__':
+    from database_models import create_db_app
+    query = ' '.join(sys.argv[1:]) or 'bluetoth headphons'
+    app = create_db_app()
+    searcher._build(app)
+    for _ in range(3):
+        t = time.perf_counter()
+        result = searcher.search(query)
+        print(f'{(time.perf_counter() - t) * 1000:.2f} ms')
+    print(result)
@@ -1,9 +1,18 @@
-from app import create_app
+#!/usr/bin/env python3
+"""
+Seed the database with sample categories, ~1000 products and demo users.
+Usage:
+  python seed_db.py
+  python seed_db.py --synthetic 1000000 [--seed 42] [--users N] [--orders N]
+
+--synthetic generates a deterministic load-test catalog (products, users,
+carts and order history) in bulk instead; see seed_synthetic.py.
+"""
+import argparse
+from database_models import create_db_app
 from database_models import db, User, Category, Product, Cart
 import random
 
-app = create_app()
-
 SAMPLE_CATEGORIES = [
     {'name': 'Electronics'},
     {'name': 'Fashion'},
@@ -223,81 +232,114 @@ for _ in range(900):
         'asin': f'B{random.randint(10000000, 99999999)}' if random.random() > 0.4 else None
     })
 
-with app.app_context():
-    print('Creating database tables...')
-    db.create_all()
+def seed_sample(app):
+    with app.app_context():
+        print('Creating database tables...')
+        db.create_all()
 
-    # create categories
-    cat_map = {}
-    for c in SAMPLE_CATEGORIES:
-        existing = Category.query.filter_by(name=c['name']).first()
-        if not existing:
-            existing = Category(name=c['name'])
-            db.session.add(existing)
-    db.session.commit()
-    for c in Category.query.all():
-        cat_map[c.name] = c.id
-
-    # create products in batches
-    print(f'Creating {len(SAMPLE_PRODUCTS)} products...')
-    batch_size = 100
-    for i, p in enumerate(SAMPLE_PRODUCTS):
-        if not Product.query.filter_by(name=p['name']).first():
-            pr = Product(
-                name=p['name'], 
-                description=p['description'], 
-                price=p['price'],
-                discount_price=p.get('discount_price'), 
-                stock=p['stock'], 
-                image_url=p.get('image_url'), 
-                rating=p.get('rating', 0.0),
-                category_id=cat_map.get(p['category']), 
-                asin=p.get('asin')
-            )
-            db.session.add(pr)
-        if (i + 1) % batch_size == 0:
-            db.session.commit()
-            print(f'  ... {i + 1}/{len(SAMPLE_PRODUCTS)} products created')
-    db.session.commit()
-    print(f'Products creation complete. Total: {Product.query.count()}')
+        # create categories
+        cat_map = {}
+        for c in SAMPLE_CATEGORIES:
+            existing = Category.query.filter_by(name=c['name']).first()
+            if not existing:
+                existing = Category(name=c['name'])
+                db.session.add(existing)
+        db.session.commit()
+        for c in Category.query.all():
+            cat_map[c.name] = c.id
 
-    # create an admin user
-    admin_email = 'admin@example.com'
-    if not User.query.filter_by(email=admin_email).first():
-        u = User(name='Admin', email=admin_email, role='admin')
-        u.set_password('admin123')
-        db.session.add(u)
+        # create products in batches; existing names are loaded once instead of queried per product
+        print(f'Creating {len(SAMPLE_PRODUCTS)} products...')
+        batch_size = 100
+        existing_names = {name for (name,) in db.session.query(Product.name)}
+        for i, p in enumerate(SAMPLE_PRODUCTS):
+            if p['name'] not in existing_names:
+                existing_names.add(p['name'])
+                pr = Product(
+                    name=p['name'], 
+                    description=p['description'], 
+                    price=p['price'],
+                    discount_price=p.get('discount_price'), 
+                    stock=p['stock'], 
+                    image_url=p.get('image_url'), 
+                    rating=p.get('rating', 0.0),
+                    category_id=cat_map.get(p['category']), 
+                    asin=p.get('asin')
+                )
+                db.session.add(pr)
+            if (i + 1) % batch_size == 0:
+                db.session.commit()
+                print(f'  ... {i + 1}/{len(SAMPLE_PRODUCTS)} products created')
         db.session.commit()
-        # create cart
-        try:
-            c = Cart(user_id=u.id)
-            db.session.add(c)
+        print(f'Products creation complete. Total: {Product.query.count()}')
+
+        # create an admin user
+        admin_email = 'admin@example.com'
+        if not User.query.filter_by(email=admin_email).first():
+            u = User(name='Admin', email=admin_email, role='admin')
+            u.set_password('admin123')
+            db.session.add(u)
             db.session.commit()
-        except Exception:
-            db.session.rollback()
+            # create cart
+            try:
+                c = Cart(user_id=u.id)
+                db.session.add(c)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
 
-    # create a sample customer
-    cust_email = 'user@example.com'
-    if not User.query.filter_by(email=cust_email).first():
-        u = User(name='Sample User', email=cust_email, role='customer')
-        u.set_password('password')
-        db.session.add(u)
-        db.session.commit()
-        try:
-            c = Cart(user_id=u.id)
-            db.session.add(c)
+        # create a sample customer
+        cust_email = 'user@example.com'
+        if not User.query.filter_by(email=cust_email).first():
+            u = User(name='Sample User', email=cust_email, role='customer')
+            u.set_password('password')
+            db.session.add(u)
             db.session.commit()
-        except Exception:
-            db.session.rollback()
+            try:
+                c = Cart(user_id=u.id)
+                db.session.add(c)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+        print('✅ Seeding complete!')
+        print(f'📊 Database Stats:')
+        print(f'   - Categories: {Category.query.count()}')
+        print(f'   - Products: {Product.query.count()}')
+        print(f'   - Users: {User.query.count()}')
+        print(f'\n🔐 Admin credentials:')
+        print(f'   Email: {admin_email}')
+        print(f'   Password: admin123')
+        print(f'\n👤 Sample user credentials:')
+        print(f'   Email: {cust_email}')
+        print(f'   Password: password')
+
 
-    print('✅ Seeding complete!')
-    print(f'📊 Database Stats:')
-    print(f'   - Categories: {Category.query.count()}')
-    print(f'   - Products: {Product.query.count()}')
-    print(f'   - Users: {User.query.count()}')
-    print(f'\n🔐 Admin credentials:')
-    print(f'   Email: {admin_email}')
-    print(f'   Password: admin123')
-    print(f'\n👤 Sample user credentials:')
-    print(f'   Email: {cust_email}')
-    print(f'   Password: password')
+def seed_synthetic_catalog(app, args):
+    import seed_synthetic
+    with app.app_context():
+        db.create_all()
+        print(f'Seeding {args.synthetic} synthetic products (seed={args.seed})...')
+        seed_synthetic.seed(db.engine, args.synthetic, seed=args.seed, n_users=args.users, n_orders=args.orders,
+                            batch=args.batch)
+    print(f'Users log in with password {seed_synthetic.DEFAULT_PASSWORD!r} (admin: admin@example.com)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed the database.')
+    parser.add_argument('--synthetic', type=int, default=0, help='Generate N synthetic products plus users and orders')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for --synthetic')
+    parser.add_argument('--users', type=int, default=None, help='Synthetic users (default N/100)')
+    parser.add_argument('--orders', type=int, default=None, help='Synthetic orders, 1-9 lines each (default N)')
+    parser.add_argument('--batch', type=int, default=50000, help='Rows per executemany')
+    args = parser.parse_args()
+    app = create_db_app()
+    if args.synthetic < 0:
+        parser.error('--synthetic must not be negative')
+    if args.synthetic:
+        try:
+            seed_synthetic_catalog(app, args)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        seed_sample(app)
@@ -0,0 +1,279 @@
+"""Deterministic synthetic catalog for load testing.
+
+`seed(engine, n_products, seed)` generates categories, products, users with
+carts, and historical orders with their lines and payments. The same seed
+against the same starting database always produces the same rows. Rows go
+straight to the DB-API connection with executemany in large transactions.
+Names and emails are deduplicated in memory (loaded once) instead of one
+query per row. The lookup indexes in LOAD_INDEXES are dropped before the
+load and built afterwards, so the inserts do not pay for index maintenance.
+They are built even when the load fails, so an interrupted run does not
+leave the database without them.
+At the defaults, 1M products is about 5M order lines.
+
+Usage (see seed_db.py):
+  python seed_db.py --synthetic 1000000 --seed 42
+"""
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+CATEGORIES = ['Electronics', 'Fashion', 'Home & Kitchen', 'Mobile Phones', 'Accessories',
+              'Sports & Outdoors', 'Books', 'Beauty', 'Toys & Games', 'Grocery']
+NOUNS = {
+    'Electronics': ['Headphones', 'USB-C Cable', 'Portable SSD', 'Desk Lamp', 'Wireless Mouse', 'USB Hub',
+                    'Mechanical Keyboard', 'Webcam', 'Monitor', 'Power Bank'],
+    'Fashion': ['T-Shirt', 'Denim Jeans', 'Running Shoes', 'Winter Jacket', 'Casual Shirt', 'Sports Shorts',
+                'Socks Pack', 'Leather Belt', 'Wool Sweater', 'Sneakers'],
+    'Home & Kitchen': ['Frying Pan', 'Knife Set', 'Mixer Blender', 'Dinner Plate Set', 'Tea Kettle',
+                       'Cutting Board', 'Storage Jars', 'Dish Rack', 'Table Runner', 'Bed Sheet Set'],
+    'Mobile Phones': ['Smartphone', 'Phone Case', 'Screen Guard', 'Fast Charger', 'Bluetooth Speaker',
+                      'Car Phone Mount', 'Cooling Fan', 'USB-C Hub', 'Lens Protector', 'Phone Stand'],
+    'Accessories': ['Sunglasses', 'Analog Watch', 'Leather Wallet', 'Baseball Cap', 'Backpack', 'Scarf',
+                    'Gloves', 'Umbrella', 'Key Chain', 'Hair Clip Set'],
+    'Sports & Outdoors': ['Cricket Bat', 'Football', 'Yoga Mat', 'Dumbbells', 'Mountain Bike', 'Skateboard',
+                          'Swimming Goggles', 'Jump Rope', 'Sleeping Bag', 'Camping Tent'],
+    'Books': ['Python Programming', 'Data Science Guide', 'Web Development', 'Business Strategy',
+              'Self Help', 'Fiction Novel', 'History', 'Recipe Book', 'Travel Guide', 'Art Book'],
+    'Beauty': ['Face Wash', 'Shampoo', 'Moisturizer', 'Matte Lipstick', 'Sheet Masks', 'Sunscreen',
+               'Eye Serum', 'Nail Polish Set', 'Perfume', 'Hair Oil'],
+    'Toys & Games': ['Building Blocks', 'Jigsaw Puzzle', 'Board Game', 'Action Figure', 'RC Car', 'Drone',
+                     'Chess Set', 'Card Game', 'Fashion Doll', 'Kite Set'],
+    'Grocery': ['Basmati Rice', 'Olive Oil', 'Sugar', 'Tea Bags', 'Coffee Powder', 'Honey', 'Nuts Mix',
+                'Flour', 'Spice Mix', 'Biscuits'],
+}
+PREFIXES = ['Premium', 'Deluxe', 'Professional', 'Standard', 'Ultra', 'Compact', 'Portable', 'Heavy-Duty',
+            'Lightweight', 'Smart']
+VARIANTS = ['Black', 'White', 'Blue', 'Red', 'Green', 'Silver', 'Gold', 'Grey', 'Pink', 'Purple',
+            'Small', 'Medium', 'Large', 'XL', '32GB', '64GB', '128GB', '256GB', '2L', '5L']
+PAYMENT_METHODS = ['card', 'upi', 'netbanking', 'cod']
+DEFAULT_PASSWORD = 'password'
+IMAGE_URL = 'o2_featured_v2.avif'
+HISTORY_START = datetime(2024, 1, 1)
+HISTORY_DAYS = 730
+
+# (name, table, column): built after the load, dropped first if they already exist
+LOAD_INDEXES = [
+    ('ix_products_category_id', 'products', 'category_id'),
+    ('ix_orders_user_id', 'orders', 'user_id'),
+    ('ix_order_items_order_id', 'order_items', 'order_id'),
+    ('ix_order_items_product_id', 'order_items', 'product_id'),
+    ('ix_payments_order_id', 'payments', 'order_id'),
+]
+
+PRODUCT_COLUMNS = ('id', 'name', 'description', 'price', 'discount_price', 'stock', 'image_url', 'rating', 'asin',
+                   'category_id')
+ORDER_COLUMNS = ('id', 'user_id', 'order_date', 'invoice_number', 'total_amount', 'gst_amount', 'status')
+ITEM_COLUMNS = ('id', 'order_id', 'product_id', 'quantity', 'price')
+PAYMENT_COLUMNS = ('id', 'order_id', 'payment_method', 'payment_status', 'amount', 'created_at')
+
+
+def _check(n_products, n_users, n_orders, lines_per_order, batch):
+    """ValueError for arguments the generator cannot satisfy."""
+    if n_products < 0 or n_users < 0 or n_orders < 0:
+        raise ValueError('product, user and order counts must not be negative')
+    lo, hi = lines_per_order
+    if not 1 <= lo <= hi:
+        raise ValueError(f'lines_per_order must be (lo, hi) with 1 <= lo <= hi, not {lines_per_order!r}')
+    if batch < 1:
+        raise ValueError('batch must be at least 1')
+    if n_orders and not (n_products and n_users):
+        raise ValueError('orders need at least one product and one user')
+
+
+def _ts(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class _Loader:
+    """executemany in fixed-size batches on a raw DB-API connection, committing once per insert()."""
+
+    def __init__(self, engine, batch, log):
+        self.dialect = engine.dialect.name
+        self.conn = engine.raw_connection()
+        self.cur = self.conn.cursor()
+        self.mark = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+        self.batch = batch
+        self.log = log
+        if self.dialect == 'sqlite':
+            self.cur.execute('PRAGMA synchronous=OFF')
+            self.cur.execute('PRAGMA cache_size=-200000')  # ~200 MB page cache
+
+    def scalar(self, sql):
+        self.cur.execute(sql)
+        return self.cur.fetchone()[0]
+
+    def insert(self, table, columns, rows, report=True):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([self.mark] * len(columns))})"
+        start = time.perf_counter()
+        n = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.batch:
+                self.cur.executemany(sql, chunk)
+                n += len(chunk)
+                chunk = []
+        if chunk:
+            self.cur.executemany(sql, chunk)
+            n += len(chunk)
+        self.conn.commit()
+        if report:
+            self.report(table, n, time.perf_counter() - start)
+        return n
+
+    def report(self, what, n, elapsed):
+        self.log(f'  {what}: {n} rows in {elapsed:.1f}s ({n / max(elapsed, 1e-6):,.0f} rows/s)')
+
+    def close(self):
+        self.cur.close()
+        self.conn.close()
+
+
+def _names(rng, category, used, existing):
+    """Unique product names for `category`: repeats of a base name get a " Mk<n>" suffix.
+    `used` counts base names across categories; `existing` holds the names already in the database.
+    """
+    nouns = NOUNS[category]
+    while True:
+        base = f'{rng.choice(PREFIXES)} {rng.choice(nouns)} - {rng.choice(VARIANTS)}'
+        n = used.get(base, 0)
+        name = base if n == 0 else f'{base} Mk{n + 1}'
+        while name in existing:
+            n += 1
+            name = f'{base} Mk{n + 1}'
+        used[base] = n + 1
+        yield name
+
+
+def seed(engine, n_products, seed=42, n_users=None, n_orders=None, lines_per_order=(1, 9),
+         batch=50000, log=print):
+    """Append a synthetic catalog to the database behind `engine` (tables must exist).
+    Defaults scale with n_products: n_products // 100 users (at least 20) and
+    n_products orders of 1-9 lines each. Returns the number of rows per table.
+    Raises ValueError for counts it cannot generate (e.g. orders without products).
+    """
+    from sqlalchemy import inspect, text
+
+    rng = random.Random(seed)
+    n_users = n_users if n_users is not None else max(20, n_products // 100)
+    n_orders = n_orders if n_orders is not None else n_products
+    _check(n_products, n_users, n_orders, lines_per_order, batch)
+    started = time.perf_counter()
+    counts = {}
+
+    try:
+        present = {ix['name'] for _, table, _ in LOAD_INDEXES for ix in inspect(engine).get_indexes(table)}
+        with engine.begin() as conn:
+            for name, table, _ in LOAD_INDEXES:
+                if name in present:
+                    conn.execute(text(f'DROP INDEX {name} ON {table}' if engine.dialect.name == 'mysql'
+                                      else f'DROP INDEX {name}'))
+        _load(engine, n_products, n_users, n_orders, lines_per_order, batch, rng, counts, log)
+    finally:
+        start = time.perf_counter()
+        present = {ix['name'] for _, table, _ in LOAD_INDEXES for ix in inspect(engine).get_indexes(table)}
+        with engine.begin() as conn:
+            for name, table, column in LOAD_INDEXES:
+                if name not in present:
+                    conn.execute(text(f'CREATE INDEX {name} ON {table} ({column})'))
+            if engine.dialect.name == 'sqlite':
+                conn.execute(text('ANALYZE'))
+        log(f'  indexes built in {time.perf_counter() - start:.1f}s')
+    log(f'seeded {counts} in {time.perf_counter() - started:.1f}s')
+    return counts
+
+
+def _load(engine, n_products, n_users, n_orders, lines_per_order, batch, rng, counts, log):
+    """Insert the rows, adding their number per table to `counts`."""
+    load = _Loader(engine, batch, log)
+    try:
+        # categories: reuse existing ones by name
+        load.cur.execute('SELECT id, name FROM categories')
+        cat_ids = {name: cid for cid, name in load.cur.fetchall()}
+        missing = [c for c in CATEGORIES if c not in cat_ids]
+        next_id = (load.scalar('SELECT MAX(id) FROM categories') or 0) + 1
+        counts['categories'] = load.insert('categories', ('id', 'name'),
+                                           [(next_id + i, name) for i, name in enumerate(missing)])
+        cat_ids.update({name: next_id + i for i, name in enumerate(missing)})
+
+        # products: names deduplicated against what is already there, prices kept for the order lines
+        load.cur.execute('SELECT name FROM products')
+        existing = {name for (name,) in load.cur.fetchall()}
+        used = {}
+        first_product = (load.scalar('SELECT MAX(id) FROM products') or 0) + 1
+        prices = array('d')
+        names = {c: _names(rng, c, used, existing) for c in CATEGORIES}
+
+        def products():
+            for pid in range(first_product, first_product + n_products):
+                category = CATEGORIES[int(rng.random() * len(CATEGORIES))]
+                price = round(99 + rng.random() * 19901, 2)
+                prices.append(price)
+                yield (pid, next(names[category]), f'Synthetic {category.lower()} product', price,
+                       round(price * (0.7 + rng.random() * 0.25), 2), int(rng.random() * 501), IMAGE_URL,
+                       round(3.0 + rng.random() * 2.0, 1),
+                       f'B{int(10000000 + rng.random() * 89999999)}' if rng.random() > 0.4 else None,
+                       cat_ids[category])
+        counts['products'] = load.insert('products', PRODUCT_COLUMNS, products())
+
+        # users (+ one cart each); the admin account is created if the database has none
+        load.cur.execute('SELECT email FROM users')
+        emails = {e for (e,) in load.cur.fetchall()}
+        first_user = (load.scalar('SELECT MAX(id) FROM users') or 0) + 1
+        password_hash = generate_password_hash(DEFAULT_PASSWORD)
+        users = []
+        if 'admin@example.com' not in emails:
+            users.append((first_user, 'Admin', 'admin@example.com', password_hash, 'admin'))
+        uid = first_user + len(users)
+        i = 1
+        while len(users) < n_users:
+            email = f'user{i}@example.com'
+            i += 1
+            if email not in emails:
+                users.append((uid, f'User {i - 1}', email, password_hash, 'customer'))
+                uid += 1
+        counts['users'] = load.insert('users', ('id', 'name', 'email', 'password_hash', 'role'), users)
+        first_cart = (load.scalar('SELECT MAX(id) FROM carts') or 0) + 1
+        counts['carts'] = load.insert('carts', ('id', 'user_id'),
+                                      [(first_cart + k, u[0]) for k, u in enumerate(users)])
+        user_ids = [u[0] for u in users]
+
+        # orders with their lines and payments, generated together so totals match the lines
+        first_order = (load.scalar('SELECT MAX(id) FROM orders') or 0) + 1
+        first_item = (load.scalar('SELECT MAX(id) FROM order_items') or 0) + 1
+        first_payment = (load.scalar('SELECT MAX(id) FROM payments') or 0) + 1
+        lo, hi = lines_per_order
+        orders, items, payments = [], [], []
+        item_id = first_item
+        counts.update(orders=0, order_items=0, payments=0)
+        start = time.perf_counter()
+        for k in range(n_orders):
+            oid = first_order + k
+            when = HISTORY_START + timedelta(seconds=int(rng.random() * HISTORY_DAYS * 86400))
+            subtotal = 0.0
+            for _ in range(lo + int(rng.random() * (hi - lo + 1))):
+                j = int(rng.random() * n_products)
+                qty = 1 + int(rng.random() * 3)
+                items.append((item_id, oid, first_product + j, qty, prices[j]))
+                item_id += 1
+                subtotal += qty * prices[j]
+            gst = round(subtotal * 0.05, 2)
+            total = round(subtotal + gst, 2)
+            ts = _ts(when)
+            orders.append((oid, user_ids[int(rng.random() * len(user_ids))], ts,
+                           f'INV{when:%Y%m%d%H%M%S}{oid:04d}', total, gst, 'placed'))
+            payments.append((first_payment + k, oid, PAYMENT_METHODS[int(rng.random() * len(PAYMENT_METHODS))],
+                             'paid', total, ts))
+            if len(items) >= batch * 4 or k == n_orders - 1:
+                counts['orders'] += load.insert('orders', ORDER_COLUMNS, orders, report=False)
+                counts['order_items'] += load.insert('order_items', ITEM_COLUMNS, items, report=False)
+                counts['payments'] += load.insert('payments', PAYMENT_COLUMNS, payments, report=False)
+                orders, items, payments = [], [], []
+        load.report('orders + order_items + payments',
+                    counts['orders'] + counts['order_items'] + counts['payments'], time.perf_counter() - start)
+    finally:
+        load.close()
@@ -1,10 +1,12 @@
-from app import create_app
+from database_models import create_db_app
 from database_models import Product
+import maintenance
 
-app = create_app()
+app = create_db_app()
 with app.app_context():
     total = Product.query.count()
     print(f'Total products: {total}')
     print('\nSample products (first 5):')
-    for p in Product.query.order_by(Product.id).limit(5).all():
-        print(f'{p.id} | {p.name} | {p.image_url}')
+    for rows in maintenance.iter_products(('name', 'image_url'), chunk=5, limit=5):
+        for p in rows:
+            print(f'{p.id} | {p.name} | {p.image_url}')
@@ -0,0 +1,174 @@
+"""In-memory static assets with precompressed variants and fingerprinted URLs.
+
+Files in the project root are read once and kept in memory along with their
+gzip (and brotli, if the `brotli` package is installed) encodings. Each
+request picks the best encoding the client accepts and answers 304 when
+If-None-Match matches. HTML pages are rewritten so local script, stylesheet
+and image references point at fingerprinted names (scripts.<hash>.js). Those
+names change whenever the content does, so they are served with a one-year
+immutable Cache-Control. Pages are served with no-cache so a deploy takes
+effect on the next load. Every request stats the file, and an entry is rebuilt
+only when the file's mtime or size changes.
+
+Only the site's own top-level files (what preload() walks) are kept, keyed
+by their normalized name, so the store cannot grow past the project root's
+file list. Anything in a subdirectory is not cached here: the caller
+streams it from disk.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ALLOWED_EXT = ('.html', '.js', '.css', '.png', '.jpg', '.jpeg', '.avif', '.gif', '.webp', '.mp3', '.wav', '.ogg')
+# images and audio are already compressed
+COMPRESS_EXT = ('.html', '.js', '.css', '.svg', '.json', '.txt')
+MIN_COMPRESS = 256  # bytes
+MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))  # plain (non-fingerprinted) URLs
+IMMUTABLE_MAX_AGE = 31536000
+FINGERPRINT_RE = re.compile(r'^(.+)\.([0-9a-f]{10})(\.[A-Za-z0-9]+)$')
+REF_RE = re.compile(r'''(\b(?:src|href)=["'])([^"'#?:]+)(["'])''')
+
+
+class Asset:
+    def __init__(self, path, name, stat):
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.name = name
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.mimetype.startswith('text/') or self.mimetype == 'application/javascript':
+            self.mimetype += '; charset=utf-8'
+        self.set_body(body)
+
+    def set_body(self, body):
+        self.hash = hashlib.sha256(body).hexdigest()[:10]
+        self.bodies = {'identity': body}
+        if self.name.lower().endswith(COMPRESS_EXT) and len(body) >= MIN_COMPRESS:
+            self.bodies['gzip'] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(body, quality=11)
+
+    @property
+    def fingerprinted_name(self):
+        stem, ext = os.path.splitext(self.name)
+        return f'{stem}.{self.hash}{ext}'
+
+
+class AssetStore:
+    def __init__(self, root=ROOT):
+        self.root = root
+        self.assets = {}
+        self.pages = {}  # html name -> (asset key, versions of referenced assets, rewritten Asset)
+        self.lock = threading.Lock()
+
+    def preload(self):
+        for name in sorted(os.listdir(self.root)):
+            if name.lower().endswith(ALLOWED_EXT):
+                self.get(name)
+
+    def get(self, name):
+        """Current Asset for top-level file `name`, or None (also for anything in a subdirectory).
+        Rebuilt when the file changes.
+        """
+        name = top_level(name)
+        if name is None:
+            return None
+        path = os.path.join(self.root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.assets.pop(name, None)
+            return None
+        asset = self.assets.get(name)
+        if asset is None or asset.key != (st.st_mtime_ns, st.st_size):
+            with self.lock:
+                asset = self.assets.get(name)
+                if asset is None or asset.key != (st.st_mtime_ns, st.st_size):
+                    asset = self.assets[name] = Asset(path, name, st)
+        if name.lower().endswith('.html'):
+            return self._page(asset)
+        return asset
+
+    def resolve(self, name):
+        """(Asset, immutable) for a plain or fingerprinted name."""
+        asset = self.get(name)
+        if asset is not None:
+            return asset, False
+        m = FINGERPRINT_RE.match(name)
+        if m:
+            asset = self.get(m.group(1) + m.group(3))
+            if asset is not None:
+                # an outdated fingerprint gets the current content, but without the long cache
+                return asset, asset.hash == m.group(2)
+        return None, False
+
+    def _page(self, asset):
+        # html with local references rewritten to fingerprinted names
+        refs = sorted(set(m.group(2) for m in REF_RE.finditer(asset.bodies['identity'].decode('utf-8'))))
+        deps = {ref: self.get(ref) for ref in refs if not ref.lower().endswith('.html')}
+        versions = tuple((ref, a.hash) for ref, a in deps.items() if a is not None)
+        cached = self.pages.get(asset.name)
+        if cached and cached[0] == asset.key and cached[1] == versions:
+            return cached[2]
+
+        def sub(m):
+            dep = deps.get(m.group(2))
+            return m.group(1) + (dep.fingerprinted_name if dep else m.group(2)) + m.group(3)
+        page = Asset.__new__(Asset)
+        page.name, page.key, page.mimetype = asset.name, asset.key, asset.mimetype
+        page.set_body(REF_RE.sub(sub, asset.bodies['identity'].decode('utf-8')).encode('utf-8'))
+        self.pages[asset.name] = (asset.key, versions, page)
+        return page
+
+
+def top_level(name):
+    """Normalized `name` if it is an allowed file directly in the root (`./app.js` -> `app.js`), else None."""
+    name = posixpath.normpath(name.replace('\\', '/'))
+    if '/' in name or name.startswith('.') or not name.lower().endswith(ALLOWED_EXT):
+        return None
+    return name
+
+
+def negotiate(asset):
+    """Best encoding of `asset` the client accepts."""
+    accept = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in asset.bodies and accept[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+def respond(asset, immutable=False, page=False):
+    encoding = negotiate(asset)
+    resp = Response(asset.bodies[encoding], content_type=asset.mimetype)
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    if len(asset.bodies) > 1:
+        resp.vary.add('Accept-Encoding')
+    # each encoding is a different representation, so it gets its own strong ETag
+    resp.set_etag(asset.hash if encoding == 'identity' else f'{asset.hash}-{encoding}')
+    if page:
+        resp.cache_control.no_cache = True
+    elif immutable:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = IMMUTABLE_MAX_AGE
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = MAX_AGE
+    return resp.make_conditional(request)
+
+
+store = AssetStore()
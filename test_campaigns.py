@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Set-based repricing (campaigns.py) against a throwaway sqlite database.
+
+  python -m pytest -q test_campaigns.py
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import campaigns
+from database_models import create_db_app, db, Product, PriceCampaign
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "campaigns.db"}'})
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def add(price, discount_price=None):
+    p = Product(name=f'p{price}', price=price, discount_price=discount_price, stock=1)
+    db.session.add(p)
+    db.session.commit()
+    return p.id
+
+
+def prices(*ids):
+    db.session.expire_all()
+    return [(p.price, p.discount_price) for p in (db.session.get(Product, i) for i in ids)]
+
+
+def reprice(target, change, **extra):
+    return campaigns.create(dict({'target': target, 'change': change}, **extra))
+
+
+def test_percent_rounds_to_cents(app):
+    a, b = add(9.99), add(19.95)
+    reprice({'ids': [a, b]}, {'percent': -15})
+    assert prices(a, b) == [(8.49, None), (16.96, None)]
+
+
+def test_price_never_drops_below_floor(app):
+    a = add(5.0)
+    reprice({'ids': [a]}, {'amount': -100})
+    assert prices(a) == [(0.01, None)]
+
+
+def test_price_cut_drops_discount_no_longer_below_price(app):
+    kept, dropped = add(100.0, 50.0), add(100.0, 95.0)
+    reprice({'ids': [kept, dropped]}, {'percent': -10})
+    assert prices(kept, dropped) == [(90.0, 50.0), (90.0, None)]
+
+
+def test_discount_campaign_skips_manual_discounts(app):
+    manual, plain = add(100.0, 70.0), add(100.0)
+    campaign = reprice({'ids': [manual, plain]}, {'discount_percent': 20})
+    assert campaign.affected == 1
+    assert prices(manual, plain) == [(100.0, 70.0), (100.0, 80.0)]
+
+
+def test_end_restores_only_campaign_discounts(app):
+    manual, plain = add(100.0, 70.0), add(50.0)
+    campaign = reprice({'all': True}, {'discount_amount': 10},
+                       ends_at=(datetime.utcnow() + timedelta(hours=1)).isoformat())
+    assert campaign.status == 'active'
+    assert prices(manual, plain) == [(100.0, 70.0), (50.0, 40.0)]
+    assert campaigns.end(campaign.id) == 1
+    assert prices(manual, plain) == [(100.0, 70.0), (50.0, None)]
+    assert campaigns.end(campaign.id) is None  # already ended
+
+
+def test_run_due_claims_each_transition_once(app):
+    a = add(100.0)
+    now = datetime.utcnow()
+    campaign = reprice({'ids': [a]}, {'discount_percent': 10}, starts_at=(now + timedelta(minutes=1)).isoformat(),
+                       ends_at=(now + timedelta(minutes=2)).isoformat())
+    assert campaign.status == 'scheduled'
+    assert campaigns.run_due(now) == []
+    later = now + timedelta(minutes=1, seconds=30)
+    assert campaigns.run_due(later) == [(campaign.id, 'applied', 1)]
+    assert campaigns.run_due(later) == []
+    assert campaigns.apply(campaign.id) is None  # a second worker loses the claim
+    assert prices(a) == [(100.0, 90.0)]
+    assert campaigns.run_due(now + timedelta(minutes=3)) == [(campaign.id, 'ended', 1)]
+    assert campaigns.run_due(now + timedelta(minutes=3)) == []
+    assert db.session.get(PriceCampaign, campaign.id).status == 'ended'
+    assert prices(a) == [(100.0, None)]
+
+
+def test_values_rejects_bad_changes(app):
+    for change in ({}, {'percent': -10, 'amount': 1}, {'percent': -100}, {'discount_percent': 0},
+                   {'discount_amount': -5}):
+        with pytest.raises(ValueError):
+            campaigns.values(change)
+    with pytest.raises(ValueError):
+        campaigns.conditions({})
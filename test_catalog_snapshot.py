@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Columnar catalog snapshot (catalog_snapshot.py) against a throwaway sqlite database.
+
+Covers filtering, sorting and paging, the stock overlay that saves a
+rebuild, and rebuilding into a new generation when a listed field changes.
+
+  python -m pytest -q test_catalog_snapshot.py
+"""
+import os
+
+import pytest
+
+import catalog
+import catalog_snapshot
+from database_models import create_db_app, db, Product, Category
+
+# name, price, discount_price, rating, stock, category
+PRODUCTS = [
+    ('Bluetooth Speaker', 50.0, None, 4.5, 3, 1),
+    ('Wireless Mouse', 20.0, 15.0, 4.0, 0, 1),
+    ('Desk Lamp', 35.0, None, 3.0, 7, 2),
+    ('Bluetooth Headphones', 80.0, 45.0, 4.8, 2, 1),
+    ('Notebook', 5.0, None, 0.0, 50, None),
+]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, 'SNAPSHOT_DIR', str(tmp_path / 'snapshot'))
+    monkeypatch.setattr(catalog_snapshot, 'RELOAD_INTERVAL', 0)
+    monkeypatch.setattr(catalog, '_default', {'hooks': [], 'version': None, 'checked_at': 0.0})  # per database
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "snapshot.db"}'})
+    with app.app_context():
+        db.session.add_all([Category(id=1, name='Electronics'), Category(id=2, name='Home')])
+        db.session.add_all(Product(name=n, price=p, discount_price=d, rating=r, stock=s, category_id=c)
+                           for n, p, d, r, s, c in PRODUCTS)
+        db.session.commit()
+        catalog.bump()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def reader(app):
+    assert catalog_snapshot.build(log=lambda msg: None) is not None
+    return catalog_snapshot.Reader(*catalog_snapshot.location())
+
+
+def names(ids):
+    return [db.session.get(Product, i).name for i in ids]
+
+
+def listing(reader, **filters):
+    total, ids, _ = reader.query(**filters)
+    return total, names(ids)
+
+
+def test_filters_sorts_and_pages(reader):
+    assert listing(reader, category_ids=[1], sort='price') == (
+        3, ['Wireless Mouse', 'Bluetooth Headphones', 'Bluetooth Speaker'])  # by effective price: 15, 45, 50
+    assert listing(reader, min_price=10, max_price=40, sort='-price') == (2, ['Desk Lamp', 'Wireless Mouse'])
+    assert listing(reader, q='BLUETOOTH', sort='name') == (2, ['Bluetooth Headphones', 'Bluetooth Speaker'])
+    assert listing(reader, on_sale=True, min_rating=4.5) == (1, ['Bluetooth Headphones'])
+    assert listing(reader, sort='-rating', offset=1, limit=2) == (5, ['Bluetooth Speaker', 'Wireless Mouse'])
+    assert listing(reader, sort='newest', limit=1) == (5, ['Notebook'])
+
+
+def test_stock_changes_use_the_overlay_not_a_rebuild(app, reader):
+    generation = reader.get().generation
+    mouse = Product.query.filter_by(name='Wireless Mouse').one()
+    speaker = Product.query.filter_by(name='Bluetooth Speaker').one()
+    mouse.stock, speaker.stock = 4, 0
+    catalog.bump(['stock'], [mouse.id, speaker.id])
+    assert listing(reader, in_stock=True, category_ids=[1]) == (2, ['Wireless Mouse', 'Bluetooth Headphones'])
+
+    assert catalog_snapshot.build(log=lambda msg: None) is None  # relabelled, not rebuilt
+    snap = reader.get()
+    assert snap.generation == generation and snap.version == catalog.version()
+    assert listing(reader, in_stock=True, category_ids=[1]) == (2, ['Wireless Mouse', 'Bluetooth Headphones'])
+
+
+def test_unknown_stock_changes_are_not_answered_from_the_snapshot(app, reader):
+    Product.query.update({'stock': 1})
+    catalog.bump(['stock'])  # no product ids: the overlay cannot be patched
+    assert reader.query(in_stock=True) is None
+    assert reader.query(sort='price')[0] == 5  # listings that do not filter on stock still work
+
+
+def test_price_change_builds_a_new_generation(app, reader):
+    first = reader.get()
+    lamp = Product.query.filter_by(name='Desk Lamp').one()
+    lamp.price = 1.0
+    catalog.bump(['price'], [lamp.id])
+    assert catalog_snapshot.build(log=lambda msg: None) == catalog.version()
+    second = reader.get()
+    assert second.generation != first.generation
+    assert listing(reader, sort='price', limit=1) == (5, ['Desk Lamp'])
+
+    directory, _ = catalog_snapshot.location()
+    generations = {name.split('.')[0] for name in os.listdir(directory) if name.endswith('.npy')}
+    assert generations == {first.generation, second.generation}  # the previous one stays for readers mid-switch
+    notebook = Product.query.filter_by(name='Notebook').one()
+    notebook.name = 'Spiral Notebook'
+    catalog.bump(['name'], [notebook.id])
+    catalog_snapshot.build(log=lambda msg: None)
+    generations = {name.split('.')[0] for name in os.listdir(directory) if name.endswith('.npy')}
+    assert first.generation not in generations and len(generations) == 2
+
+
+def test_other_database_does_not_see_this_snapshot(reader, tmp_path):
+    other = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "other.db"}'})
+    with other.app_context():
+        directory, database = catalog_snapshot.location()
+        assert catalog_snapshot.Reader(directory, database).query() is None
+        db.session.remove()
@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 from database_models import db, Product, Category
-from app import create_app
+from database_models import create_db_app
+import maintenance
 
-app = create_app()
-with app.app_context():
-    count = Product.query.count()
-    print(f'Total products: {count}')
-    
-    cat_count = Category.query.count()
-    print(f'Total categories: {cat_count}')
-    
-    products = Product.query.limit(3).all()
-    print('\nSample products:')
-    for p in products:
-        print(f"  - {p.name} (${p.price}, discount: ${p.discount_price})")
+if __name__ == '__main__':
+    app = create_db_app()
+    with app.app_context():
+        count = Product.query.count()
+        print(f'Total products: {count}')
+
+        cat_count = Category.query.count()
+        print(f'Total categories: {cat_count}')
+
+        categories = maintenance.category_names()
+        print('\nSample products:')
+        for rows in maintenance.iter_products(('name', 'price', 'discount_price', 'category_id'), chunk=3, limit=3):
+            for p in rows:
+                print(f"  - {p.name} (${p.price}, discount: ${p.discount_price}) [{categories.get(p.category_id)}]")
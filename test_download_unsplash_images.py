@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Image downloader (download_unsplash_images.py) against a local stand-in for the Unsplash API and CDN.
+
+Covers the search rate limit, one bulk update and checkpoint per batch, and
+resuming from the checkpoint: a product whose search failed is retried first
+on the next run, and finished products are not searched again.
+
+  python -m pytest -q test_download_unsplash_images.py
+"""
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from PIL import Image
+
+import download_unsplash_images as dl
+from database_models import create_db_app, db, Product, Category
+
+
+class StandIn(ThreadingHTTPServer):
+    """/search/photos answers one hit, a JPEG under /photos/ (500 for queries containing a word in `failing`)."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        out = io.BytesIO()
+        Image.new('RGB', (400, 300), (30, 120, 200)).save(out, 'JPEG')
+        self.jpeg = out.getvalue()
+        self.searches = []  # (monotonic time, query)
+        self.failing = set()
+        self.lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/search/photos':
+            query = parse_qs(parts.query)['query'][0]
+            with self.server.lock:
+                self.server.searches.append((time.monotonic(), query))
+            if any(word in query for word in self.server.failing):
+                return self._send(500, b'{}', 'application/json')
+            hit = {'urls': {'regular': f'http://127.0.0.1:{self.server.server_port}/photos/{len(query)}.jpg'}}
+            return self._send(200, json.dumps({'results': [hit]}).encode(), 'application/json')
+        self._send(200, self.server.jpeg, 'image/jpeg')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    server = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(dl, 'UNSPLASH_API_URL', f'http://127.0.0.1:{server.server_port}')
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "dl.db"}', 'UPLOAD_FOLDER': str(tmp_path / 'uploads')}
+    monkeypatch.setattr(dl, 'create_db_app', lambda: create_db_app(config))
+    app = create_db_app(config)
+    with app.app_context():
+        db.session.add(Category(id=1, name='Electronics'))
+        db.session.add_all(Product(id=i, name=f'Gadget{i}', price=1.0, stock=1, category_id=1) for i in range(1, 6))
+        db.session.commit()
+    yield server, app, str(tmp_path / 'checkpoint.json')
+    server.shutdown()
+    server.server_close()
+
+
+def image_urls(app):
+    with app.app_context():
+        return {p.id: p.image_url for p in Product.query.order_by(Product.id)}
+
+
+def test_batches_are_committed_with_a_checkpoint(env, capsys):
+    server, app, checkpoint = env
+    dl.main(['--limit', '0', '--batch', '2', '--rate', '360000', '--burst', '10', '--checkpoint', checkpoint])
+    out = capsys.readouterr().out
+    assert out.count('Committed after') == 3  # 2 + 2 + 1
+    assert all(url.startswith('/uploads/') for url in image_urls(app).values())
+    with open(checkpoint) as f:
+        assert json.load(f) == {'last_id': 5, 'failed': []}
+
+
+def test_searches_keep_to_the_rate(env):
+    server, app, checkpoint = env
+    dl.main(['--limit', '0', '--rate', '36000', '--burst', '1', '--workers', '4', '--checkpoint', checkpoint])
+    times = sorted(t for t, _ in server.searches)
+    assert len(times) == 5
+    assert times[-1] - times[0] >= 4 * 0.1 * 0.9  # 10 searches/s: four gaps of 0.1 s
+
+
+def test_failed_product_is_retried_first_on_the_next_run(env):
+    server, app, checkpoint = env
+    server.failing = {'Gadget3'}
+    dl.main(['--limit', '0', '--batch', '2', '--rate', '360000', '--burst', '10', '--checkpoint', checkpoint])
+    urls = image_urls(app)
+    assert not urls[3] and all(urls[i] for i in (1, 2, 4, 5))
+    with open(checkpoint) as f:
+        assert json.load(f) == {'last_id': 5, 'failed': [3]}
+
+    server.failing, server.searches = set(), []
+    dl.main(['--limit', '0', '--rate', '360000', '--burst', '10', '--checkpoint', checkpoint])
+    assert [q for _, q in server.searches] == ['Gadget3 Electronics']  # nothing else is searched again
+    assert image_urls(app)[3].startswith('/uploads/3-Gadget3')
+    with open(checkpoint) as f:
+        assert json.load(f) == {'last_id': 5, 'failed': []}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Storefront events (events.py) on a throwaway events database.
+
+Covers batch validation, the ring buffer and its writer thread, and
+compaction of old raw events into daily counts.
+
+  python -m pytest -q test_events.py
+"""
+import time
+
+import pytest
+
+import events
+
+NOW = 1_700_000_000.0
+
+
+def row(ts, kind='view', pid=1):
+    return (ts, kind, pid, None, 's', None)
+
+
+def fetch(path, sql):
+    conn = events.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'events.db')
+
+
+def test_parse_batch_keeps_valid_events_only():
+    data = {'session': 'x' * 100, 'sent': 10_000, 'events': [
+        {'type': 'view', 'product_id': 3, 't': 4_000, 'source': 'grid'},
+        {'type': 'click', 'product_id': '7', 't': 10_000},
+        {'type': 'purchase', 'product_id': 3},  # unknown kind
+        {'type': 'view', 'product_id': 0},
+        {'type': 'view', 'product_id': True},
+        {'type': 'view', 'product_id': 'abc'},
+        'not an event',
+    ]}
+    rows, rejected = events.parse_batch(data, user_id=5, now=NOW)
+    assert rejected == 5
+    assert rows == [(NOW - 6, 'view', 3, 5, 'x' * 64, 'grid'), (NOW, 'click', 7, 5, 'x' * 64, None)]
+
+
+def test_parse_batch_caps_the_client_delay():
+    rows, _ = events.parse_batch({'sent': 10 ** 10, 'events': [{'type': 'view', 'product_id': 1, 't': 0}]}, now=NOW)
+    assert rows[0][0] == NOW - events.MAX_AGE
+    rows, _ = events.parse_batch({'sent': 0, 'events': [{'type': 'view', 'product_id': 1, 't': 5000}]}, now=NOW)
+    assert rows[0][0] == NOW  # an event "from the future" is not moved forward
+
+
+def test_parse_batch_rejects_malformed_batches():
+    with pytest.raises(ValueError):
+        events.parse_batch({'events': 'view'})
+    with pytest.raises(ValueError):
+        events.parse_batch({'events': [{'type': 'view', 'product_id': 1}] * (events.MAX_BATCH + 1)})
+
+
+def test_writer_thread_flushes_the_buffer(path):
+    log = events.EventLog(path, capacity=100, flush_size=10, flush_interval=60, compact_interval=0)
+    log.add([row(NOW + i) for i in range(10)])  # a full flush's worth wakes the writer
+    deadline = time.time() + 5
+    while log.flushed < 10 and time.time() < deadline:
+        time.sleep(0.02)
+    assert log.flushed == 10 and log.pending() == 0
+    assert fetch(path, 'SELECT count(*) FROM events') == [(10,)]
+
+
+def test_ring_buffer_drops_the_oldest_when_full(path):
+    log = events.EventLog(path, capacity=8, flush_size=1000, flush_interval=60, compact_interval=0)
+    log.add([row(NOW + i) for i in range(5)])
+    log.add([row(NOW + i) for i in range(5, 12)])
+    assert log.stats()['dropped'] == 4 and log.pending() == 8
+    assert log.flush() == 8
+    assert fetch(path, 'SELECT min(ts), max(ts) FROM events') == [(NOW + 4, NOW + 11)]
+
+
+def test_compaction_folds_old_events_into_daily_counts(path, monkeypatch):
+    monkeypatch.setattr(events, 'COMPACT_BATCH', 3)  # several transactions, with equal timestamps at an edge
+    day = 86400
+    log = events.EventLog(path, flush_interval=60, compact_interval=0, raw_days=7)
+    old = [row(NOW - 10 * day, 'view', 1)] * 4 + [row(NOW - 10 * day + 60, 'click', 1),
+                                                  row(NOW - 9 * day, 'view', 2), row(NOW - 9 * day, 'view', 1)]
+    log.add(old + [row(NOW - day, 'view', 1)])
+    log.flush()
+    result = log.compact(now=NOW)
+    assert result['rows'] == 7 and result['counts'] == 4
+    assert fetch(path, 'SELECT count(*) FROM events') == [(1,)]
+    counts = {(d, pid, kind): n for d, pid, kind, n in fetch(path, 'SELECT * FROM event_counts')}
+    first = int((NOW - 10 * day) // day)
+    assert counts == {(first, 1, 'view'): 4, (first, 1, 'click'): 1, (first + 1, 2, 'view'): 1, (first + 1, 1, 'view'): 1}
+
+    log.add([row(NOW - 10 * day, 'view', 1)])  # a late arrival adds to the existing count
+    log.flush()
+    log.compact(now=NOW)
+    assert fetch(path, f"SELECT n FROM event_counts WHERE day = {first} AND kind = 'view'") == [(5,)]
+
+
+def test_compaction_skips_when_another_process_holds_the_lock(path):
+    log = events.EventLog(path, compact_interval=0)
+    with events.compaction_lock(path):
+        assert log.compact(now=NOW, wait=False) is None
+    assert log.compact(now=NOW, wait=False)['rows'] == 0
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Upload garbage collection (gc_uploads.py) on a scratch upload folder and sqlite database.
+
+Only old blobs that no product_images row or product image_url refers to
+are removed, with their variants; a dry run removes nothing.
+
+  python -m pytest -q test_gc_uploads.py
+"""
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import gc_uploads
+import upload_store
+from database_models import create_db_app, db, Product, UploadBlob, ProductImage, ImageVariant
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "gc.db"}', 'UPLOAD_FOLDER': str(tmp_path / 'uploads')}
+    monkeypatch.setattr(gc_uploads, 'create_db_app', lambda: create_db_app(config))
+    return create_db_app(config)
+
+
+def store(app, content, hours_old):
+    """Save an upload with one variant file, its blob row `hours_old` hours old. Returns its URL."""
+    folder = app.config['UPLOAD_FOLDER']
+    digest, ext, size, _ = upload_store.save(io.BytesIO(content), 'photo.jpg', folder)
+    variant = f'variants/{digest}-thumb.webp'
+    os.makedirs(os.path.join(folder, 'variants'), exist_ok=True)
+    with open(os.path.join(folder, variant), 'wb') as f:
+        f.write(b'webp')
+    url = upload_store.blob_url(digest, ext)
+    db.session.add(UploadBlob(hash=digest, ext=ext, size=size, created_at=datetime.utcnow() - timedelta(hours=hours_old)))
+    db.session.add(ImageVariant(source_url=url, preset='thumb', format='webp', width=160, height=120,
+                                url=f'/uploads/{variant}'))
+    db.session.commit()
+    return url
+
+
+def exists(app, url):
+    digest, ext = upload_store.parse_blob_url(url)
+    folder = app.config['UPLOAD_FOLDER']
+    files = [os.path.exists(os.path.join(folder, upload_store.blob_path(digest, ext))),
+             os.path.exists(os.path.join(folder, 'variants', f'{digest}-thumb.webp'))]
+    rows = [db.session.get(UploadBlob, digest) is not None, ImageVariant.query.filter_by(source_url=url).count() == 1]
+    assert len(set(files + rows)) == 1, (files, rows)  # a blob goes with its variants, files and rows together
+    return files[0]
+
+
+@pytest.fixture
+def blobs(app):
+    with app.app_context():
+        urls = {
+            'orphan': store(app, b'orphan', 48),
+            'young': store(app, b'young', 1),  # maybe for a product that is not saved yet
+            'linked': store(app, b'linked', 48),
+            'image_url': store(app, b'image_url', 48),
+        }
+        product = Product(name='Lamp', price=1.0, image_url=urls['image_url'])
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(ProductImage(product_id=product.id, blob_hash=upload_store.parse_blob_url(urls['linked'])[0]))
+        db.session.commit()
+        db.session.remove()
+    return urls
+
+
+def test_dry_run_deletes_nothing(app, blobs, capsys):
+    gc_uploads.main(min_age=24, dry_run=True)
+    out = capsys.readouterr().out
+    assert f'would delete {blobs["orphan"]}' in out and '1 orphaned blobs' in out
+    with app.app_context():
+        assert all(exists(app, url) for url in blobs.values())
+
+
+def test_apply_deletes_only_old_unreferenced_blobs(app, blobs):
+    gc_uploads.main(min_age=24, dry_run=False)
+    with app.app_context():
+        assert {name: exists(app, url) for name, url in blobs.items()} == {
+            'orphan': False, 'young': True, 'linked': True, 'image_url': True}
+
+
+def test_min_age_zero_still_keeps_referenced_blobs(app, blobs):
+    gc_uploads.main(min_age=0, dry_run=False)
+    with app.app_context():
+        assert {name: exists(app, url) for name, url in blobs.items()} == {
+            'orphan': False, 'young': False, 'linked': True, 'image_url': True}
+        gc_uploads.main(min_age=0, dry_run=False)  # nothing left to collect
+        assert UploadBlob.query.count() == 2
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Retries and the per-host circuit breaker (http_client.py) against a local stand-in server.
+
+  python -m pytest -q test_http_client.py
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+
+
+class StandIn(ThreadingHTTPServer):
+    """GET /ok answers the next status in `statuses` (200 once they run out); /loop redirects to itself."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.hits = 0
+        self.statuses = []
+        self.lock = threading.Lock()
+
+    def url(self, path='/ok'):
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _answer(self):
+        with self.server.lock:
+            self.server.hits += 1
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if self.path == '/loop':
+            status = 302
+        self.send_response(status)
+        if status == 302:
+            self.send_header('Location', '/loop')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    do_GET = do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(http_client, 'BACKOFF', 0.01)
+    monkeypatch.setattr(http_client, 'BREAKER_THRESHOLD', 3)
+    monkeypatch.setattr(http_client, 'BREAKER_COOLDOWN', 0.2)
+    s = StandIn()
+    threading.Thread(target=s.serve_forever, daemon=True).start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def host_stats(server):
+    return http_client.stats()[f'127.0.0.1:{server.server_port}']
+
+
+def test_get_retries_gateway_errors(server):
+    server.statuses = [503, 502]
+    resp = http_client.get(server.url(), timeout=5)
+    assert resp.status_code == 200 and server.hits == 3
+    assert host_stats(server)['retries'] == 2
+
+
+def test_post_is_sent_once_unless_asked(server):
+    server.statuses = [503, 503]
+    assert http_client.post(server.url(), timeout=5).status_code == 503
+    assert server.hits == 1
+    assert http_client.post(server.url(), timeout=5, retries=1).status_code == 200
+    assert server.hits == 3
+
+
+def test_breaker_opens_then_lets_one_trial_through(server):
+    server.statuses = [503] * 3
+    assert http_client.get(server.url(), timeout=5, retries=2).status_code == 503
+    assert host_stats(server)['circuit'] == 'open'
+    with pytest.raises(http_client.CircuitOpenError):
+        http_client.get(server.url(), timeout=5)
+    assert server.hits == 3  # rejected without touching the network
+    time.sleep(0.25)
+    assert http_client.get(server.url(), timeout=5).status_code == 200
+    assert host_stats(server)['circuit'] == 'closed'
+
+
+def test_failed_trial_of_any_kind_does_not_wedge_the_host(server):
+    server.statuses = [503] * 3
+    http_client.get(server.url(), timeout=5, retries=2)
+    time.sleep(0.25)
+    with pytest.raises(requests.TooManyRedirects):
+        http_client.get(server.url('/loop'), timeout=5)  # the half-open trial fails without a connection error
+    time.sleep(0.25)
+    assert http_client.get(server.url(), timeout=5).status_code == 200
+
+
+def test_connection_errors_are_retried_then_raised(server, monkeypatch):
+    url = server.url()
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(requests.ConnectionError):
+        http_client.get(url, timeout=1, retries=1)
+    assert http_client.stats()[url.split('/')[2]]['retries'] == 1
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Resize proxy (image_proxy.py) against a local stand-in image host.
+
+Covers one upstream fetch per source however many presets, threads and
+worker processes ask, LRU eviction of the shared cache directory, and the
+/img response headers.
+
+  python -m pytest -q test_image_proxy.py
+"""
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+import image_proxy
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def jpeg(width=1200, height=900):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(out, 'JPEG')
+    return out.getvalue()
+
+
+class StandIn(ThreadingHTTPServer):
+    """Serves one JPEG at every path, after `delay` seconds, counting requests."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.body = jpeg()
+        self.delay = 0.0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def url(self, path='/photo.jpg'):
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    s = StandIn()
+    threading.Thread(target=s.serve_forever, daemon=True).start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = str(tmp_path / 'img')
+    monkeypatch.setattr(image_proxy, 'PROXY_DIR', path)
+    monkeypatch.setattr(image_proxy, '_lru', None)
+    return path
+
+
+def test_every_preset_and_format_comes_from_one_fetch(upstream, cache_dir):
+    upstream.delay = 0.3
+    url = upstream.url()
+    results = {}
+    threads = [threading.Thread(target=lambda p=p, f=f: results.update({(p, f): image_proxy.get_resized(url, p, f)}))
+               for p in image_proxy.PRESETS for f in ('webp', 'jpeg') for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert upstream.hits == 1
+    for (preset, fmt), (data, etag) in results.items():
+        with Image.open(io.BytesIO(data)) as im:
+            assert im.format == fmt.upper() and im.width == image_proxy.PRESETS[preset]
+        assert etag.endswith(f'-{preset}-{fmt}')
+    image_proxy.get_resized(url, 'card', 'webp')
+    assert upstream.hits == 1
+
+
+WORKER = '''
+import sys
+import image_proxy
+image_proxy.PROXY_DIR = sys.argv[2]
+image_proxy.get_resized(sys.argv[1], sys.argv[3], 'webp')
+'''
+
+
+def test_worker_processes_share_one_fetch(upstream, cache_dir):
+    upstream.delay = 1.0
+    procs = [subprocess.Popen([sys.executable, '-c', WORKER, upstream.url(), cache_dir, preset], cwd=ROOT)
+             for preset in image_proxy.PRESETS]
+    assert all(p.wait(timeout=60) == 0 for p in procs)
+    assert upstream.hits == 1
+
+
+def test_lru_evicts_least_recently_used_across_instances(tmp_path):
+    path = str(tmp_path / 'lru')
+    a, b = image_proxy.FileLRU(path, 10000), image_proxy.FileLRU(path, 10000)  # two workers
+    for i in range(4):
+        a.put(f'{i}', b'x' * 2000)
+        time.sleep(0.01)
+    assert b.get('0') is not None  # used again: now the newest
+    time.sleep(0.01)
+    b.put('4', b'x' * 2000)
+    b.put('5', b'x' * 2000)  # 12000 bytes: evict down to 9000
+    assert a.get('0') is not None and a.get('1') is None
+    on_disk = sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path) if not n.startswith('.'))
+    assert on_disk == a.stats()['bytes'] <= 10000
+
+
+def test_img_route_headers(upstream, cache_dir, tmp_path):
+    from app import create_app
+    from database_models import db, Product
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "img.db"}',
+                      'EVENTS_PATH': str(tmp_path / 'events.db'), 'METRICS_DIR': str(tmp_path / 'metrics'),
+                      'CAMPAIGN_SCHEDULER': False,
+                      'CATALOG_SNAPSHOT': False})
+    with app.app_context():
+        product = Product(name='Red', price=1.0, stock=1, image_url=upstream.url())
+        db.session.add(product)
+        db.session.commit()
+        pid, url = product.id, product.image_url
+    client = app.test_client()
+    v = image_proxy.version(url)
+    resp = client.get(f'/img/card/{pid}?v={v}', headers={'Accept': 'image/webp'})
+    assert resp.status_code == 200 and resp.mimetype == 'image/webp'
+    assert 'immutable' in resp.headers['Cache-Control'] and 'Accept' in resp.headers['Vary']
+    again = client.get(f'/img/card/{pid}?v={v}', headers={'Accept': 'image/webp', 'If-None-Match': resp.headers['ETag']})
+    assert again.status_code == 304
+    outdated = client.get(f'/img/card/{pid}?v=old', headers={'Accept': 'image/jpeg'})
+    assert outdated.mimetype == 'image/jpeg' and 'immutable' not in outdated.headers['Cache-Control']
+    assert client.get(f'/img/huge/{pid}').status_code == 404
+    assert upstream.hits == 1
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Upload derivatives (image_variants.py) in a scratch upload folder and sqlite database.
+
+Covers the preset sizes and formats written for an upload, EXIF rotation
+and transparency, and recording variants as srcset data.
+
+  python -m pytest -q test_image_variants.py
+"""
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import image_variants
+from database_models import create_db_app, db, ImageVariant
+
+FORMATS = image_variants.FORMATS
+
+
+def save_image(path, size, mode='RGB', **params):
+    Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40)).save(path, **params)
+    return str(path)
+
+
+def sizes(variants):
+    return {(v['preset'], v['format']): (v['width'], v['height']) for v in variants}
+
+
+def test_every_preset_in_every_format(tmp_path):
+    src = save_image(tmp_path / 'photo.jpg', (1200, 900))
+    variants = image_variants.generate_variants(src, str(tmp_path / 'variants'), 'photo')
+    expected = {'detail': (800, 600), 'card': (320, 240), 'thumb': (160, 120)}
+    assert sizes(variants) == {(p, f): expected[p] for p in expected for f in FORMATS}
+    for v in variants:
+        with Image.open(tmp_path / 'variants' / v['filename']) as im:
+            assert im.format == v['format'].upper() and im.size == (v['width'], v['height'])
+
+
+def test_small_originals_are_not_upscaled(tmp_path):
+    src = save_image(tmp_path / 'small.png', (200, 100))
+    variants = sizes(image_variants.generate_variants(src, str(tmp_path / 'variants'), 'small'))
+    fmt = FORMATS[0]
+    assert [variants[(p, fmt)] for p in ('detail', 'card', 'thumb')] == [(200, 100), (200, 100), (160, 80)]
+
+
+def test_exif_rotation_and_alpha_are_kept(tmp_path):
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation: rotate 90 degrees when shown
+    src = save_image(tmp_path / 'portrait.jpg', (1200, 900), exif=exif.tobytes())
+    variants = sizes(image_variants.generate_variants(src, str(tmp_path / 'variants'), 'portrait'))
+    assert variants[('detail', FORMATS[0])] == (800, 1067)
+
+    src = save_image(tmp_path / 'logo.png', (400, 400), mode='RGBA')
+    image_variants.generate_variants(src, str(tmp_path / 'variants'), 'logo')
+    with Image.open(tmp_path / 'variants' / 'logo-card.webp') as im:
+        assert im.mode == 'RGBA' and im.getpixel((10, 10))[3] == 128
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "variants.db"}',
+                         'UPLOAD_FOLDER': str(tmp_path / 'uploads')})
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_scheduled_variants_become_srcset_data(app):
+    folder = app.config['UPLOAD_FOLDER']
+    save_image(os.path.join(folder, 'a1.jpg'), (300, 200))
+    image_variants.schedule(app, '/uploads/a1.jpg', 'a1.jpg').result(timeout=60)
+    deadline = time.time() + 10
+    while ImageVariant.query.count() < 3 * len(FORMATS) and time.time() < deadline:  # stored on the background pool
+        time.sleep(0.05)
+        db.session.rollback()
+    data = image_variants.variants_for(['/uploads/a1.jpg', '/uploads/missing.jpg', 'https://cdn/x.jpg', None])
+    assert list(data) == ['/uploads/a1.jpg']
+    for fmt in FORMATS:
+        # detail and card are both the original 300 px: one srcset entry for them
+        assert data['/uploads/a1.jpg']['srcset'][fmt] == (f'/uploads/variants/a1-thumb.{fmt} 160w, '
+                                                         f'/uploads/variants/a1-detail.{fmt} 300w')
+    assert len(data['/uploads/a1.jpg']['sizes']) == 3 * len(FORMATS)
+
+
+def test_recording_again_replaces_the_rows(app):
+    first = [{'preset': 'thumb', 'format': 'webp', 'width': 160, 'height': 90, 'filename': 'b-thumb.webp'}]
+    image_variants.record_variants('/uploads/b.jpg', first)
+    image_variants.record_variants('/uploads/b.jpg', [dict(first[0], width=150)])
+    assert [(v.width, v.url) for v in ImageVariant.query.all()] == [(150, '/uploads/variants/b-thumb.webp')]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Catalog import (import_catalog.py) against a throwaway sqlite database.
+
+Covers row validation, upserts by key, and resuming mid-file from the
+checkpoint after a chunk fails, with no row skipped or imported twice.
+
+  python -m pytest -q test_import_catalog.py
+"""
+import json
+import os
+
+import pytest
+
+import import_catalog
+from database_models import create_db_app, db, Product, Category
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "import.db"}'}
+    monkeypatch.setattr(import_catalog, 'create_db_app', lambda: create_db_app(config))
+    app = create_db_app(config)
+    with app.app_context():
+        db.session.add(Category(id=1, name='Electronics'))
+        db.session.commit()
+        db.session.remove()
+    return app
+
+
+def products(app):
+    with app.app_context():
+        return {p.asin: (p.name, p.price, p.discount_price, p.stock, p.category_id)
+                for p in Product.query.order_by(Product.id)}
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('asin,name,price,discount_price,stock,category\n')
+        for r in rows:
+            f.write(r + '\n')
+    return str(path)
+
+
+def failing_at(line, apply):
+    """Importer.apply that raises on the chunk starting at `line`, as a crash mid-import would."""
+    def failing_apply(self, records, results, first_line):
+        if first_line == line:
+            raise RuntimeError('disk full')
+        return apply(self, records, results, first_line)
+    return failing_apply
+
+
+def test_normalize_cleans_and_rejects():
+    row, error = import_catalog.normalize({'Name': ' Lamp ', 'price': '₹1,299.00', 'discount_price': '1299', 'stock': '3'})
+    assert error is None
+    assert (row['name'], row['price'], row['discount_price'], row['stock']) == ('Lamp', 1299.0, None, 3)
+    assert 'rating' not in row and not row['has_category']  # absent columns are left alone on update
+    for raw, message in [({'name': 'x', 'price': '0'}, 'bad price'),
+                         ({'name': 'x', 'price': '10', 'discount_price': '12'}, 'discount'),
+                         ({'name': 'x', 'price': '10', 'stock': '-1'}, 'negative stock'),
+                         ({'name': 'x', 'price': '10', 'rating': '7'}, 'rating'),
+                         ({'name': 'x', 'price': 'ten'}, 'bad number'),
+                         ({'price': '10'}, 'missing name')]:
+        assert import_catalog.normalize(raw)[1].startswith(message)
+
+
+def test_import_upserts_by_key_and_rejects_bad_rows(app, tmp_path):
+    path = write_csv(tmp_path / 'a.csv', ['A1,Lamp,10,,2,Electronics', 'A2,Mug,5,4,1,Kitchen',
+                                          ',Nameless key,3,,1,', 'A3,"Cable, 2 m",7,,0,'])
+    errors = str(tmp_path / 'rejected.jsonl')
+    counts = import_catalog.main(path, chunk=2, workers=1, errors=errors)
+    assert counts == {'rows': 4, 'inserted': 2, 'updated': 0, 'rejected': 2}
+    with open(errors) as f:
+        assert [json.loads(line)['error'] for line in f] == ["unknown category 'Kitchen'", 'missing asin']
+
+    path = write_csv(tmp_path / 'b.csv', ['A1,Desk Lamp,12,9,5,Electronics', 'A2,Mug,5,4,1,Kitchen'])
+    counts = import_catalog.main(path, chunk=10, workers=1, create_categories=True)
+    assert counts == {'rows': 2, 'inserted': 1, 'updated': 1, 'rejected': 0}
+    found = products(app)
+    assert found['A1'] == ('Desk Lamp', 12.0, 9.0, 5, 1)
+    assert found['A2'][:4] == ('Mug', 5.0, 4.0, 1) and found['A3'] == ('Cable, 2 m', 7.0, None, 0, None)
+
+
+def test_invalid_utf8_rejects_only_its_row(app, tmp_path):
+    path = tmp_path / 'bad.csv'
+    path.write_bytes(b'asin,name,price\nB1,Good,1\nB2,Caf\xe9,2\nB3,Fine,3\n')
+    counts = import_catalog.main(str(path), workers=1)
+    assert counts['inserted'] == 2 and counts['rejected'] == 1
+    assert set(products(app)) == {'B1', 'B3'}
+
+
+def test_failed_chunk_resumes_mid_file(app, tmp_path, monkeypatch):
+    rows = [f'C{i},"Item {i}\nsecond line",{i},,1,' for i in range(1, 11)]  # records spanning two lines
+    path = write_csv(tmp_path / 'c.csv', rows)
+    apply = import_catalog.Importer.apply
+    monkeypatch.setattr(import_catalog.Importer, 'apply', failing_at(7, apply))
+    with pytest.raises(RuntimeError):
+        import_catalog.main(path, chunk=3, workers=1)
+    assert len(products(app)) == 6  # two chunks committed with their checkpoint, the third rolled back
+
+    monkeypatch.setattr(import_catalog.Importer, 'apply', apply)
+    counts = import_catalog.main(path, chunk=3, workers=2)
+    assert counts == {'rows': 10, 'inserted': 10, 'updated': 0, 'rejected': 0}
+    found = products(app)
+    assert sorted(found, key=lambda k: int(k[1:])) == [f'C{i}' for i in range(1, 11)]
+    assert found['C7'] == ('Item 7\nsecond line', 7.0, None, 1, None)
+    with app.app_context():
+        assert import_catalog.checkpoint_for(path).state == {}  # cleared once the file is done
+
+
+def test_changed_file_is_not_resumed(app, tmp_path, monkeypatch):
+    path = write_csv(tmp_path / 'd.csv', [f'D{i},Item {i},{i},,1,' for i in range(1, 5)])
+    monkeypatch.setattr(import_catalog.Importer, 'apply', failing_at(3, import_catalog.Importer.apply))
+    with pytest.raises(RuntimeError):
+        import_catalog.main(path, chunk=2, workers=1)
+    with open(path, 'a') as f:
+        f.write('D5,Item 5,5,,1,\n')
+    os.utime(path, (1, 1))
+    assert import_catalog.main(path, chunk=2, workers=1) is None
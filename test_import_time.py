@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Cold-start import budget for the app and the maintenance scripts.
+
+Each module is imported in a fresh interpreter under `python -X importtime`.
+Its own cost is the time spent in modules that the frameworks it sits on
+(Flask-SQLAlchemy and friends) do not import themselves. That part is
+ours, and it does not drift with the speed of the machine the way the
+framework's share does. The best of RUNS runs is compared with the budget.
+
+Modules that must stay lazy are checked as well. The app must not pull in
+requests, MySQL or the reviews client at import time. Scripts must not
+pull in the web app, JWT or numpy just to open the database.
+
+  python -m pytest -q test_import_time.py
+  python test_import_time.py            # print the breakdown
+"""
+import os
+import re
+import subprocess
+import sys
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RUNS = 3
+APP_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_APP_MS', 400))
+SCRIPT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_SCRIPT_MS', 150))
+
+APP_FRAMEWORK = 'import flask_sqlalchemy, flask_jwt_extended, flask_login, flask_cors'
+SCRIPT_FRAMEWORK = 'import flask_sqlalchemy, flask_login'
+SCRIPTS = ['database_models', 'import_catalog', 'maintenance', 'gc_uploads', 'seed_db', 'compute_lqip',
+           'update_images', 'assign_images_by_keyword', 'test_db']
+APP_LAZY = ('requests', 'mysql', 'rapid_reviews', 'urllib3')
+SCRIPT_LAZY = ('app', 'flask_jwt_extended', 'numpy', 'requests', 'mysql')
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+\d+ \| *(\S+)')
+
+
+def import_times(code):
+    """{module: self time in us} for running `code` in a fresh interpreter."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, capture_output=True,
+                         text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'))
+    if out.returncode:
+        raise RuntimeError(f'{code!r} failed:\n{out.stderr[-2000:]}')
+    return {m.group(2): int(m.group(1)) for m in _LINE.finditer(out.stderr)}
+
+
+def own_cost(module, framework):
+    """(ms, {module: us}) spent importing `module` beyond `framework`, best of RUNS."""
+    floor = import_times(framework)
+    best = None
+    for _ in range(RUNS):
+        own = {k: v for k, v in import_times(f'import {module}').items() if k not in floor}
+        total = sum(own.values()) / 1000
+        if best is None or total < best[0]:
+            best = (total, own)
+    return best
+
+
+def breakdown(own, top=8):
+    by_package = Counter()
+    for name, us in own.items():
+        by_package[name.split('.')[0]] += us
+    return ', '.join(f'{name} {us / 1000:.1f}ms' for name, us in by_package.most_common(top))
+
+
+def test_app_import_budget():
+    ms, own = own_cost('app', APP_FRAMEWORK)
+    assert ms <= APP_BUDGET_MS, f'app imports take {ms:.0f} ms over the frameworks (budget {APP_BUDGET_MS:.0f}): {breakdown(own)}'
+
+
+def test_app_keeps_integrations_lazy():
+    _, own = own_cost('app', APP_FRAMEWORK)
+    loaded = sorted({name.split('.')[0] for name in own} & set(APP_LAZY))
+    assert not loaded, f'app imports {loaded} at module level'
+
+
+def test_script_import_budget():
+    for script in SCRIPTS:
+        ms, own = own_cost(script, SCRIPT_FRAMEWORK)
+        assert ms <= SCRIPT_BUDGET_MS, f'{script} takes {ms:.0f} ms over the DB stack (budget {SCRIPT_BUDGET_MS:.0f}): {breakdown(own)}'
+        loaded = sorted({name.split('.')[0] for name in own} & set(SCRIPT_LAZY))
+        assert not loaded, f'{script} imports {loaded}; scripts should use database_models.create_db_app()'
+
+
+if __name__ == '__main__':
+    for module, framework, budget in [('app', APP_FRAMEWORK, APP_BUDGET_MS)] + \
+            [(s, SCRIPT_FRAMEWORK, SCRIPT_BUDGET_MS) for s in SCRIPTS]:
+        ms, own = own_cost(module, framework)
+        print(f'{module:<26} {ms:7.1f} ms / {budget:.0f}  {breakdown(own, 5)}')
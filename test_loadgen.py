@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Load generator helpers (bench/loadgen.py) on a throwaway sqlite database and a local stand-in server.
+
+Covers --mix parsing, the oversell / lost-update stock check, shopper
+accounts, and how the recorder counts errors and timeouts.
+
+  python -m pytest -q test_loadgen.py
+"""
+import argparse
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from werkzeug.security import check_password_hash
+
+from bench import loadgen
+from database_models import create_db_app, db
+
+
+def test_parse_mix():
+    assert loadgen.parse_mix('browse:40, cart:30,buy') == {'browse': 40.0, 'cart': 30.0, 'buy': 1.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        loadgen.parse_mix('browse:1,window:2')
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'shop.db'
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}'})
+    with app.app_context():
+        db.session.remove()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, email, password_hash) VALUES (1, 'old@example.com', 'x')")
+    conn.executemany("INSERT INTO products (id, name, price, stock) VALUES (?, 'p', 1.0, ?)",
+                     [(1, 5), (2, 3), (3, 10), (4, 2)])
+    conn.execute('INSERT INTO orders (id, user_id) VALUES (1, 1)')  # before the run
+    conn.execute('INSERT INTO order_items (order_id, product_id, quantity) VALUES (1, 1, 4)')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_check_stock_finds_oversold_and_lost_updates(path):
+    before, last_order = loadgen.stock_state(path)
+    assert before == {1: 5, 2: 3, 3: 10, 4: 2} and last_order == 1
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO orders (id, user_id) VALUES (?, 1)', [(2,), (3,), (4,)])
+    conn.executemany('INSERT INTO order_items (order_id, product_id, quantity) VALUES (?, ?, ?)',
+                     [(2, 1, 2), (2, 2, 2), (3, 2, 2), (3, 3, 4)])  # order 4 has no items
+    # product 1: 5 - 2 = 3, correct. 2: 4 sold of 3, oversold by 1 (stock clamps at 0).
+    # 3: 10 - 4 should leave 6, but one checkout's update was lost. 4: untouched.
+    conn.executemany('UPDATE products SET stock = ? WHERE id = ?', [(3, 1), (0, 2), (8, 3)])
+    conn.commit()
+    conn.close()
+    assert loadgen.check_stock(path, before, last_order) == {
+        'orders': 3, 'orders_without_items': 1, 'units_sold': 10,
+        'oversold_products': 1, 'oversold_units': 1, 'lost_update_products': 1, 'lost_update_units': 2}
+
+
+def test_create_shoppers_is_idempotent(path):
+    loadgen.create_shoppers(path, 3)
+    loadgen.create_shoppers(path, 4)
+    conn = sqlite3.connect(path)
+    users = conn.execute("SELECT id, email, password_hash FROM users WHERE email LIKE 'loadgen%' ORDER BY id").fetchall()
+    carts = conn.execute('SELECT user_id FROM carts ORDER BY user_id').fetchall()
+    conn.close()
+    assert [email for _, email, _ in users] == [f'loadgen{i}@example.com' for i in range(4)]
+    assert [uid for (uid,) in carts] == [uid for uid, _, _ in users]  # one cart each, none for other users
+    assert check_password_hash(users[0][2], 'password')
+
+
+class StandIn(ThreadingHTTPServer):
+    """/ok answers 200, /fail 500, /slow after `delay` seconds."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.delay = 0.5
+        self.hits = 0
+        self.lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+        if self.path == '/slow':
+            time.sleep(self.server.delay)
+        try:
+            self.send_response(500 if self.path == '/fail' else 200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on /slow
+
+    def log_message(self, *args):
+        pass
+
+
+def test_recorder_counts_statuses_errors_and_timeouts():
+    server = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    rec = loadgen.Recorder()
+    http = requests.Session()
+    try:
+        assert rec.call('browse', http, 'GET', f'{base}/ok', timeout=5) is not None
+        assert rec.call('browse', http, 'GET', f'{base}/fail', timeout=5) is None
+        assert rec.call('detail', http, 'GET', f'{base}/slow', timeout=0.1) is None
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert rec.call('orders', http, 'GET', f'{base}/ok', timeout=1) is None  # server gone
+    assert len(rec.times['browse']) == 2 and rec.errors['browse'] == 1 and rec.statuses[500] == 1
+    assert rec.timeouts['detail'] == 1 and not rec.times['detail']
+    assert rec.errors['orders'] == 1 and rec.statuses['connection'] == 1
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Chunked maintenance runner (maintenance.py) against a throwaway sqlite database.
+
+Covers dry runs, bulk updates of only the changed fields, and resuming
+from the checkpoint after an interrupted run or a --limit.
+
+  python -m pytest -q test_maintenance.py
+"""
+import pytest
+
+import catalog
+import checkpoint
+import maintenance
+from database_models import create_db_app, db, Product, Category, CatalogChange
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'CHECKPOINT_DIR', str(tmp_path / 'checkpoints'))
+    monkeypatch.setattr(catalog, '_default', {'hooks': [], 'version': None, 'checked_at': 0.0})  # per database
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "maintenance.db"}'})
+    with app.app_context():
+        db.session.add(Category(id=1, name='Lighting'))
+        db.session.add_all(Product(name=f'lamp {i}', price=float(i), stock=1, category_id=1 if i % 2 else None)
+                           for i in range(1, 11))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def titled(row, categories):
+    """Title-case names and prefix the category, like a cleanup script would."""
+    name = row.name.title()
+    prefix = f'{categories[row.category_id]}: ' if row.category_id in categories else ''
+    if not name.startswith(prefix):
+        name = prefix + name
+    return {'name': name, 'price': row.price}  # price unchanged: dropped from the diff
+
+
+def names():
+    db.session.expire_all()
+    return [p.name for p in Product.query.order_by(Product.id)]
+
+
+def saved(name):
+    return checkpoint.Checkpoint.for_script(name).state
+
+
+def test_dry_run_prints_and_changes_nothing(app, capsys):
+    assert maintenance.run('titles', titled, ['name', 'price', 'category_id'], chunk=4, dry_run=True) == \
+        {'processed': 10, 'changed': 10}
+    out = capsys.readouterr().out
+    diffs = [line for line in out.splitlines() if line.startswith('id=')]
+    assert diffs[0] == "id=1 name: 'lamp 1' -> 'Lighting: Lamp 1'" and len(diffs) == 10
+    assert not any('price' in line for line in diffs)
+    assert names()[0] == 'lamp 1' and saved('titles') == {}
+    assert CatalogChange.query.count() == 0
+
+
+def test_apply_writes_changed_fields_and_bumps_the_catalog(app):
+    before = catalog.version()
+    assert maintenance.run('titles', titled, ['name', 'price', 'category_id'], chunk=4) == \
+        {'processed': 10, 'changed': 10}
+    assert names()[:2] == ['Lighting: Lamp 1', 'Lamp 2']
+    version, fields = catalog.changed_since(before)
+    assert fields == {'name'} and version == before + 3  # one bump per chunk
+    assert catalog.changed_products(before, 'name')[1] == set(range(1, 11))
+    assert maintenance.run('titles', titled, ['name', 'price', 'category_id'], chunk=4)['changed'] == 0  # already done
+    assert saved('titles') == {}  # finished: the next run starts from the top
+
+
+def test_interrupted_run_resumes_after_the_last_chunk(app):
+    seen = []
+
+    def crashing(row, categories):
+        seen.append(row.id)
+        if row.id == 7:
+            raise KeyboardInterrupt
+        return titled(row, categories)
+    with pytest.raises(KeyboardInterrupt):
+        maintenance.run('titles', crashing, ['name', 'price', 'category_id'], chunk=3)
+    assert saved('titles') == {'last_id': 6}
+    assert names()[5:7] == ['Lamp 6', 'lamp 7']
+
+    seen.clear()
+    maintenance.run('titles', titled_and_seen(seen), ['name', 'price', 'category_id'], chunk=3)
+    assert seen == [7, 8, 9, 10]  # earlier chunks are not read again
+    assert all(name.startswith(('Lighting: Lamp', 'Lamp')) for name in names())
+
+
+def titled_and_seen(seen):
+    def compute(row, categories):
+        seen.append(row.id)
+        return titled(row, categories)
+    return compute
+
+
+def test_limit_keeps_the_checkpoint_and_restart_ignores_it(app):
+    seen = []
+    result = maintenance.run('titles', titled_and_seen(seen), ['name', 'price', 'category_id'], chunk=2, limit=3)
+    assert result['processed'] == 3
+    assert saved('titles') == {'last_id': 3}
+    maintenance.run('titles', titled_and_seen(seen), ['name', 'price', 'category_id'], chunk=2, limit=3)
+    assert seen == [1, 2, 3, 4, 5, 6]
+    seen.clear()
+    maintenance.run('titles', titled_and_seen(seen), ['name', 'price', 'category_id'], chunk=5, restart=True)
+    assert seen == list(range(1, 11)) and saved('titles') == {}
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Request metrics (metrics.py) on a throwaway app, snapshots in a temporary METRICS_DIR.
+
+  python -m pytest -q test_metrics.py
+"""
+import threading
+import warnings
+
+from sqlalchemy import text
+
+import catalog
+import fanout
+import metrics
+from database_models import db
+
+
+def make_app(tmp_path, monkeypatch):
+    from app import create_app
+    monkeypatch.setattr(catalog, 'poll', lambda: 0)  # keep the per-request version check out of the counts
+    warnings.filterwarnings('ignore')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}',
+                      'EVENTS_PATH': str(tmp_path / 'events.db'), 'METRICS_DIR': str(tmp_path / 'metrics'),
+                      'SEARCH_INDEX_PRELOAD': False, 'CAMPAIGN_SCHEDULER': False, 'CATALOG_SNAPSHOT': False})
+
+    def query(n):
+        for _ in range(n):
+            db.session.execute(text('SELECT 1'))
+        return n
+
+    @app.route('/api/test/fanout')
+    def fanned_out():
+        fan = fanout.Fanout(app)
+        fan.submit('a', 5, query, 3)
+        fan.submit('b', 5, query, 4, pool='upstream')
+        results, _, _ = fan.collect()
+        return {'parts': results}
+
+    def in_context(n):
+        with app.app_context():
+            query(n)
+
+    @app.route('/api/test/thread')
+    def plain_thread():
+        t = threading.Thread(target=in_context, args=(2,))
+        t.start()
+        t.join()
+        return {}
+    return app
+
+
+def statements(route):
+    merged = metrics.collect()
+    series = merged['db_statements_per_request'][('GET', route)]
+    return series[-2], series[-1]  # (sum, count)
+
+
+def test_fanout_parts_count_towards_the_request(tmp_path, monkeypatch):
+    client = make_app(tmp_path, monkeypatch).test_client()
+    assert client.get('/api/test/fanout').get_json() == {'parts': {'a': 3, 'b': 4}}
+    assert statements('/api/test/fanout') == (7, 1)
+    assert client.get('/api/test/thread').status_code == 200
+    assert statements('/api/test/thread') == (0, 1)  # a thread not attached to the request is not counted
+
+
+def test_attach_counts_outside_a_request():
+    usage = metrics.Usage()
+    assert metrics.current() is None
+    with metrics.attach(usage):
+        assert metrics.current() is usage
+        metrics._on_outbound('example.com', 0.25, True)
+    assert metrics.current() is None
+    metrics._on_outbound('example.com', 0.25, True)
+    assert usage.outbound == 0.25
+
+
+def test_snapshots_go_to_the_configured_directory(tmp_path, monkeypatch):
+    client = make_app(tmp_path, monkeypatch).test_client()
+    client.get('/metrics')
+    assert [name for name in (tmp_path / 'metrics').iterdir() if name.suffix == '.json']
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Personalized ranking (personalization.py) against a throwaway sqlite database and vector directory.
+
+Covers growing a shared VectorFile, concurrent writers in several
+processes, and rank() putting a user's best matches first.
+
+  python -m pytest -q test_personalization.py
+"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import personalization
+from database_models import create_db_app, db, Category, Product, Order, OrderItem, User
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# name, category
+PRODUCTS = [
+    ('Desk Lamp', 2), ('Trail Running Shoes', 1), ('Coffee Mug', 2), ('Running Socks', 1),
+    ('Notebook', None), ('Running Jacket', 1), ('Kitchen Scale', 2),
+]
+
+
+@pytest.fixture
+def vectors(tmp_path, monkeypatch):
+    path = str(tmp_path / 'vectors')
+    monkeypatch.setattr(personalization, 'VECTORS_DIR', path)
+    monkeypatch.setattr(personalization, 'items', personalization.VectorFile('items'))
+    monkeypatch.setattr(personalization, 'users', personalization.VectorFile('users'))
+    return path
+
+
+@pytest.fixture
+def app(tmp_path, vectors):
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "shop.db"}'})
+    with app.app_context():
+        db.session.add_all([Category(id=1, name='Sports'), Category(id=2, name='Home')])
+        db.session.add_all(Product(name=n, price=1.0, stock=1, category_id=c) for n, c in PRODUCTS)
+        db.session.add_all(User(id=i, email=f'u{i}@example.com', password_hash='x') for i in (1, 2))
+        order = Order(user_id=1)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([OrderItem(order_id=order.id, product_id=2, quantity=1),
+                            OrderItem(order_id=order.id, product_id=4, quantity=3)])
+        db.session.commit()
+        personalization.rebuild(log=lambda msg: None)
+        yield app
+        db.session.remove()
+
+
+def unit(seed):
+    v = np.random.default_rng(seed).standard_normal(personalization.DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_put_grows_the_file_and_keeps_rows(vectors):
+    vf = personalization.VectorFile('items')
+    vf.put(5, unit(5))
+    assert len(vf.get()) == 1024
+    other = personalization.VectorFile('items')  # another worker's handle on the same file
+    assert np.allclose(other.rows([5])[0], unit(5))
+    vf.put(3000, unit(3000))
+    assert len(vf.get()) == 3001
+    assert np.allclose(other.rows([5, 3000]), [unit(5), unit(3000)])  # remapped after the grow
+    assert not other.rows([3001]).any() and not other.rows([6]).any()
+
+
+WRITER = '''
+import sys
+import numpy as np
+import personalization
+personalization.VECTORS_DIR = sys.argv[1]
+vf = personalization.VectorFile('items')
+worker, workers = int(sys.argv[2]), int(sys.argv[3])
+for row in range(worker, 5000, workers):
+    vf.put(row, np.full(personalization.DIM, row + 1, np.float32))
+'''
+
+
+def test_concurrent_writers_lose_no_rows(vectors):
+    procs = [subprocess.Popen([sys.executable, '-c', WRITER, vectors, str(i), '4'], cwd=ROOT) for i in range(4)]
+    assert all(p.wait(timeout=120) == 0 for p in procs)
+    rows = personalization.VectorFile('items').rows(range(5000))
+    assert (rows[:, 0] == np.arange(1, 5001)).all()  # no write went into a file another worker replaced
+
+
+def test_rank_puts_matches_first(app):
+    products = Product.query.order_by(Product.id).all()
+    ranked = [p.name for p in personalization.rank(products, user_id=1, k=3)]
+    assert set(ranked[:3]) == {'Trail Running Shoes', 'Running Socks', 'Running Jacket'}
+    assert ranked[3:] == ['Desk Lamp', 'Coffee Mug', 'Notebook', 'Kitchen Scale']  # the rest keep their order
+
+
+def test_rank_without_history_uses_the_cart(app):
+    products = Product.query.order_by(Product.id).all()
+    assert personalization.rank(products, user_id=2) == products
+    ranked = [p.name for p in personalization.rank(products, user_id=2, cart_product_ids=[3], k=2)]
+    assert set(ranked[:2]) <= {'Desk Lamp', 'Coffee Mug', 'Kitchen Scale'}
+
+
+def test_refresh_matches_the_rebuild(app):
+    rebuilt = personalization.users.rows([1])[0].copy()
+    personalization.users.put(1, np.zeros(personalization.DIM, np.float32))
+    personalization.refresh_user(app, 1)
+    assert np.allclose(personalization.users.rows([1])[0], rebuilt)
+    assert np.allclose(rebuilt, personalization.history_vector(1))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Reviews cache (rapid_reviews.py, disk_cache.py) against a local stand-in for the upstream API.
+
+Covers coalesced misses, serving stale entries while a background refresh
+runs, keeping a stale value when the refresh fails, the request path's single
+try and time budget, and the lease that lets only one of several processes
+call upstream for the same ASIN.
+
+  python -m pytest -q test_rapid_reviews.py
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import rapid_reviews
+from disk_cache import DiskCache
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class StandIn(ThreadingHTTPServer):
+    """Answers every GET with {'reviews': [...], 'n': <request number>} after `delay` seconds, or `status`."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.hits = 0
+        self.delay = 0.0
+        self.status = 200
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/top-product-reviews'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+            n = self.server.hits
+        time.sleep(self.server.delay)
+        body = json.dumps({'reviews': [{'title': 'fine'}], 'n': n}).encode()
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    server = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(rapid_reviews, 'REVIEWS_URL', server.url)
+    monkeypatch.setattr(rapid_reviews, 'RAPIDAPI_KEY', 'test')
+    monkeypatch.setattr(rapid_reviews, '_CACHE_PATH', str(tmp_path / 'reviews.sqlite3'))
+    monkeypatch.setattr(rapid_reviews, '_cache', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(check, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_concurrent_misses_call_upstream_once(upstream):
+    upstream.delay = 0.3
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(rapid_reviews.get_reviews('B0TEST'))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert upstream.hits == 1
+    assert len(results) == 10 and all(r['ok'] for r in results)
+    again = rapid_reviews.get_reviews('B0TEST')
+    assert again['from_cache'] and not again['stale'] and upstream.hits == 1
+
+
+def test_stale_entry_is_served_while_a_background_refresh_runs(upstream, monkeypatch):
+    monkeypatch.setattr(rapid_reviews, '_CACHE_TTL', 0.2)
+    assert rapid_reviews.get_reviews('B0TEST')['reviews']['n'] == 1
+    time.sleep(0.3)
+    upstream.delay = 0.5
+    started = time.perf_counter()
+    stale = rapid_reviews.get_reviews('B0TEST')
+    assert time.perf_counter() - started < 0.25  # did not wait for upstream
+    assert stale['ok'] and stale['stale'] and stale['reviews']['n'] == 1
+    assert wait_for(lambda: rapid_reviews._get_cache().get('US:B0TEST').value['n'] == 2)
+    assert upstream.hits == 2
+
+
+def test_failed_refresh_keeps_the_stale_value(upstream, monkeypatch):
+    monkeypatch.setattr(rapid_reviews, '_CACHE_TTL', 0.2)
+    rapid_reviews.get_reviews('B0TEST')
+    time.sleep(0.3)
+    upstream.status = 500
+    assert rapid_reviews.get_reviews('B0TEST')['stale']
+    assert wait_for(lambda: upstream.hits >= 2 and not rapid_reviews._flight.busy('US:B0TEST'))
+    entry = rapid_reviews._get_cache().get('US:B0TEST')
+    assert entry.value['n'] == 1 and entry.error  # pushed out by the negative TTL, still servable
+    later = rapid_reviews.get_reviews('B0TEST')
+    assert later['ok'] and later['reviews']['n'] == 1 and not later['stale']
+
+
+def test_upstream_error_without_a_value_is_negative_cached(upstream):
+    upstream.status = 500
+    first = rapid_reviews.get_reviews('B0MISSING')
+    assert not first['ok']
+    hits = upstream.hits
+    second = rapid_reviews.get_reviews('B0MISSING')
+    assert not second['ok'] and second['from_cache'] and upstream.hits == hits
+
+
+def test_a_waiting_request_gets_one_try(upstream):
+    upstream.status = 503
+    assert not rapid_reviews.get_reviews('B0TEST')['ok']
+    assert upstream.hits == 1  # background refreshes retry, the request path does not
+
+
+def test_a_waiting_request_does_not_outlast_its_budget(upstream, monkeypatch, tmp_path):
+    monkeypatch.setattr(rapid_reviews, '_FOREGROUND_BUDGET', 0.5)
+    other = DiskCache(rapid_reviews._CACHE_PATH)
+    assert other.acquire_lease('US:B0TEST', 60)  # another process is fetching and never finishes
+    started = time.perf_counter()
+    result = rapid_reviews.get_reviews('B0TEST')
+    assert time.perf_counter() - started < 1.0
+    assert not result['ok'] and upstream.hits == 0
+
+
+REFRESH = '''
+import json, sys, time
+import rapid_reviews
+rapid_reviews.REVIEWS_URL, rapid_reviews.RAPIDAPI_KEY, rapid_reviews._CACHE_PATH = sys.argv[1], 'test', sys.argv[2]
+print(json.dumps(rapid_reviews._refresh('B0TEST', 'US', time.time() + 8)))
+'''
+
+
+def test_lease_lets_one_process_fetch(upstream, tmp_path):
+    upstream.delay = 1.0
+    path = str(tmp_path / 'shared.sqlite3')
+    DiskCache(path)  # create the tables before the processes race
+    procs = [subprocess.Popen([sys.executable, '-c', REFRESH, upstream.url, path], cwd=ROOT,
+                              stdout=subprocess.PIPE, text=True) for _ in range(2)]
+    results = [json.loads(p.communicate(timeout=30)[0]) for p in procs]
+    assert upstream.hits == 1
+    assert all(r['ok'] for r in results)
+    assert sorted(r['from_cache'] for r in results) == [False, True]
+
+
+def test_lease_is_exclusive_until_released_or_expired(tmp_path):
+    path = str(tmp_path / 'leases.sqlite3')
+    a, b = DiskCache(path), DiskCache(path)
+    assert a.acquire_lease('k', 60)
+    assert not b.acquire_lease('k', 60)
+    b.release_lease('k')  # not b's lease: no effect
+    assert not b.acquire_lease('k', 60)
+    a.release_lease('k')
+    assert b.acquire_lease('k', 0.1)
+    time.sleep(0.15)
+    assert a.acquire_lease('k', 60)  # b's lease ran out
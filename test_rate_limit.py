@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Rate limiter behaviour (rate_limit.py): bucket refill, the key sweep, and 429 / Retry-After.
+
+  python -m pytest -q test_rate_limit.py
+"""
+import sqlite3
+import warnings
+
+import pytest
+
+import rate_limit
+
+
+def test_bucket_refills_at_rate():
+    buckets = rate_limit.KeyedBuckets(rate=1, capacity=2)
+    assert buckets.take('a', now=0) == 0
+    assert buckets.take('a', now=0) == 0
+    assert buckets.take('a', now=0) == pytest.approx(1.0)
+    assert buckets.take('a', now=0.5) == pytest.approx(0.5)
+    assert buckets.take('a', now=1.0) == 0
+    assert buckets.take('b', now=1.0) == 0  # keys are independent
+
+
+def test_sweep_drops_refilled_keys():
+    buckets = rate_limit.KeyedBuckets(rate=1, capacity=1, max_keys=10)
+    for i in range(10):
+        buckets.take(f'k{i}', now=0)
+    buckets.take('new', now=5)  # every old bucket is full again
+    assert len(buckets) == 1
+
+
+def test_sweep_drops_least_recently_used_half():
+    buckets = rate_limit.KeyedBuckets(rate=0.001, capacity=1, max_keys=10)
+    for i in range(10):
+        buckets.take(f'k{i}', now=i)
+    buckets.take('new', now=10)  # nothing has refilled
+    assert len(buckets) == 6
+    assert buckets.take('k0', now=10) == 0  # swept, so it starts full
+    assert buckets.take('k9', now=10) > 0  # kept, still empty
+
+
+def make_app(tmp_path, **config):
+    from app import create_app
+    warnings.filterwarnings('ignore')
+    return create_app(dict({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}',
+                            'EVENTS_PATH': str(tmp_path / 'events.db'), 'METRICS_DIR': str(tmp_path / 'metrics'),
+                            'SEARCH_INDEX_PRELOAD': False,
+                            'CAMPAIGN_SCHEDULER': False, 'CATALOG_SNAPSHOT': False,
+                            'RATE_LIMITS': {'api_test': [('ip', 1, 60, 2)]}}, **config))
+
+
+def test_over_limit_gets_429_with_retry_after(tmp_path):
+    client = make_app(tmp_path).test_client()
+    assert [client.get('/api/test').status_code for _ in range(2)] == [200, 200]
+    resp = client.get('/api/test')
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '60'
+    assert resp.get_json() == {'error': 'too many requests', 'retry_after': 60}
+
+
+def test_locked_sqlite_backend_fails_open(tmp_path, monkeypatch):
+    path = tmp_path / 'rate_limit.db'
+    monkeypatch.setattr(rate_limit.SQLiteBuckets, 'TIMEOUT', 0.05)
+    app = make_app(tmp_path, RATE_LIMIT_BACKEND='sqlite', RATE_LIMIT_PATH=str(path))
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute('BEGIN EXCLUSIVE')
+    try:
+        statuses = [app.test_client().get('/api/test').status_code for _ in range(3)]
+    finally:
+        holder.execute('ROLLBACK')
+        holder.close()
+    assert statuses == [200, 200, 200]
+    assert app.extensions['rate_limit'].errors == 3
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Frequently-bought-together counts (recommendations.py) against a throwaway sqlite database.
+
+Covers pair counting against a brute-force count, the CSR snapshot's top
+neighbours, orders placed after a rebuild applied through the overlay, and
+compaction of the overlay into a new generation that other workers load.
+
+  python -m pytest -q test_recommendations.py
+"""
+import itertools
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import recommendations
+from database_models import create_db_app, db, Order, OrderItem
+
+ORDERS = [[1, 2, 3], [1, 2], [1, 2, 4], [2, 3], [5]]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(recommendations, 'RECS_DIR', str(tmp_path / 'recs'))
+    monkeypatch.setattr(recommendations, '_recommender', None)
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "recs.db"}'})
+    with app.app_context():
+        place(*ORDERS)
+        yield app
+        db.session.remove()
+
+
+def place(*orders):
+    for products in orders:
+        order = Order(user_id=1)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all(OrderItem(order_id=order.id, product_id=p) for p in products)
+    db.session.commit()
+
+
+def brute_force(order_ids, product_ids):
+    baskets = {}
+    for o, p in zip(order_ids, product_ids):
+        baskets.setdefault(o, set()).add(p)
+    pairs = Counter()
+    for products in baskets.values():
+        pairs.update(itertools.permutations(sorted(products)[:recommendations.MAX_ORDER_ITEMS], 2))
+    return pairs
+
+
+def test_pairs_match_a_brute_force_count(monkeypatch):
+    monkeypatch.setattr(recommendations, 'MAX_ORDER_ITEMS', 4)
+    rng = random.Random(7)
+    order_ids = [rng.randrange(1, 40) for _ in range(400)]  # repeated lines and orders over the limit
+    product_ids = [rng.randrange(1, 25) for _ in range(400)]
+    left, right, counts = recommendations.pairs_from_orders(order_ids, product_ids)
+    assert dict(zip(zip(left.tolist(), right.tolist()), counts.tolist())) == brute_force(order_ids, product_ids)
+
+
+def test_csr_rows_keep_the_most_frequent_neighbours(monkeypatch):
+    monkeypatch.setattr(recommendations, 'MAX_NEIGHBORS', 2)
+    left, right, counts = np.array([1, 1, 1, 3]), np.array([2, 3, 4, 1]), np.array([5, 9, 7, 1])
+    snap = recommendations.Snapshot(*recommendations.to_csr(left, right, counts, 4))
+    assert [a.tolist() for a in snap.row(1)] == [[3, 4], [9, 7]]
+    assert [a.tolist() for a in snap.row(2)] == [[], []]
+    assert [a.tolist() for a in snap.row(3)] == [[1], [1]]
+    assert snap.row(99)[0].tolist() == []
+
+
+def test_rebuild_then_top(app):
+    assert recommendations.rebuild(log=lambda msg: None) == {'order_lines': 11, 'pairs': 10}
+    rec = recommendations.get_recommender()
+    assert rec.top([1]) == [(2, 3), (3, 1), (4, 1)]
+    assert rec.top([1, 3], k=2) == [(2, 5), (4, 1)]  # summed over both, neither of them listed
+    assert rec.top([5]) == []
+
+
+def test_new_orders_go_to_the_overlay(app):
+    recommendations.rebuild(log=lambda msg: None)
+    rec = recommendations.get_recommender()
+    place([1, 4], [4, 5])
+    assert rec.catch_up() == 4
+    assert rec.overlay_pairs == 4
+    assert rec.top([1]) == [(2, 3), (4, 2), (3, 1)]
+    assert rec.catch_up() == 0  # nothing new past last_item_id
+
+
+def test_compaction_writes_a_generation_other_workers_load(app, monkeypatch):
+    monkeypatch.setattr(recommendations, 'COMPACT_AT', 3)
+    recommendations.rebuild(log=lambda msg: None)
+    worker, other = recommendations.Recommender(), recommendations.Recommender()
+    first = worker.snapshot.generation
+    place([1, 4], [4, 5])
+    worker.catch_up()
+    assert worker.snapshot.generation != first and worker.overlay == {}
+    assert worker.snapshot.last_item_id == worker.last_item_id == 15
+
+    assert other.catch_up() == 0  # the new generation already covers every line
+    assert other.snapshot.generation == worker.snapshot.generation
+    assert other.top([1]) == worker.top([1]) == [(2, 3), (4, 2), (3, 1)]
+    assert other.top([5]) == [(4, 1)]
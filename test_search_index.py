@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Typo-tolerant search (search_index.py) against a throwaway sqlite database.
+
+  python -m pytest -q test_search_index.py
+"""
+import threading
+
+import pytest
+
+import search_index
+from database_models import create_db_app, db, Product
+
+NAMES = ['Bluetooth Headphones', 'Wireless Mouse', 'Mechanical Keyboard', 'Bluetooth Speaker', 'USB-C Cable']
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_db_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "search.db"}'})
+    with app.app_context():
+        db.session.add_all(Product(name=name, price=1.0, stock=1) for name in NAMES)
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def searcher(app):
+    s = search_index.Searcher()
+    s._build(app)
+    return s
+
+
+def names(found):
+    return [db.session.get(Product, pid).name for pid in found['product_ids']]
+
+
+def test_typos_match_and_suggest(searcher):
+    found = searcher.search('bluetoth headphons')
+    assert names(found)[0] == 'Bluetooth Headphones'
+    assert found['did_you_mean'] == 'bluetooth headphones'
+
+
+def test_limit_is_at_least_one(searcher):
+    assert len(searcher.search('bluetooth', limit=-5)['product_ids']) == 1
+    assert len(searcher.search('bluetooth', limit=0)['product_ids']) == 1
+
+
+def test_writes_apply_before_a_rebuild(searcher):
+    mouse = Product.query.filter_by(name='Wireless Mouse').one()
+    searcher.update(mouse.id, 'Wireless Trackball')
+    assert searcher.search('mouse')['product_ids'] == []
+    assert searcher.search('trackball')['product_ids'] == [mouse.id]
+    searcher.update(mouse.id, None)
+    assert searcher.search('trackball')['product_ids'] == []
+    assert searcher.state.stale.sum() == 1
+
+
+def test_rebuild_folds_in_earlier_writes(app, searcher):
+    keyboard = Product.query.filter_by(name='Mechanical Keyboard').one()
+    keyboard.name = 'Mechanical Piano'
+    db.session.commit()
+    searcher.update(keyboard.id, keyboard.name)
+    searcher._build(app)
+    assert searcher.state.overrides == {} and not searcher.state.stale.any()
+    assert searcher.search('piano')['product_ids'] == [keyboard.id]
+
+
+def test_search_during_updates_sees_a_consistent_state(app, searcher):
+    ids = [p.id for p in Product.query.all()]
+    errors = []
+    done = threading.Event()
+
+    def write():
+        for i in range(300):
+            searcher.update(ids[i % len(ids)], f'Renamed {i}')
+        done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                searcher.search('renamed bluetooth', limit=3)
+        except Exception as e:  # a torn state shows up as IndexError here
+            errors.append(e)
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    index, overrides, stale = searcher.state
+    assert not stale.flags.writeable and len(overrides) == len(ids)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""In-memory static assets (static_assets.py) on a scratch site directory.
+
+  python -m pytest -q test_static_assets.py
+"""
+import pytest
+from flask import Flask
+
+import static_assets
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / 'scripts.js').write_text('console.log("hi");\n' * 50)
+    (tmp_path / 'index.html').write_text('<script src="scripts.js"></script>')
+    (tmp_path / 'uploads').mkdir()
+    (tmp_path / 'uploads' / 'a.jpg').write_bytes(b'\xff\xd8' + b'x' * 100)
+    store = static_assets.AssetStore(str(tmp_path))
+    store.preload()
+    return store
+
+
+def test_names_are_normalized_to_one_entry(site):
+    first = site.get('scripts.js')
+    assert site.get('./scripts.js') is first
+    assert site.get('uploads/../scripts.js') is first
+    assert set(site.assets) == {'index.html', 'scripts.js'}
+
+
+def test_subdirectories_and_escapes_are_not_cached(site):
+    for name in ('uploads/a.jpg', '../scripts.js', '/etc/passwd.js', '.hidden.js', 'missing.js'):
+        assert site.get(name) is None
+    assert set(site.assets) == {'index.html', 'scripts.js'}
+
+
+def test_page_references_fingerprinted_names(site):
+    js = site.get('scripts.js')
+    page = site.get('index.html')
+    assert js.fingerprinted_name.encode() in page.bodies['identity']
+    asset, immutable = site.resolve(js.fingerprinted_name)
+    assert asset is js and immutable
+    assert site.resolve('scripts.0123456789.js') == (js, False)  # outdated fingerprint: current content, short cache
+
+
+def test_respond_negotiates_encoding_and_etag(site):
+    app = Flask(__name__)
+    js = site.get('scripts.js')
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        resp = static_assets.respond(js, immutable=True)
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert 'immutable' in resp.headers['Cache-Control']
+        etag = resp.headers['ETag']
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}):
+        assert static_assets.respond(js).status_code == 304
@@ -0,0 +1,98 @@
+"""Content-addressed storage for uploaded images.
+
+Uploads are written under their SHA-256, sharded two levels deep
+(uploads/ab/cd/abcd...ef.jpg), so identical bytes are stored once and two
+files that share a name can no longer overwrite each other. Blobs are
+recorded in `upload_blobs`; `product_images` maps products to the blobs
+they use. Because a blob URL can never change content, it is served as
+immutable with a strong ETag. gc_uploads.py removes blobs nothing refers to.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from werkzeug.utils import secure_filename
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+ALLOWED_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif')
+BLOB_URL_RE = re.compile(r'^/uploads/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[a-z0-9]+)$')
+# blob files and their variants (uploads/variants/<hash>-<preset>.<fmt>)
+IMMUTABLE_RE = re.compile(r'^(?:[0-9a-f]{2}/[0-9a-f]{2}/|variants/)([0-9a-f]{64}(?:-[a-z]+)?\.[a-z0-9]+)$')
+_CHUNK = 1 << 16
+
+
+def blob_path(digest, ext):
+    """Path of a blob relative to UPLOAD_FOLDER."""
+    return os.path.join(digest[:2], digest[2:4], digest + ext)
+
+
+def blob_url(digest, ext):
+    return f'/uploads/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def parse_blob_url(url):
+    """(hash, ext) for a blob URL, else None."""
+    m = BLOB_URL_RE.match(url or '')
+    return (m.group(3), m.group(4)) if m else None
+
+
+def save(stream, filename, upload_folder):
+    """Hash `stream` while writing it to a temp file, then move it into place.
+    Returns (hash, ext, size, is_new); is_new is False when the same bytes were already stored.
+    """
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    if ext not in ALLOWED_EXT:
+        raise ValueError(f'unsupported file type {ext or "(none)"}')
+    os.makedirs(upload_folder, exist_ok=True)
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=upload_folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = sha.hexdigest()
+        dest = os.path.join(upload_folder, blob_path(digest, ext))
+        if os.path.exists(dest):
+            os.remove(tmp)
+            return digest, ext, size, False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp, dest)
+        return digest, ext, size, True
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def link_product(product, replace=False):
+    """Record that `product` uses the blob in its image_url (no-op for other URLs).
+    With `replace` (its image_url changed), links to other blobs are dropped so
+    gc_uploads.py can collect them. Needs an app context; the caller commits.
+    """
+    from database_models import db, ProductImage, UploadBlob
+    if product.id is None:
+        return
+    parsed = parse_blob_url(product.image_url)
+    digest = parsed[0] if parsed and UploadBlob.query.get(parsed[0]) is not None else None
+    if replace:
+        stale = ProductImage.query.filter(ProductImage.product_id == product.id)
+        if digest is not None:
+            stale = stale.filter(ProductImage.blob_hash != digest)
+        stale.delete(synchronize_session=False)
+    if digest is None:
+        return
+    if not ProductImage.query.filter_by(product_id=product.id, blob_hash=digest).first():
+        db.session.add(ProductImage(product_id=product.id, blob_hash=digest))
+
+
+def immutable_etag(filename):
+    """Strong ETag for an immutable upload path, or None for legacy uploads."""
+    m = IMMUTABLE_RE.match(filename)
+    return m.group(1) if m else None